@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Pool de hilos compartido para el trabajo de CPU (encoder y FAISS) de las
+# búsquedas asíncronas, para no bloquear el event loop.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers=4):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retriever")
+        return _executor
+
+
+class AsyncRetriever:
+    """
+    Envoltorio asíncrono de un Retriever.
+
+    Las búsquedas que llegan casi a la vez (dentro de `max_wait` segundos) se
+    agrupan en una sola llamada a `Retriever.search_batch`, que se ejecuta en el
+    pool de hilos: con muchas sesiones concurrentes el encoder trabaja por lotes
+    en lugar de pregunta a pregunta.
+    """
+
+    def __init__(self, retriever, executor=None, max_batch_size=32, max_wait=0.005):
+        self.retriever = retriever
+        self.executor = executor or get_executor()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = {}
+
+    async def search_hits(self, query, top_k=5, **kwargs):
+        """
+        Args:
+            query (str): La pregunta.
+            top_k (int): Número de casos a recuperar.
+            **kwargs: Opciones de `search_batch` (passages, hybrid, rerank...).
+
+        Returns:
+            list: Los SearchHit de la pregunta.
+        """
+        loop = asyncio.get_running_loop()
+        # Las opciones pueden llevar diccionarios (p. ej. `filters`): la clave se
+        # construye con su JSON y las opciones originales viajan con el lote.
+        key = (top_k, json.dumps(kwargs, sort_keys=True, default=str))
+        future = loop.create_future()
+        _, batch = self._pending.setdefault(key, (kwargs, []))
+        batch.append((query, future))
+        if len(batch) == 1:
+            loop.call_later(self.max_wait, self._flush, key)
+        elif len(batch) >= self.max_batch_size:
+            self._flush(key)
+        return await future
+
+    async def search(self, query, top_k=5, **kwargs):
+        return [hit.text for hit in await self.search_hits(query, top_k=top_k, **kwargs)]
+
+    def _flush(self, key):
+        options, batch = self._pending.pop(key, (None, None))
+        if not batch:
+            return
+        top_k = key[0]
+        queries = [query for query, _ in batch]
+        futures = [future for _, future in batch]
+        task = asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(self.retriever.search_batch, queries, top_k=top_k, **options)
+        )
+
+        def _deliver(task):
+            if task.exception() is not None:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(task.exception())
+                return
+            for future, hits in zip(futures, task.result()):
+                if not future.done():
+                    future.set_result(hits)
+
+        task.add_done_callback(_deliver)
+
+
+_async_retrievers = {}
+
+
+def get_async_retriever(retriever):
+    """
+    Devuelve el AsyncRetriever compartido de un Retriever (uno por instancia).
+    """
+    if id(retriever) not in _async_retrievers:
+        _async_retrievers[id(retriever)] = AsyncRetriever(retriever)
+    return _async_retrievers[id(retriever)]
@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from async_retriever import get_executor
+from context_packer import DEFAULT_CONTEXT_TOKENS
+from llm_client import get_llm_client
+from rag_chatbot import build_rag_prompt
+from tracing import span
+
+# Modo por lotes del pipeline RAG para conjuntos de regresión: lee las preguntas
+# de un JSONL, recupera el contexto por lotes (una llamada a `search_batch` por
+# lote) y genera las respuestas con concurrencia acotada. Cada respuesta se
+# escribe en el JSONL de salida en cuanto termina, y ese archivo hace de punto de
+# control: si la ejecución se interrumpe, al relanzarla se saltan las preguntas
+# ya respondidas.
+
+
+def read_questions(path):
+    """
+    Lee las preguntas de un archivo JSON lines: un objeto por línea con
+    "question" y, opcionalmente, "id" (por defecto, el número de línea).
+
+    Returns:
+        list: Diccionarios {"id", "question"}.
+    """
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "question" not in item:
+                raise ValueError(f"{path}:{line_number}: falta el campo 'question'.")
+            records.append({"id": item.get("id", line_number), "question": item["question"]})
+    return records
+
+
+def load_checkpoint(output_path):
+    """
+    Lee las respuestas ya escritas en `output_path`. Las líneas con error (esas
+    preguntas se vuelven a intentar) y una última línea a medias (la ejecución se
+    cortó mientras se escribía) se eliminan del archivo, así cada id aparece una
+    sola vez en la salida.
+
+    Returns:
+        set: Ids (como texto) de las preguntas respondidas sin error.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    done, valid_lines, dropped = set(), [], False
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                dropped = True
+                continue
+            if result.get("error") is not None or str(result["id"]) in done:
+                dropped = True
+                continue
+            valid_lines.append(line if line.endswith("\n") else line + "\n")
+            done.add(str(result["id"]))
+    if dropped:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.writelines(valid_lines)
+    return done
+
+
+def _retrieve_batch(retriever, questions, top_k, rerank, context_tokens):
+    # Se ejecuta en el pool de hilos: búsqueda por lotes y empaquetado del contexto.
+    start = time.perf_counter()
+    with span("retrieve", queries=len(questions)):
+        hits = retriever.search_batch(questions, top_k=top_k, rerank=rerank)
+    retrieve_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    packed = [retriever.pack_context(h, max_tokens=context_tokens) for h in hits]
+    return packed, retrieve_seconds, time.perf_counter() - start
+
+
+async def answer_questions(records, retriever, agenerate_fn, output_file, concurrency=8, batch_size=32,
+                           top_k=5, rerank=False, context_tokens=DEFAULT_CONTEXT_TOKENS):
+    """
+    Responde `records` con como mucho `concurrency` llamadas al LLM a la vez,
+    escribiendo cada resultado en `output_file` en cuanto termina.
+
+    La recuperación va por delante de la generación: mientras el LLM responde un
+    lote, el pool de hilos ya busca el siguiente.
+
+    Args:
+        records (list): Diccionarios {"id", "question"}.
+        retriever (Retriever): El retriever a usar.
+        agenerate_fn (callable): Corrutina prompt -> respuesta.
+        output_file: Archivo abierto (texto) donde se escriben los resultados.
+        concurrency (int): Llamadas simultáneas al LLM.
+        batch_size (int): Preguntas por llamada a `search_batch`.
+        top_k (int): Casos a recuperar por pregunta.
+        rerank (bool): Reordenar los candidatos con el cross-encoder.
+        context_tokens (int): Presupuesto de tokens del contexto.
+
+    Returns:
+        dict: Preguntas, errores, segundos, preguntas/s, latencia total p50/p99
+            (ms) y media de cada etapa (ms).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max(batch_size, 2 * concurrency))
+    results = []
+
+    async def produce():
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i + batch_size]
+            packed, retrieve_seconds, pack_seconds = await loop.run_in_executor(
+                get_executor(), _retrieve_batch, retriever, [r["question"] for r in batch],
+                top_k, rerank, context_tokens
+            )
+            for record, context in zip(batch, packed):
+                # El tiempo de un lote se reparte entre sus preguntas.
+                timings = {"retrieve_ms": 1000 * retrieve_seconds / len(batch),
+                           "pack_context_ms": 1000 * pack_seconds / len(batch)}
+                await queue.put((record, context, timings))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def generate():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            record, packed, timings = item
+            start = time.perf_counter()
+            prompt = build_rag_prompt(record["question"], packed.text)
+            timings["format_prompt_ms"] = 1000 * (time.perf_counter() - start)
+            start = time.perf_counter()
+            answer, error = None, None
+            try:
+                with span("llm"):
+                    answer = await agenerate_fn(prompt)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            timings["llm_ms"] = 1000 * (time.perf_counter() - start)
+            timings["total_ms"] = sum(timings.values())
+            result = {"id": record["id"], "question": record["question"], "answer": answer,
+                      "case_ids": packed.case_ids, "timings": timings, "error": error}
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()
+            results.append(result)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(produce(), *(generate() for _ in range(concurrency)))
+    finally:
+        # Cada nivel de concurrencia corre en su propio event loop (`asyncio.run`):
+        # el AsyncClient del cliente compartido para este loop se cierra aquí.
+        await get_llm_client().aclose()
+    seconds = time.perf_counter() - start
+
+    totals = [r["timings"]["total_ms"] for r in results]
+    stages = ("retrieve_ms", "pack_context_ms", "format_prompt_ms", "llm_ms")
+    return {
+        "concurrency": concurrency,
+        "questions": len(results),
+        "errors": sum(r["error"] is not None for r in results),
+        "seconds": seconds,
+        "questions_per_second": len(results) / seconds if seconds else 0.0,
+        "p50_ms": float(np.percentile(totals, 50)) if totals else 0.0,
+        "p99_ms": float(np.percentile(totals, 99)) if totals else 0.0,
+        "stages_ms": {stage: float(np.mean([r["timings"][stage] for r in results])) if results else 0.0
+                      for stage in stages},
+    }
+
+
+def run_batch(input_path, output_path, retriever, agenerate_fn, concurrency_levels=(8,), restart=False, **kwargs):
+    """
+    Responde todas las preguntas de `input_path` que aún no estén en `output_path`.
+
+    Con varios niveles de concurrencia, las preguntas pendientes se reparten en
+    tramos consecutivos, uno por nivel, y se mide el throughput de cada tramo:
+    cada pregunta se responde una sola vez.
+
+    Args:
+        input_path (str): JSONL de preguntas.
+        output_path (str): JSONL de respuestas (y punto de control).
+        retriever (Retriever): El retriever a usar.
+        agenerate_fn (callable): Corrutina prompt -> respuesta.
+        concurrency_levels (tuple): Niveles de concurrencia a usar (y medir).
+        restart (bool): Ignorar las respuestas ya escritas y empezar de cero.
+        **kwargs: Opciones de `answer_questions` (batch_size, top_k, rerank, context_tokens).
+
+    Returns:
+        tuple: (resultados por nivel, preguntas ya respondidas antes de empezar).
+    """
+    records = read_questions(input_path)
+    if restart and os.path.exists(output_path):
+        os.remove(output_path)
+    done = load_checkpoint(output_path)
+    pending = [r for r in records if str(r["id"]) not in done]
+
+    reports = []
+    segment = -(-len(pending) // len(concurrency_levels)) if pending else 0
+    with open(output_path, "a", encoding="utf-8") as output_file:
+        for i, concurrency in enumerate(concurrency_levels):
+            chunk = pending[i * segment:(i + 1) * segment]
+            if not chunk:
+                continue
+            reports.append(asyncio.run(answer_questions(chunk, retriever, agenerate_fn, output_file,
+                                                        concurrency=concurrency, **kwargs)))
+    return reports, len(records) - len(pending)
+
+
+def print_batch_report(reports, skipped):
+    if skipped:
+        print(f"{skipped} preguntas ya estaban respondidas (punto de control).")
+    if not reports:
+        print("No hay preguntas pendientes.")
+        return
+    print("\n========= RESPUESTAS POR LOTES: throughput por nivel de concurrencia =========")
+    print(f"{'concurrencia':>13}{'preguntas':>11}{'errores':>9}{'segundos':>10}{'preg/s':>9}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for r in reports:
+        print(f"{r['concurrency']:>13}{r['questions']:>11}{r['errors']:>9}{r['seconds']:>10.1f}"
+              f"{r['questions_per_second']:>9.2f}{r['p50_ms']:>10.0f}{r['p99_ms']:>10.0f}")
+    print("\n--- Etapas (media por pregunta, ms) ---")
+    for stage in reports[0]["stages_ms"]:
+        values = "".join(f"{r['stages_ms'][stage]:>10.1f}" for r in reports)
+        print(f"{stage.replace('_ms', ''):<15}{values}")
+
+
+if __name__ == "__main__":
+    from retriever_registry import get_retriever
+
+    parser = argparse.ArgumentParser(description="Responde por lotes las preguntas de un archivo JSONL.")
+    parser.add_argument("--input", required=True, help='JSONL con {"id": ..., "question": ...} por línea.')
+    parser.add_argument("--output", default="respuestas.jsonl",
+                        help="JSONL de respuestas; también es el punto de control para reanudar.")
+    parser.add_argument("--index-path", default="../models/patient_cases.index")
+    parser.add_argument("--cases-path", default="../models/patient_cases.db")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank", action="store_true")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS)
+    parser.add_argument("--batch-size", type=int, default=32, help="Preguntas por búsqueda por lotes.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8],
+                        help="Llamadas simultáneas al LLM. Con varios valores, las preguntas se reparten "
+                             "en tramos y se mide el throughput de cada nivel.")
+    parser.add_argument("--restart", action="store_true", help="Ignora las respuestas ya escritas.")
+    parser.add_argument("--stub-llm", action="store_true", help="Usa un LLM local simulado en lugar de Gemini.")
+    parser.add_argument("--stub-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.stub_llm:
+        from stub_llm import StubLLM
+
+        agenerate_fn = StubLLM(latency=args.stub_latency).agenerate
+    else:
+        from llm_generator import agenerate_test_answer, configure_llm
+
+        configure_llm()
+        agenerate_fn = agenerate_test_answer
+
+    retriever = get_retriever(args.index_path, args.cases_path, args.model_name)
+    try:
+        reports, skipped = run_batch(
+            args.input, args.output, retriever, agenerate_fn, concurrency_levels=args.concurrency,
+            restart=args.restart, batch_size=args.batch_size, top_k=args.top_k, rerank=args.rerank,
+            context_tokens=args.context_tokens
+        )
+    except KeyboardInterrupt:
+        print(f"\nInterrumpido. Las respuestas terminadas están en {args.output}; "
+              f"vuelve a ejecutar el mismo comando para continuar.")
+    else:
+        print_batch_report(reports, skipped)
+        print(f"\nRespuestas en {args.output}")
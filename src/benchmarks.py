@@ -0,0 +1,1156 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from index_factory import create_index, set_search_params, index_memory_bytes
+from retriever import Retriever
+from synthetic_cases import SAMPLE_QUERIES
+from tracing import percentile_ms
+
+
+# Las preguntas de ejemplo (ver synthetic_cases.py) se repiten cíclicamente hasta
+# alcanzar el número de consultas pedido.
+def make_queries(n):
+    """
+    Genera una lista de n preguntas a partir de SAMPLE_QUERIES.
+    """
+    return [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] for i in range(n)]
+
+
+def bench_batch_search(retriever, queries, top_k=5, batch_size=32):
+    """
+    Compara el throughput de `search` en un bucle contra `search_batch`.
+
+    Args:
+        retriever (Retriever): El retriever a medir.
+        queries (list): Las preguntas a buscar.
+        top_k (int): Número de casos por pregunta.
+        batch_size (int): Tamaño de lote del encoder para `search_batch`.
+
+    Returns:
+        dict: Tiempos totales y consultas por segundo de cada modo.
+    """
+    # Calentamos el modelo para no medir la primera inicialización.
+    retriever.search(queries[0], top_k=top_k)
+
+    start = time.perf_counter()
+    for query in queries:
+        retriever.search(query, top_k=top_k)
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retriever.search_batch(queries, top_k=top_k, batch_size=batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "queries": len(queries),
+        "loop_seconds": loop_seconds,
+        "batch_seconds": batch_seconds,
+        "loop_qps": len(queries) / loop_seconds,
+        "batch_qps": len(queries) / batch_seconds,
+        "speedup": loop_seconds / batch_seconds,
+    }
+
+
+def bench_query_cache(retriever, queries, top_k=5):
+    """
+    Mide el tiempo de `search` con la caché de embeddings fría y luego caliente.
+    """
+    retriever.query_cache.clear()
+    start = time.perf_counter()
+    for query in queries:
+        retriever.search(query, top_k=top_k)
+    cold_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        retriever.search(query, top_k=top_k)
+    warm_seconds = time.perf_counter() - start
+
+    return {
+        "queries": len(queries),
+        "cold_seconds": cold_seconds,
+        "warm_seconds": warm_seconds,
+        "cache": retriever.query_cache.stats(),
+    }
+
+
+def synthetic_vectors(num_vectors, dim, num_clusters=100, seed=0):
+    """
+    Genera vectores float32 agrupados en clusters, parecidos a embeddings reales
+    (que no están distribuidos de forma uniforme en el espacio).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dim)).astype('float32')
+    labels = rng.integers(0, num_clusters, size=num_vectors)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((num_vectors, dim)).astype('float32')
+    return vectors.astype('float32')
+
+
+def bench_index_types(vectors, queries, index_specs, top_k=10, nprobe=None, ef_search=None):
+    """
+    Compara tipos de índice FAISS contra la búsqueda exacta (Flat).
+
+    Para cada tipo de índice mide el tiempo de construcción, recall@k respecto a
+    Flat, la latencia p50/p99 de una consulta y el tamaño del índice.
+
+    Args:
+        vectors (np.ndarray): Los vectores del corpus.
+        queries (np.ndarray): Los vectores de consulta.
+        index_specs (list): Cadenas de `faiss.index_factory` a comparar.
+        top_k (int): k de recall@k.
+        nprobe (int): nprobe para los índices IVF.
+        ef_search (int): efSearch para los índices HNSW.
+
+    Returns:
+        list: Un dict de resultados por tipo de índice.
+    """
+    ids = np.arange(len(vectors), dtype='int64')
+    results = []
+    ground_truth = None
+    for spec in ["Flat"] + [spec for spec in index_specs if spec != "Flat"]:
+        start = time.perf_counter()
+        index = create_index(spec, vectors.shape[1])
+        if not index.is_trained:
+            index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        build_seconds = time.perf_counter() - start
+        set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+
+        latencies = []
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            _, indices = index.search(query.reshape(1, -1), top_k)
+            latencies.append(time.perf_counter() - start)
+            found.append(indices[0])
+        found = np.array(found)
+        if ground_truth is None:
+            ground_truth = found
+        recall = np.mean([
+            len(set(row) & set(truth)) / top_k for row, truth in zip(found, ground_truth)
+        ])
+
+        results.append({
+            "index_spec": spec,
+            "build_seconds": build_seconds,
+            f"recall@{top_k}": float(recall),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+            "memory_mb": index_memory_bytes(index) / 1e6,
+        })
+    return results
+
+
+def bench_hybrid(retriever, queries, top_k=5):
+    """
+    Mide la latencia por consulta de la búsqueda densa contra la híbrida (densa + BM25).
+    Los embeddings salen de la caché para medir solo la búsqueda y la fusión.
+    """
+    retriever.search_batch(queries, top_k=top_k)  # llena la caché de embeddings
+    result = {}
+    for mode, hybrid in (("dense", False), ("hybrid", True)):
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            retriever.search_batch([query], top_k=top_k, hybrid=hybrid)
+            latencies.append(time.perf_counter() - start)
+        result[mode] = {"p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+    return result
+
+
+def bench_history(num_turns=120, history_manager=None):
+    """
+    Conversa `num_turns` turnos seguidos con el grafo de chat_pipeline_rag y un LLM
+    simulado, y mide el tamaño del prompt y la latencia de cada turno.
+
+    Args:
+        num_turns (int): Turnos de la conversación.
+        history_manager (HistoryManager): Límites del historial a probar.
+
+    Returns:
+        dict: "prompt_tokens" (palabras del prompt por turno) y "latencies" (s).
+    """
+    from langchain_core.messages import HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from chat_pipeline_rag import build_app, build_rag_chain
+    from stub_llm import StubChatModel, STUB_ANSWER
+
+    # Respuestas largas, como las de un LLM real, para que el historial crezca.
+    model = StubChatModel(latency=0.0, answer=" ".join([STUB_ANSWER] * 4))
+    app = build_app(chain=build_rag_chain(model), checkpointer=MemorySaver(), history_manager=history_manager)
+    config = {"configurable": {"thread_id": "benchmark-historial"}}
+    latencies = []
+    for turn in range(num_turns):
+        start = time.perf_counter()
+        app.invoke({"messages": [HumanMessage(content=SAMPLE_QUERIES[turn % len(SAMPLE_QUERIES)])]}, config=config)
+        latencies.append(time.perf_counter() - start)
+    return {"prompt_tokens": list(model.prompt_tokens), "latencies": latencies}
+
+
+def current_rss_mb():
+    """
+    Memoria residente (RSS) actual del proceso, en MB.
+    Fuera de Linux se devuelve el máximo alcanzado (getrusage).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_checkpointer(checkpointer, num_sessions=2000, turns=3):
+    """
+    Simula `num_sessions` conversaciones intercaladas (un turno de cada sesión por
+    ronda) con el grafo de chat_pipeline_rag y un LLM simulado sin latencia, para
+    medir solo el coste del checkpointer.
+
+    Returns:
+        dict: Latencia por turno p50/p99 (ms), turnos/s y RSS antes y después (MB).
+    """
+    from langchain_core.messages import HumanMessage
+
+    from chat_pipeline_rag import build_app, build_rag_chain
+    from history import HistoryManager
+    from stub_llm import StubChatModel
+
+    app = build_app(chain=build_rag_chain(StubChatModel(latency=0.0)), checkpointer=checkpointer,
+                    history_manager=HistoryManager())
+    # Un turno previo para cargar el Retriever antes de medir.
+    app.invoke({"messages": [HumanMessage(content=SAMPLE_QUERIES[0])]},
+               config={"configurable": {"thread_id": "calentamiento"}})
+    rss_before = current_rss_mb()
+    latencies = []
+    start = time.perf_counter()
+    for turn in range(turns):
+        for session in range(num_sessions):
+            config = {"configurable": {"thread_id": f"sesion-{session}"}}
+            question = SAMPLE_QUERIES[(session + turn) % len(SAMPLE_QUERIES)]
+            t0 = time.perf_counter()
+            app.invoke({"messages": [HumanMessage(content=question)]}, config=config)
+            latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    return {
+        "turns": len(latencies),
+        "turns_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "rss_before_mb": rss_before,
+        "rss_after_mb": current_rss_mb(),
+    }
+
+
+class ReplayEncoder:
+    """
+    Encoder para construir índices de millones de casos sin codificarlos todos:
+    devuelve los embeddings reales de una muestra, repetidos con algo de ruido.
+    Mide todo lo demás de la construcción (almacén, FAISS, BM25, manifest).
+    """
+
+    def __init__(self, model, sample_embeddings, seed=0):
+        self.tokenizer = getattr(model, "tokenizer", None)
+        self.sample = np.asarray(sample_embeddings, dtype='float32')
+        self.rng = np.random.default_rng(seed)
+
+    def get_sentence_embedding_dimension(self):
+        return self.sample.shape[1]
+
+    def encode(self, texts, **kwargs):
+        rows = self.sample[np.arange(len(texts)) % len(self.sample)]
+        return rows + 0.01 * self.rng.standard_normal(rows.shape).astype('float32')
+
+
+def timed(fn, *args, quiet=True, **kwargs):
+    """
+    Ejecuta fn(*args, **kwargs) y devuelve (resultado, segundos). Con `quiet`, se
+    descarta lo que imprima.
+    """
+    output = io.StringIO() if quiet else sys.stdout
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_scale(num_cases, model, workdir, model_name, index_spec="Flat", encode_sample=2000,
+                max_docx_cases=20000, num_queries=200, num_e2e=50, stub_latency=0.0, seed=0):
+    """
+    Mide todas las etapas del sistema con `num_cases` casos sintéticos
+    (ver synthetic_cases.py).
+
+    Etapas: extracción del .docx, segmentación, codificación, construcción del
+    índice, búsqueda (p50/p99, con codificación de la pregunta), memoria y
+    `run_rag_pipeline` completo con un LLM simulado.
+
+    La extracción se mide con como mucho `max_docx_cases` casos (escribir un .docx
+    enorme con python-docx es muy lento) y la codificación con `encode_sample`
+    casos; si hay más casos, el índice se construye con `ReplayEncoder` y el
+    tiempo de codificar todo se estima con el throughput medido.
+
+    Returns:
+        dict: Resultados por etapa.
+    """
+    from data_extractor import extract_text_from_docx
+    from data_processor import build_index, embedding_encode, segment_cases
+    from rag_chatbot import run_rag_pipeline
+    from stub_llm import StubLLM
+    from synthetic_cases import cases_to_text, generate_cases, write_docx
+
+    cases = generate_cases(num_cases, seed=seed)
+    text = cases_to_text(cases)
+    result = {"cases": num_cases, "text_mb": len(text.encode("utf-8")) / 1024 ** 2}
+
+    docx_cases = cases[:max_docx_cases]
+    docx_path = os.path.join(workdir, "casos.docx")
+    write_docx(docx_cases, docx_path)
+    _, seconds = timed(extract_text_from_docx, docx_path)
+    result["extraction"] = {"cases": len(docx_cases), "seconds": seconds,
+                            "cases_per_second": len(docx_cases) / seconds}
+    os.remove(docx_path)
+
+    segmented, seconds = timed(segment_cases, text)
+    if len(segmented) != num_cases:
+        raise RuntimeError(f"segment_cases devolvió {len(segmented)} casos de {num_cases}.")
+    result["segmentation"] = {"seconds": seconds, "cases_per_second": num_cases / seconds}
+    del text
+
+    sample = segmented[:encode_sample]
+    sample_embeddings, seconds = timed(embedding_encode, sample, model)
+    encode_rate = len(sample) / seconds
+    result["encoding"] = {"cases": len(sample), "seconds": seconds, "cases_per_second": encode_rate,
+                          "estimated_full_seconds": num_cases / encode_rate}
+
+    encoder = model if num_cases <= encode_sample else ReplayEncoder(model, sample_embeddings, seed=seed)
+    index_path = os.path.join(workdir, "casos.index")
+    cases_path = os.path.join(workdir, "casos.db")
+    _, seconds = timed(build_index, segmented, encoder, index_path, cases_path,
+                       model_name=model_name, index_spec=index_spec)
+    result["build"] = {"seconds": seconds, "all_encoded": encoder is model,
+                       "index_file_mb": os.path.getsize(index_path) / 1024 ** 2,
+                       "store_file_mb": os.path.getsize(cases_path) / 1024 ** 2}
+    del segmented, cases
+
+    # Sin caché de embeddings: cada búsqueda incluye codificar la pregunta.
+    retriever, _ = timed(Retriever, index_path, cases_path, model_name, model=model, cache_size=0)
+    queries = make_queries(num_queries)
+    retriever.search_batch(queries[:1])
+    latencies = []
+    for query in queries:
+        _, seconds = timed(retriever.search_batch, [query], top_k=5)
+        latencies.append(seconds)
+    result["search"] = {"queries": len(queries), "p50_ms": percentile_ms(latencies, 50),
+                        "p99_ms": percentile_ms(latencies, 99), "qps": len(latencies) / sum(latencies)}
+    result["memory"] = {"rss_mb": current_rss_mb(), "index_mb": index_memory_bytes(retriever.index) / 1024 ** 2}
+
+    llm = StubLLM(latency=stub_latency)
+    latencies = []
+    for query in queries[:num_e2e]:
+        _, seconds = timed(run_rag_pipeline, query, retriever, top_k=5, generate_fn=llm.generate)
+        latencies.append(seconds)
+    result["end_to_end"] = {"questions": len(latencies), "stub_latency_s": stub_latency,
+                            "p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+    retriever.store.close()
+    return result
+
+
+# Métricas que se comparan entre ejecuciones: (etapa, métrica, True si mayor es mejor).
+REGRESSION_METRICS = [
+    ("extraction", "cases_per_second", True),
+    ("segmentation", "cases_per_second", True),
+    ("encoding", "cases_per_second", True),
+    ("build", "seconds", False),
+    ("search", "p50_ms", False),
+    ("search", "p99_ms", False),
+    ("memory", "rss_mb", False),
+    ("end_to_end", "p50_ms", False),
+]
+
+
+def compare_results(previous, current, tolerance=0.10):
+    """
+    Compara dos archivos de resultados de `suite` por número de casos.
+
+    Returns:
+        list: (casos, etapa, métrica, antes, ahora, cambio relativo, es_regresión).
+    """
+    previous_by_size = {r["cases"]: r for r in previous["results"]}
+    rows = []
+    for r in current["results"]:
+        old = previous_by_size.get(r["cases"])
+        if old is None:
+            continue
+        for stage, metric, higher_is_better in REGRESSION_METRICS:
+            before, after = old[stage][metric], r[stage][metric]
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            rows.append((r["cases"], stage, metric, before, after, change, worse > tolerance))
+    return rows
+
+
+def git_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return output.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def time_in_subprocess(code):
+    """
+    Ejecuta `code` en un proceso Python nuevo y devuelve los segundos que tardó.
+    Un proceso nuevo es la única forma de medir imports en frío.
+    """
+    script = "import time, json\n_t0 = time.perf_counter()\n" + code + \
+        "\nprint(json.dumps(time.perf_counter() - _t0))"
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, "-c", script], cwd=src_dir,
+                            capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def bench_cold_start(index_path, cases_path, model_name):
+    """
+    Compara el arranque con carga anticipada (un Retriever por módulo al importar,
+    como antes) contra el registro perezoso.
+
+    Returns:
+        dict: Segundos de cada escenario.
+    """
+    paths = f"{os.path.abspath(index_path)!r}, {os.path.abspath(cases_path)!r}, {model_name!r}"
+    return {
+        "import_registro": time_in_subprocess("import retriever_registry"),
+        "retriever_anticipado": time_in_subprocess(
+            f"from retriever import Retriever\nRetriever({paths})"),
+        "dos_retrievers_anticipados": time_in_subprocess(
+            f"from retriever import Retriever\nRetriever({paths})\nRetriever({paths})"),
+        "registro_primera_busqueda": time_in_subprocess(
+            f"from retriever_registry import get_retriever\nget_retriever({paths}).search('ansiedad')"),
+        "registro_dos_puntos_de_entrada": time_in_subprocess(
+            f"from retriever_registry import get_retriever\nget_retriever({paths}).search('ansiedad')\n"
+            f"get_retriever({paths}).search('ansiedad')"),
+    }
+
+
+def load_retriever(args, **kwargs):
+    return Retriever(
+        index_path=args.index_path,
+        cases_path=args.cases_path,
+        model_name=args.model_name,
+        **kwargs
+    )
+
+
+def run_batch_search(args):
+    # Sin caché de embeddings: queremos medir el encoder, no la caché.
+    retriever = load_retriever(args, cache_size=0)
+    queries = make_queries(args.num_queries)
+    result = bench_batch_search(retriever, queries, top_k=args.top_k, batch_size=args.batch_size)
+
+    print("\n========= BENCHMARK: search vs search_batch =========")
+    print(f"Consultas:            {result['queries']}")
+    print(f"search (bucle):       {result['loop_seconds']:.3f} s  ({result['loop_qps']:.1f} consultas/s)")
+    print(f"search_batch:         {result['batch_seconds']:.3f} s  ({result['batch_qps']:.1f} consultas/s)")
+    print(f"Mejora:               x{result['speedup']:.2f}")
+
+
+def run_query_cache(args):
+    retriever = load_retriever(args)
+    result = bench_query_cache(retriever, make_queries(args.num_queries), top_k=args.top_k)
+
+    print("\n========= BENCHMARK: caché de embeddings =========")
+    print(f"Consultas:            {result['queries']}")
+    print(f"Caché fría:           {result['cold_seconds']:.3f} s")
+    print(f"Caché caliente:       {result['warm_seconds']:.3f} s")
+    print(f"Estadísticas:         {result['cache']}")
+
+
+def run_index_types(args):
+    vectors = synthetic_vectors(args.num_vectors, args.dim)
+    queries = synthetic_vectors(args.num_queries, args.dim, seed=1)
+    results = bench_index_types(
+        vectors, queries, args.index_specs, top_k=args.top_k,
+        nprobe=args.nprobe, ef_search=args.ef_search
+    )
+
+    print(f"\n========= BENCHMARK: tipos de índice ({args.num_vectors} vectores, dim {args.dim}) =========")
+    print(f"{'índice':<16}{'build (s)':>10}{'recall@' + str(args.top_k):>11}{'p50 (ms)':>10}{'p99 (ms)':>10}{'MB':>9}")
+    for r in results:
+        print(f"{r['index_spec']:<16}{r['build_seconds']:>10.2f}{r[f'recall@{args.top_k}']:>11.3f}"
+              f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['memory_mb']:>9.1f}")
+
+
+def run_hybrid(args):
+    retriever = load_retriever(args)
+    result = bench_hybrid(retriever, make_queries(args.num_queries), top_k=args.top_k)
+
+    print("\n========= BENCHMARK: búsqueda densa vs híbrida =========")
+    for mode, r in result.items():
+        print(f"{mode:<8} p50 {r['p50_ms']:.3f} ms   p99 {r['p99_ms']:.3f} ms")
+
+
+def run_cold_start(args):
+    result = bench_cold_start(args.index_path, args.cases_path, args.model_name)
+
+    print("\n========= BENCHMARK: arranque en frío =========")
+    print(f"Importar retriever_registry (nada pesado):      {result['import_registro']:.2f} s")
+    print(f"Retriever anticipado (como al importar antes):  {result['retriever_anticipado']:.2f} s")
+    print(f"Dos Retrievers anticipados (dos módulos):       {result['dos_retrievers_anticipados']:.2f} s")
+    print(f"Registro: carga + primera búsqueda:             {result['registro_primera_busqueda']:.2f} s")
+    print(f"Registro: dos puntos de entrada:                {result['registro_dos_puntos_de_entrada']:.2f} s")
+
+
+def run_history(args):
+    import chat_pipeline_rag
+    from history import HistoryManager
+
+    # El grafo busca en las rutas de chat_pipeline_rag; aquí se usan las del benchmark.
+    chat_pipeline_rag.INDEX_PATH = args.index_path
+    chat_pipeline_rag.CASES_PATH = args.cases_path
+    chat_pipeline_rag.MODEL_NAME = args.model_name
+
+    managers = {
+        "completo": HistoryManager(max_turns=10 ** 9, window_tokens=10 ** 9),
+        "acotado": HistoryManager(max_turns=args.max_turns, window_tokens=args.window_tokens,
+                                  summary_tokens=args.summary_tokens),
+    }
+    results = {name: bench_history(args.turns, manager) for name, manager in managers.items()}
+
+    print(f"\n========= BENCHMARK: historial en {args.turns} turnos (palabras del prompt) =========")
+    checkpoints = sorted({1, 10, 25, 50, 100, args.turns} & set(range(1, args.turns + 1)))
+    print(f"{'turno':>6}" + "".join(f"{name:>12}" for name in results))
+    for turn in checkpoints:
+        print(f"{turn:>6}" + "".join(f"{r['prompt_tokens'][turn - 1]:>12}" for r in results.values()))
+    for name, r in results.items():
+        tail = r["prompt_tokens"][len(r["prompt_tokens"]) // 5:]
+        print(f"{name}: prompt mín/máx desde el turno {args.turns // 5 + 1}: {min(tail)}/{max(tail)} palabras | "
+              f"latencia p50 {percentile_ms(r['latencies'], 50):.1f} ms, p99 {percentile_ms(r['latencies'], 99):.1f} ms")
+
+
+def run_tracing(args):
+    import tracing
+    from rag_chatbot import run_rag_pipeline
+    from stub_llm import StubLLM
+
+    retriever = Retriever(args.index_path, args.cases_path, args.model_name, cache_size=0)
+    llm = StubLLM(latency=args.stub_latency)
+    queries = make_queries(args.num_queries)
+    modes = {
+        "sin trazas": tracing.Tracer(enabled=False),
+        "histogramas": tracing.Tracer(),
+        "histogramas + jsonl": tracing.Tracer(path=args.trace_path),
+    }
+    results = {}
+    for name, mode_tracer in modes.items():
+        # span() usa el tracer del módulo en cada llamada.
+        tracing.tracer = mode_tracer
+        latencies = []
+        for query in queries:
+            _, seconds = timed(run_rag_pipeline, query, retriever, top_k=5, generate_fn=llm.generate)
+            latencies.append(seconds)
+        mode_tracer.close()
+        results[name] = latencies
+
+    print(f"\n========= BENCHMARK: coste de la instrumentación ({len(queries)} preguntas) =========")
+    base = percentile_ms(results["sin trazas"], 50)
+    for name, latencies in results.items():
+        p50 = percentile_ms(latencies, 50)
+        print(f"{name:<22} p50 {p50:8.3f} ms  p99 {percentile_ms(latencies, 99):8.3f} ms  "
+              f"(+{p50 - base:.3f} ms)")
+
+    print("\n--- Etapas (media) ---")
+    for stage, row in sorted(modes["histogramas"].summary().items()):
+        print(f"{stage:<16}{row['count']:>6} spans {row['mean_ms']:>10.3f} ms")
+    print(f"\nTraza escrita en {args.trace_path}")
+    if args.metrics_path:
+        with open(args.metrics_path, "w", encoding="utf-8") as f:
+            f.write(modes["histogramas"].prometheus_text())
+        print(f"Histogramas (formato Prometheus) en {args.metrics_path}")
+
+
+def run_agent_tool(args):
+    from langchain_core.messages import HumanMessage
+    import rag_tools
+    from caching import SemanticAnswerCache
+    from history import HistoryManager
+    from langgraph_agent_main import build_agent_app
+    from stub_llm import StubChatModel, StubToolCallingModel
+
+    rag_tools.INDEX_PATH = args.index_path
+    rag_tools.CASES_PATH = args.cases_path
+    rag_tools.MODEL_NAME = args.model_name
+    # Sin caché de respuestas: cada turno de "answer" paga su llamada interna al LLM.
+    rag_tools.answer_cache = SemanticAnswerCache(max_size=0)
+    inner = StubChatModel(latency=args.stub_latency)
+    rag_tools.rag_chain = rag_tools.build_rag_chain(inner)
+    agent = StubToolCallingModel(latency=args.stub_latency)
+    # Resumen extractivo del historial: el benchmark no llama a Gemini.
+    app = build_agent_app(model=agent, history_manager=HistoryManager())
+    queries = make_queries(args.num_queries)
+
+    results = {}
+    for mode in rag_tools.RAG_TOOL_MODES:
+        rag_tools.RAG_TOOL_MODE = mode
+        # Un turno previo para cargar el Retriever antes de medir.
+        timed(app.invoke, {"messages": [HumanMessage(content=queries[0])]})
+        calls = agent.calls + inner.calls
+        prompts = len(agent.prompt_tokens) + len(inner.prompt_tokens)
+        latencies = []
+        for query in queries:
+            _, seconds = timed(app.invoke, {"messages": [HumanMessage(content=query)]})
+            latencies.append(seconds)
+        prompt_tokens = (agent.prompt_tokens + inner.prompt_tokens)[prompts:]
+        turn_calls = agent.calls + inner.calls - calls
+        results[mode] = {
+            "llm_calls": turn_calls / len(queries),
+            "prompt_tokens": sum(prompt_tokens) / len(queries),
+            "response_tokens": turn_calls * len(agent.answer.split()) / len(queries),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+        }
+
+    print(f"\n========= BENCHMARK: modos de patient_case_rag_tool ({len(queries)} turnos, "
+          f"LLM simulado de {args.stub_latency * 1000:.0f} ms) =========")
+    print(f"{'modo':<10}{'llamadas LLM':>14}{'tokens prompt':>15}{'tokens resp.':>14}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<10}{r['llm_calls']:>14.2f}{r['prompt_tokens']:>15.0f}{r['response_tokens']:>14.0f}"
+              f"{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+    print("(tokens contados en palabras, por turno)")
+
+
+# Turnos de ejemplo para el enrutador: cuentas, preguntas sobre casos y conversación.
+ROUTER_QUERIES = SAMPLE_QUERIES + [
+    "¿Cuánto es 125 * 4?",
+    "2^10",
+    "calcula (15 + 3) / 4",
+    "¿Qué diagnóstico tenía la paciente con ataques de pánico?",
+    "Hola, ¿qué tal?",
+    "Gracias por la ayuda",
+]
+
+
+def run_router(args):
+    from langchain_core.messages import HumanMessage
+    import rag_tools
+    from history import HistoryManager
+    from langgraph_agent_main import build_agent_app
+    from router import Router, print_router_report
+    from stub_llm import StubChatModel, StubToolCallingModel
+
+    rag_tools.INDEX_PATH = args.index_path
+    rag_tools.CASES_PATH = args.cases_path
+    rag_tools.MODEL_NAME = args.model_name
+    inner = StubChatModel(latency=args.stub_latency)
+    rag_tools.rag_chain = rag_tools.build_rag_chain(inner)
+    retriever = Retriever(args.index_path, args.cases_path, args.model_name)
+    queries = [ROUTER_QUERIES[i % len(ROUTER_QUERIES)] for i in range(args.num_queries)]
+
+    results = {}
+    for name, enabled in (("sin enrutador", False), ("con enrutador", True)):
+        router = Router(encode_fn=retriever.encode_queries, rag_threshold=args.rag_threshold, enabled=enabled)
+        agent = StubToolCallingModel(latency=args.stub_latency)
+        app = build_agent_app(model=agent, router=router, history_manager=HistoryManager())
+        timed(app.invoke, {"messages": [HumanMessage(content=queries[0])]})
+        router.reset_stats()
+        calls = agent.calls + inner.calls
+        latencies = []
+        for query in queries:
+            _, seconds = timed(app.invoke, {"messages": [HumanMessage(content=query)]})
+            latencies.append(seconds)
+        results[name] = {
+            "llm_calls": (agent.calls + inner.calls - calls) / len(queries),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+            "mean_ms": 1000 * float(np.mean(latencies)),
+            "router": router.stats(),
+        }
+
+    print(f"\n========= BENCHMARK: enrutador local ({len(queries)} turnos, "
+          f"LLM simulado de {args.stub_latency * 1000:.0f} ms, RAG_TOOL_MODE={rag_tools.RAG_TOOL_MODE}) =========")
+    print(f"{'configuración':<16}{'llamadas LLM':>14}{'media (ms)':>12}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['llm_calls']:>14.2f}{r['mean_ms']:>12.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+    stats = results["con enrutador"]["router"]
+    print_router_report(stats)
+    print(f"Turnos enrutados por motivo: {stats['by_reason']}")
+    saved = results["sin enrutador"]["mean_ms"] - results["con enrutador"]["mean_ms"]
+    print(f"Latencia media ahorrada medida: {saved:.1f} ms por turno")
+
+
+async def bench_llm_bursts(make_client, bursts, burst_size, pause, duplicates, per_call=False, seed=0):
+    """
+    Lanza `bursts` ráfagas de `burst_size` llamadas concurrentes a `agenerate`
+    (una fracción `duplicates` repite un prompt de la misma ráfaga), separadas
+    por `pause` segundos.
+
+    Args:
+        make_client (callable): Devuelve el LLMClient de cada llamada.
+        per_call (bool): `make_client` crea un cliente nuevo en cada llamada (se cierra al terminar).
+
+    Returns:
+        dict: Respuestas correctas, errores, latencias p50/p99 (ms), respuestas/s
+            en total y por ráfaga (mínimo y máximo).
+    """
+    import random
+
+    rng = random.Random(seed)
+    latencies = []
+    errors = 0
+    per_burst = []
+
+    async def call(prompt):
+        nonlocal errors
+        client = make_client()
+        start = time.perf_counter()
+        try:
+            await client.agenerate(prompt)
+            latencies.append(time.perf_counter() - start)
+            return True
+        except Exception:
+            errors += 1
+            return False
+        finally:
+            if per_call:
+                await client.aclose()
+
+    start = time.perf_counter()
+    for burst in range(bursts):
+        unique = [f"Pregunta {burst}-{i}: {SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]}" for i in range(burst_size)]
+        prompts = [rng.choice(unique[:i]) if i and rng.random() < duplicates else unique[i]
+                   for i in range(burst_size)]
+        burst_start = time.perf_counter()
+        ok = await asyncio.gather(*(call(prompt) for prompt in prompts))
+        per_burst.append(sum(ok) / (time.perf_counter() - burst_start))
+        if burst < bursts - 1:
+            await asyncio.sleep(pause)
+    elapsed = time.perf_counter() - start
+    if not per_call:
+        # El AsyncClient del cliente compartido se cierra en este mismo loop.
+        await make_client().aclose()
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile_ms(latencies, 50) if latencies else 0.0,
+        "p99_ms": percentile_ms(latencies, 99) if latencies else 0.0,
+        "answers_per_second": len(latencies) / elapsed,
+        "burst_min": min(per_burst),
+        "burst_max": max(per_burst),
+    }
+
+
+def run_llm_client(args):
+    from fake_gemini_server import FakeGeminiServer
+    from llm_client import LLMClient, TokenBucket
+
+    results = {}
+    for name in ("cliente por llamada", "cliente compartido"):
+        with FakeGeminiServer(latency=args.latency, quota=args.quota, error_rate=args.error_rate,
+                              retry_after=args.retry_after) as server:
+            per_call = name == "cliente por llamada"
+            if per_call:
+                # Como antes: un cliente nuevo en cada llamada, sin límite, sin reintentos ni agrupación.
+                shared = None
+
+                def make_client():
+                    return LLMClient(base_url=server.url, api_key="local", max_retries=0, coalesce=False,
+                                     rate_limiter=TokenBucket(rate=1e9, capacity=10 ** 9))
+            else:
+                shared = LLMClient(base_url=server.url, api_key="local", base_delay=args.base_delay,
+                                   rate_limiter=TokenBucket(rate=args.rate, capacity=args.burst))
+
+                def make_client():
+                    return shared
+            result = asyncio.run(bench_llm_bursts(make_client, args.bursts, args.burst_size, args.pause,
+                                                  args.duplicates, per_call=per_call))
+            if shared is not None:
+                result["client"] = shared.stats()
+            result["server"] = server.stats()
+            results[name] = result
+
+    total = args.bursts * args.burst_size
+    print(f"\n========= BENCHMARK: cliente LLM con ráfagas ({args.bursts} x {args.burst_size} llamadas, "
+          f"cuota {args.quota}/s, {args.error_rate:.0%} de 503) =========")
+    print(f"{'configuración':<22}{'correctas':>10}{'errores':>9}{'peticiones':>12}{'conexiones':>12}{'429':>6}"
+          f"{'p50 (ms)':>10}{'p99 (ms)':>10}{'resp/s':>8}{'ráfaga mín-máx':>16}")
+    for name, r in results.items():
+        server = r["server"]
+        print(f"{name:<22}{r['ok']:>6}/{total:<3}{r['errors']:>9}{server['requests']:>12}{server['connections']:>12}"
+              f"{server['rate_limited']:>6}{r['p50_ms']:>10.0f}{r['p99_ms']:>10.0f}{r['answers_per_second']:>8.1f}"
+              f"{r['burst_min']:>9.1f}-{r['burst_max']:.1f}")
+    client = results["cliente compartido"]["client"]
+    print(f"Cliente compartido: {client['coalesced']} llamadas agrupadas, {client['retries']} reintentos, "
+          f"{client['rate_limit_wait_s']:.1f} s de espera acumulada en el limitador.")
+
+
+def make_case_files(directory, num_files, cases_per_file, docx_fraction=0.5, num_broken=2, seed=0):
+    """
+    Escribe `num_files` archivos de casos sintéticos (.docx y .txt) y `num_broken`
+    archivos corruptos, para medir la ingesta.
+    """
+    from synthetic_cases import cases_to_text, generate_cases, write_docx
+
+    cases = generate_cases(num_files * cases_per_file, seed=seed)
+    num_docx = int(num_files * docx_fraction)
+    for i in range(num_files):
+        file_cases = cases[i * cases_per_file:(i + 1) * cases_per_file]
+        if i < num_docx:
+            write_docx(file_cases, os.path.join(directory, f"casos_{i:05d}.docx"))
+        else:
+            with open(os.path.join(directory, f"casos_{i:05d}.txt"), "w", encoding="utf-8") as f:
+                f.write(cases_to_text(file_cases))
+    for i in range(num_broken):
+        with open(os.path.join(directory, f"roto_{i}.docx"), "wb") as f:
+            f.write(b"no es un docx")
+
+
+def run_ingest(args):
+    from ingest import ingest_directory
+    from retriever_registry import get_encoder
+
+    model = get_encoder(args.model_name)
+    workdir = tempfile.mkdtemp(prefix="rag_ingest_")
+    try:
+        input_dir = os.path.join(workdir, "casos")
+        os.makedirs(input_dir)
+        make_case_files(input_dir, args.num_files, args.cases_per_file)
+        results = {}
+        for workers in args.workers:
+            result, _ = timed(ingest_directory, input_dir, model, os.path.join(workdir, "casos.index"),
+                              os.path.join(workdir, "casos.db"), workers=workers,
+                              batch_size=args.batch_size, model_name=args.model_name)
+            results[workers] = result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n========= BENCHMARK: ingesta de {args.num_files} archivos "
+          f"({args.cases_per_file} casos por archivo) =========")
+    print(f"{'procesos':>9}{'archivos/s':>12}{'casos/s':>10}{'segundos':>10}{'fallos':>8}")
+    for workers, r in results.items():
+        print(f"{workers:>9}{r['files_per_second']:>12.1f}{r['cases_per_second']:>10.1f}"
+              f"{r['seconds']:>10.2f}{len(r['failures']):>8}")
+
+
+def run_cutoffs(args):
+    from itertools import islice
+
+    from case_store import open_case_store
+    from data_processor import build_index
+    from retriever_registry import get_encoder
+
+    model = get_encoder(args.model_name)
+    store = open_case_store(args.cases_path, index_path=args.index_path)
+    cases = [text for _, text in islice(store.iter_texts("cases"), args.max_cases)]
+    store.close()
+
+    # Índice por coseno temporal con los mismos casos, para tener puntuaciones comparables.
+    workdir = tempfile.mkdtemp(prefix="rag_cutoffs_")
+    try:
+        index_path = os.path.join(workdir, "casos.index")
+        cases_path = os.path.join(workdir, "casos.db")
+        timed(build_index, cases, model, index_path, cases_path, model_name=args.model_name, metric="cosine")
+        retriever, _ = timed(Retriever, index_path, cases_path, args.model_name, model=model)
+        queries = make_queries(args.num_queries)
+
+        settings = [("sin umbrales", {})]
+        settings += [(f"min_score={v}", {"min_score": v}) for v in args.min_scores]
+        settings += [(f"relative_gap={v}", {"relative_gap": v}) for v in args.relative_gaps]
+        settings += [(f"min_score={args.min_scores[0]}, gap={args.relative_gaps[0]}",
+                      {"min_score": args.min_scores[0], "relative_gap": args.relative_gaps[0]})]
+        results = {}
+        for name, cutoffs in settings:
+            hits = retriever.search_batch(queries, top_k=args.top_k, **cutoffs)
+            packed = [retriever.pack_context(h, max_tokens=args.context_tokens) for h in hits]
+            results[name] = {
+                "cases": np.mean([len(p.case_ids) for p in packed]),
+                "tokens": np.mean([p.tokens for p in packed]),
+                "fewer": np.mean([len(h) < args.top_k for h in hits]),
+            }
+        retriever.store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    base = results["sin umbrales"]["tokens"]
+    print(f"\n========= BENCHMARK: umbrales de similitud (top_k={args.top_k}, {len(cases)} casos, "
+          f"{len(queries)} preguntas) =========")
+    print(f"{'configuración':<30}{'casos':>7}{'tokens':>9}{'ahorro':>9}{'con < top_k':>13}")
+    for name, r in results.items():
+        print(f"{name:<30}{r['cases']:>7.2f}{r['tokens']:>9.0f}{1 - r['tokens'] / base:>9.1%}{r['fewer']:>13.0%}")
+
+
+def run_lookup(args):
+    retriever = Retriever(args.index_path, args.cases_path, args.model_name)
+    if not retriever.store.has_metadata:
+        raise SystemExit("El almacén no tiene metadatos: reconstruye el índice con data_processor.py.")
+    metadata = retriever.store.get_metadata(range(args.num_queries * 4))
+    names = [m.nombre for m in metadata.values() if m.iniciales and "." in (m.nombre or "")][:args.num_queries]
+    if not names:
+        raise SystemExit("No hay casos con iniciales (\"Nombre: M.G.P.\") en el almacén.")
+    lookups = [f"¿Cuál es el motivo de consulta de {name}?" for name in names]
+    queries = make_queries(args.num_queries)
+
+    def latencies(batch, **kwargs):
+        result = []
+        for query in batch:
+            start = time.perf_counter()
+            retriever.search(query, top_k=args.top_k, **kwargs)
+            result.append(time.perf_counter() - start)
+        return result
+
+    settings = [
+        ("pacientes, por embeddings", latencies(lookups, exact_lookup=False)),
+        ("pacientes, búsqueda exacta", latencies(lookups, exact_lookup=True)),
+        ("sin filtro", latencies(queries)),
+        (f"edad {args.min_age}-{args.max_age}", latencies(queries, filters={"min_age": args.min_age,
+                                                                          "max_age": args.max_age})),
+    ]
+    retriever.store.close()
+
+    print(f"\n========= BENCHMARK: metadatos y búsqueda filtrada (top_k={args.top_k}) =========")
+    print(f"{'búsqueda':<30}{'preguntas':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for name, values in settings:
+        print(f"{name:<30}{len(values):>10}{percentile_ms(values, 50):>10.2f}{percentile_ms(values, 99):>10.2f}")
+
+
+def run_checkpointer(args):
+    import chat_pipeline_rag
+
+    chat_pipeline_rag.INDEX_PATH = args.index_path
+    chat_pipeline_rag.CASES_PATH = args.cases_path
+    chat_pipeline_rag.MODEL_NAME = args.model_name
+
+    if args.backend:
+        # Proceso hijo: mide un solo checkpointer y escribe el resultado en JSON.
+        from checkpointer import SQLiteCheckpointer
+        from langgraph.checkpoint.memory import MemorySaver
+
+        if args.backend == "sqlite":
+            checkpointer = SQLiteCheckpointer(args.db_path, max_memory_threads=args.max_memory_threads)
+        else:
+            checkpointer = MemorySaver()
+        result = bench_checkpointer(checkpointer, args.sessions, args.turns)
+        if args.backend == "sqlite":
+            checkpointer.close()
+            result["db_mb"] = os.path.getsize(args.db_path) / 1024 ** 2
+        print(json.dumps(result))
+        return
+
+    # Cada checkpointer se mide en un proceso nuevo, para que el RSS de uno no
+    # contamine al otro.
+    results = {}
+    for backend in ("memory", "sqlite"):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db_path + suffix):
+                os.remove(args.db_path + suffix)
+        command = [sys.executable, os.path.abspath(__file__), "--index-path", args.index_path,
+                   "--cases-path", args.cases_path, "--model-name", args.model_name, "checkpointer",
+                   "--backend", backend, "--sessions", str(args.sessions), "--turns", str(args.turns),
+                   "--db-path", args.db_path, "--max-memory-threads", str(args.max_memory_threads)]
+        output = subprocess.run(command, capture_output=True, text=True, check=True)
+        results[backend] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    print(f"\n========= BENCHMARK: checkpointer ({args.sessions} sesiones x {args.turns} turnos) =========")
+    print(f"{'backend':<8}{'turnos/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}{'RSS antes':>11}{'RSS después':>13}{'disco (MB)':>12}")
+    for backend, r in results.items():
+        print(f"{backend:<8}{r['turns_per_second']:>10.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['rss_before_mb']:>11.1f}{r['rss_after_mb']:>13.1f}{r.get('db_mb', 0.0):>12.1f}")
+    overhead = results["sqlite"]["p50_ms"] - results["memory"]["p50_ms"]
+    print(f"Coste por turno del checkpointer SQLite frente a MemorySaver (p50): {overhead:+.2f} ms")
+
+
+def run_suite(args):
+    from retriever_registry import get_encoder
+
+    model = get_encoder(args.model_name, args.backend)
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "model_name": args.model_name,
+        "backend": args.backend,
+        "index_spec": args.index_spec,
+        "python": sys.version.split()[0],
+        "results": [],
+    }
+    for num_cases in args.sizes:
+        workdir = tempfile.mkdtemp(prefix="rag_bench_")
+        try:
+            print(f"Midiendo con {num_cases} casos...")
+            result = bench_scale(num_cases, model, workdir, args.model_name, index_spec=args.index_spec,
+                                 encode_sample=args.encode_sample, max_docx_cases=args.max_docx_cases,
+                                 num_queries=args.num_queries, num_e2e=args.num_e2e,
+                                 stub_latency=args.stub_latency)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        report["results"].append(result)
+        # Se guarda tras cada tamaño, para no perder lo medido si un tamaño grande falla.
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n========= BENCHMARK: escalado ({args.model_name}, {args.index_spec}) =========")
+    print(f"{'casos':>9}{'extr. c/s':>11}{'segm. c/s':>12}{'cod. c/s':>10}{'build (s)':>11}"
+          f"{'p50 (ms)':>10}{'p99 (ms)':>10}{'RSS MB':>9}{'e2e p50':>9}")
+    for r in report["results"]:
+        print(f"{r['cases']:>9}{r['extraction']['cases_per_second']:>11.0f}"
+              f"{r['segmentation']['cases_per_second']:>12.0f}{r['encoding']['cases_per_second']:>10.1f}"
+              f"{r['build']['seconds']:>11.2f}{r['search']['p50_ms']:>10.2f}{r['search']['p99_ms']:>10.2f}"
+              f"{r['memory']['rss_mb']:>9.0f}{r['end_to_end']['p50_ms']:>9.1f}")
+    print(f"Resultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        rows = compare_results(previous, report, tolerance=args.tolerance)
+        print(f"\n--- Comparación con {args.compare} (commit {previous.get('git_commit')}) ---")
+        for cases, stage, metric, before, after, change, regression in rows:
+            flag = "  <-- REGRESIÓN" if regression else ""
+            print(f"{cases:>9} {stage + '.' + metric:<30}{before:>12.2f}{after:>12.2f}{change:>+9.1%}{flag}")
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks del sistema RAG.")
+    parser.add_argument("--index-path", default="../models/patient_cases.index")
+    parser.add_argument("--cases-path", default="../models/patient_cases.db")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = subparsers.add_parser("batch-search", help="search en bucle vs search_batch")
+    batch_parser.add_argument("--num-queries", type=int, default=1000)
+    batch_parser.add_argument("--top-k", type=int, default=5)
+    batch_parser.add_argument("--batch-size", type=int, default=32)
+    batch_parser.set_defaults(func=run_batch_search)
+
+    cache_parser = subparsers.add_parser("query-cache", help="search con caché de embeddings fría vs caliente")
+    cache_parser.add_argument("--num-queries", type=int, default=1000)
+    cache_parser.add_argument("--top-k", type=int, default=5)
+    cache_parser.set_defaults(func=run_query_cache)
+
+    index_parser = subparsers.add_parser("index-types", help="recall@k y latencia de índices aproximados vs Flat")
+    index_parser.add_argument("--num-vectors", type=int, default=100000)
+    index_parser.add_argument("--num-queries", type=int, default=500)
+    index_parser.add_argument("--dim", type=int, default=768)
+    index_parser.add_argument("--top-k", type=int, default=10)
+    index_parser.add_argument("--nprobe", type=int, default=16)
+    index_parser.add_argument("--ef-search", type=int, default=64)
+    index_parser.add_argument("--index-specs", nargs="+",
+                              default=["IVF1024,Flat", "IVF1024,PQ32", "HNSW32"])
+    index_parser.set_defaults(func=run_index_types)
+
+    hybrid_parser = subparsers.add_parser("hybrid", help="latencia de la búsqueda densa vs híbrida")
+    hybrid_parser.add_argument("--num-queries", type=int, default=200)
+    hybrid_parser.add_argument("--top-k", type=int, default=5)
+    hybrid_parser.set_defaults(func=run_hybrid)
+
+    cold_parser = subparsers.add_parser("cold-start", help="arranque anticipado vs registro perezoso")
+    cold_parser.set_defaults(func=run_cold_start)
+
+    history_parser = subparsers.add_parser("history", help="tamaño del prompt por turno con historial acotado")
+    history_parser.add_argument("--turns", type=int, default=120)
+    history_parser.add_argument("--max-turns", type=int, default=6)
+    history_parser.add_argument("--window-tokens", type=int, default=1200)
+    history_parser.add_argument("--summary-tokens", type=int, default=250)
+    history_parser.set_defaults(func=run_history)
+
+    checkpoint_parser = subparsers.add_parser("checkpointer", help="RSS y coste por turno: MemorySaver vs SQLite")
+    checkpoint_parser.add_argument("--sessions", type=int, default=2000)
+    checkpoint_parser.add_argument("--turns", type=int, default=3)
+    checkpoint_parser.add_argument("--db-path", default="checkpoints_benchmark.db")
+    checkpoint_parser.add_argument("--max-memory-threads", type=int, default=200)
+    checkpoint_parser.add_argument("--backend", choices=["memory", "sqlite"],
+                                   help="Medir solo este checkpointer (uso interno).")
+    checkpoint_parser.set_defaults(func=run_checkpointer)
+
+    tracing_parser = subparsers.add_parser("tracing", help="coste de las trazas por etapa")
+    tracing_parser.add_argument("--num-queries", type=int, default=300)
+    tracing_parser.add_argument("--stub-latency", type=float, default=0.0)
+    tracing_parser.add_argument("--trace-path", default="trace.jsonl")
+    tracing_parser.add_argument("--metrics-path", default="metrics.prom")
+    tracing_parser.set_defaults(func=run_tracing)
+
+    cutoffs_parser = subparsers.add_parser("cutoffs", help="contexto ahorrado con umbrales de similitud")
+    cutoffs_parser.add_argument("--top-k", type=int, default=5)
+    cutoffs_parser.add_argument("--num-queries", type=int, default=200)
+    cutoffs_parser.add_argument("--max-cases", type=int, default=20000)
+    cutoffs_parser.add_argument("--context-tokens", type=int, default=1500)
+    cutoffs_parser.add_argument("--min-scores", type=float, nargs="+", default=[0.3, 0.4, 0.5])
+    cutoffs_parser.add_argument("--relative-gaps", type=float, nargs="+", default=[0.1, 0.2])
+    cutoffs_parser.set_defaults(func=run_cutoffs)
+
+    lookup_parser = subparsers.add_parser("lookup", help="búsqueda exacta de pacientes y filtros por metadatos")
+    lookup_parser.add_argument("--top-k", type=int, default=5)
+    lookup_parser.add_argument("--num-queries", type=int, default=200)
+    lookup_parser.add_argument("--min-age", type=int, default=18)
+    lookup_parser.add_argument("--max-age", type=int, default=25)
+    lookup_parser.set_defaults(func=run_lookup)
+
+    agent_tool_parser = subparsers.add_parser("agent-tool", help="herramienta RAG: respuesta propia vs solo contexto")
+    agent_tool_parser.add_argument("--num-queries", type=int, default=50)
+    agent_tool_parser.add_argument("--stub-latency", type=float, default=0.5,
+                                   help="Latencia simulada de cada llamada al LLM (s).")
+    agent_tool_parser.set_defaults(func=run_agent_tool)
+
+    router_parser = subparsers.add_parser("router", help="enrutador local antes del agente: aciertos y latencia")
+    router_parser.add_argument("--num-queries", type=int, default=56)
+    router_parser.add_argument("--stub-latency", type=float, default=0.5,
+                               help="Latencia simulada de cada llamada al LLM (s).")
+    router_parser.add_argument("--rag-threshold", type=float, default=0.5)
+    router_parser.set_defaults(func=run_router)
+
+    llm_parser = subparsers.add_parser("llm-client", help="cliente LLM compartido frente a ráfagas (servidor local)")
+    llm_parser.add_argument("--bursts", type=int, default=5)
+    llm_parser.add_argument("--burst-size", type=int, default=40)
+    llm_parser.add_argument("--pause", type=float, default=1.0, help="Segundos entre ráfagas.")
+    llm_parser.add_argument("--duplicates", type=float, default=0.25,
+                            help="Fracción de llamadas que repiten un prompt en curso.")
+    llm_parser.add_argument("--latency", type=float, default=0.2, help="Latencia del servidor simulado (s).")
+    llm_parser.add_argument("--quota", type=int, default=20, help="Peticiones por segundo del servidor.")
+    llm_parser.add_argument("--error-rate", type=float, default=0.05)
+    llm_parser.add_argument("--retry-after", type=float, default=None)
+    llm_parser.add_argument("--rate", type=float, default=18.0, help="Peticiones/s del token bucket.")
+    llm_parser.add_argument("--burst", type=int, default=2, help="Capacidad del token bucket.")
+    llm_parser.add_argument("--base-delay", type=float, default=0.2)
+    llm_parser.set_defaults(func=run_llm_client)
+
+    ingest_parser = subparsers.add_parser("ingest", help="ingesta paralela de un directorio de casos")
+    ingest_parser.add_argument("--num-files", type=int, default=500)
+    ingest_parser.add_argument("--cases-per-file", type=int, default=20)
+    ingest_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ingest_parser.add_argument("--batch-size", type=int, default=256)
+    ingest_parser.set_defaults(func=run_ingest)
+
+    suite_parser = subparsers.add_parser("suite", help="escalado de todas las etapas con casos sintéticos")
+    suite_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                              help="Números de casos a medir (hasta 1000000).")
+    suite_parser.add_argument("--index-spec", default="Flat")
+    suite_parser.add_argument("--backend", default="torch", help='Backend del encoder: "torch", "onnx" u "onnx-int8".')
+    suite_parser.add_argument("--encode-sample", type=int, default=2000,
+                              help="Casos que se codifican de verdad; por encima se reutilizan sus embeddings.")
+    suite_parser.add_argument("--max-docx-cases", type=int, default=20000)
+    suite_parser.add_argument("--num-queries", type=int, default=200)
+    suite_parser.add_argument("--num-e2e", type=int, default=50)
+    suite_parser.add_argument("--stub-latency", type=float, default=0.0)
+    suite_parser.add_argument("--output", default="benchmark_results.json")
+    suite_parser.add_argument("--compare", help="Resultados anteriores con los que comparar.")
+    suite_parser.add_argument("--tolerance", type=float, default=0.10,
+                              help="Empeoramiento relativo a partir del cual se marca una regresión.")
+    suite_parser.set_defaults(func=run_suite)
+
+    args = parser.parse_args()
+    args.func(args)
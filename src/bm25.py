@@ -0,0 +1,180 @@
+import re
+import unicodedata
+
+import numpy as np
+
+# Palabras vacías del español que no aportan a la búsqueda léxica.
+SPANISH_STOPWORDS = {
+    "a", "al", "algo", "como", "con", "cual", "cuando", "de", "del", "desde", "donde",
+    "el", "ella", "ellas", "ellos", "en", "entre", "era", "es", "esa", "ese", "eso",
+    "esta", "este", "esto", "fue", "ha", "han", "hay", "la", "las", "le", "les", "lo",
+    "los", "mas", "me", "mi", "muy", "no", "nos", "o", "para", "pero", "por", "que",
+    "se", "si", "sin", "sobre", "su", "sus", "tambien", "te", "tiene", "un", "una",
+    "uno", "y", "ya", "yo",
+}
+
+# Iniciales como "M.G.P." se conservan como un solo token ("mgp").
+INITIALS_PATTERN = re.compile(r"\b(?:[a-z]\.){2,}")
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def strip_accents(text):
+    return "".join(
+        c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn"
+    )
+
+
+def tokenize(text):
+    """
+    Tokeniza texto en español para BM25: minúsculas, sin tildes, sin palabras vacías.
+
+    Args:
+        text (str): El texto a tokenizar.
+
+    Returns:
+        list: Los tokens.
+    """
+    text = strip_accents(text.lower())
+    tokens = [initials.replace(".", "") for initials in INITIALS_PATTERN.findall(text)]
+    text = INITIALS_PATTERN.sub(" ", text)
+    tokens.extend(
+        token for token in WORD_PATTERN.findall(text)
+        if token not in SPANISH_STOPWORDS and (len(token) > 1 or token.isdigit())
+    )
+    return tokens
+
+
+class BM25Index:
+    """
+    Índice invertido en memoria con puntuación BM25.
+
+    Las listas de postings se guardan en formato CSR (indptr + documentos + frecuencias)
+    para que una búsqueda sea solo unas pocas operaciones vectorizadas de numpy.
+    """
+
+    def __init__(self, doc_ids, doc_lens, vocab, indptr, postings_docs, postings_tf, k1=1.5, b=0.75):
+        self.doc_ids = doc_ids
+        self.doc_lens = doc_lens
+        self.vocab = vocab
+        self.indptr = indptr
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.k1 = k1
+        self.b = b
+        num_docs = len(doc_ids)
+        doc_freq = np.diff(indptr).astype('float32')
+        self.idf = np.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype('float32')
+        avg_len = doc_lens.mean() if num_docs else 1.0
+        # Parte del denominador BM25 que solo depende del documento.
+        self.length_norm = (k1 * (1 - b + b * doc_lens / avg_len)).astype('float32')
+
+    @classmethod
+    def build(cls, documents, **kwargs):
+        """
+        Construye el índice.
+
+        Args:
+            documents (iterable): Pares (id, texto). El id es el del vector en FAISS
+                (caso o pasaje), para poder fusionar ambos resultados.
+
+        Returns:
+            BM25Index: El índice construido.
+        """
+        doc_ids = []
+        doc_lens = []
+        term_postings = {}
+        for position, (doc_id, text) in enumerate(documents):
+            tokens = tokenize(text)
+            doc_ids.append(doc_id)
+            doc_lens.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                term_postings.setdefault(token, []).append((position, tf))
+
+        vocab = {}
+        indptr = [0]
+        postings_docs = []
+        postings_tf = []
+        for term_id, (token, postings) in enumerate(term_postings.items()):
+            vocab[token] = term_id
+            postings_docs.extend(position for position, _ in postings)
+            postings_tf.extend(tf for _, tf in postings)
+            indptr.append(len(postings_docs))
+
+        return cls(
+            np.array(doc_ids, dtype='int64'),
+            np.array(doc_lens, dtype='float32'),
+            vocab,
+            np.array(indptr, dtype='int64'),
+            np.array(postings_docs, dtype='int32'),
+            np.array(postings_tf, dtype='float32'),
+            **kwargs
+        )
+
+    def search(self, query, top_k=10):
+        """
+        Args:
+            query (str): La pregunta.
+            top_k (int): Número de documentos a devolver.
+
+        Returns:
+            list: Pares (id, puntuación BM25) ordenados de mayor a menor puntuación.
+        """
+        scores = np.zeros(len(self.doc_ids), dtype='float32')
+        for token in set(tokenize(query)):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k)[:top_k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(int(self.doc_ids[i]), float(scores[i])) for i in matched]
+
+    def save(self, path):
+        tokens = np.array(sorted(self.vocab, key=self.vocab.get))
+        with open(path, "wb") as f:
+            np.savez(f, doc_ids=self.doc_ids, doc_lens=self.doc_lens, tokens=tokens,
+                     indptr=self.indptr, postings_docs=self.postings_docs,
+                     postings_tf=self.postings_tf, params=np.array([self.k1, self.b]))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"]
+            return cls(
+                data["doc_ids"],
+                data["doc_lens"],
+                {str(token): term_id for term_id, token in enumerate(data["tokens"])},
+                data["indptr"],
+                data["postings_docs"],
+                data["postings_tf"],
+                k1=float(k1),
+                b=float(b),
+            )
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fusiona varias listas ordenadas de ids con Reciprocal Rank Fusion:
+    cada id suma 1 / (k + posición) por cada lista en la que aparece.
+
+    Args:
+        rankings (list): Listas de ids, cada una ordenada de mejor a peor.
+        k (int): Constante de RRF; atenúa el peso de las primeras posiciones.
+
+    Returns:
+        list: Pares (id, puntuación RRF) ordenados de mayor a menor puntuación.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,248 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """
+    Normaliza el texto de una pregunta para usarlo como clave de caché:
+    espacios colapsados y sin distinguir mayúsculas.
+    """
+    return " ".join(text.split()).casefold()
+
+
+class LRUCache:
+    """
+    Caché acotada con desalojo LRU (el elemento menos usado recientemente sale primero).
+    Lleva la cuenta de aciertos y fallos. Es segura para usarse desde varios hilos.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Tamaño actual, aciertos, fallos y tasa de aciertos.
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class QueryEmbeddingCache(LRUCache):
+    """
+    Caché LRU de texto de pregunta normalizado -> embedding float32. El embedding
+    debe calcularse sobre ese mismo texto normalizado (ver `Retriever.encode_queries`).
+
+    Si se indica `path`, la caché se carga desde ese archivo .npz al crearse y se
+    guarda al terminar el proceso. El archivo guarda el nombre del modelo: si no
+    coincide con `model_name`, su contenido se descarta.
+    """
+
+    def __init__(self, model_name, max_size=1024, path=None):
+        super().__init__(max_size=max_size)
+        self.model_name = model_name
+        self.path = path
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def get_embedding(self, query):
+        return self.get(normalize_query(query))
+
+    def put_embedding(self, query, embedding):
+        self.put(normalize_query(query), np.asarray(embedding, dtype='float32'))
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            if str(data["model_name"]) != self.model_name:
+                print(f"Caché de embeddings ignorada: fue creada con otro modelo ({data['model_name']}).")
+                return
+            for key, embedding in zip(data["keys"], data["embeddings"]):
+                self.put(str(key), embedding)
+
+    def save(self):
+        """
+        Guarda la caché en `path` de forma atómica (archivo temporal + rename).
+        """
+        if not self.path:
+            return
+        items = self.items()
+        if not items:
+            return
+        keys = np.array([key for key, _ in items])
+        embeddings = np.stack([embedding for _, embedding in items]).astype('float32')
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, model_name=np.array(self.model_name), keys=keys, embeddings=embeddings)
+        os.replace(tmp_path, self.path)
+
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas del LLM por similitud semántica de la pregunta.
+
+    Una pregunta reutiliza una respuesta guardada si:
+      - su embedding tiene similitud coseno >= `threshold` con el de la pregunta
+        guardada (paráfrasis de la misma pregunta), y
+      - se recuperaron exactamente los mismos casos (el LLM vería el mismo contexto).
+
+    Las entradas caducan tras `ttl` segundos (None: no caducan) y, por encima de
+    `max_size`, se desaloja la menos usada recientemente. Toda la caché se vacía
+    cuando cambia el `build_id` del índice (el índice se reconstruyó).
+    Es segura para usarse desde varios hilos.
+    """
+
+    def __init__(self, threshold=0.92, ttl=3600, max_size=512):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.build_id = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # id de entrada -> (embedding normalizado, casos, respuesta, instante de creación)
+        self._entries = OrderedDict()
+        # conjunto de casos -> ids de las entradas con ese contexto
+        self._by_cases = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype='float32').ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _check_build(self, build_id):
+        if build_id != self.build_id:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._by_cases.clear()
+            self.build_id = build_id
+
+    def _remove(self, entry_id):
+        _, case_ids, _, _ = self._entries.pop(entry_id)
+        ids = self._by_cases[case_ids]
+        ids.remove(entry_id)
+        if not ids:
+            del self._by_cases[case_ids]
+
+    def get(self, embedding, case_ids, build_id=None):
+        """
+        Args:
+            embedding (np.ndarray): Embedding de la pregunta.
+            case_ids (iterable): Ids de los casos recuperados para la pregunta.
+            build_id (str): `build_id` del índice con el que se recuperaron.
+
+        Returns:
+            str: La respuesta guardada, o None si no hay ninguna válida.
+        """
+        case_ids = frozenset(case_ids)
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_build(build_id)
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(self._by_cases.get(case_ids, ())):
+                cached_embedding, _, _, created = self._entries[entry_id]
+                if self.ttl is not None and now - created > self.ttl:
+                    self._remove(entry_id)
+                    self.evictions += 1
+                    continue
+                similarity = float(np.dot(query, cached_embedding))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def put(self, embedding, case_ids, answer, build_id=None):
+        if self.max_size <= 0:
+            return
+        case_ids = frozenset(case_ids)
+        with self._lock:
+            self._check_build(build_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (self._normalize(embedding), case_ids, answer, time.monotonic())
+            self._by_cases.setdefault(case_ids, []).append(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_cases.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Tamaño actual, aciertos, fallos, tasa de aciertos, entradas
+                desalojadas (por tamaño o TTL) e invalidaciones por reconstrucción.
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,125 @@
+import ast
+import math
+import operator
+import re
+
+# Evaluador de expresiones aritméticas sobre el AST de Python, en lugar de eval():
+# solo admite números, + - * / // % ** y paréntesis, con límites de tamaño.
+
+MAX_EXPRESSION_LENGTH = 200
+# Límites de las potencias, para que "9 ** 9 ** 9" no bloquee el proceso.
+MAX_EXPONENT = 100
+MAX_POWER_BASE = 1e6
+# Cifras máximas (orden de magnitud) de un resultado intermedio: por debajo del
+# máximo de un float (~1.8e308), así "999999^100 / 7" no desborda.
+MAX_RESULT_DIGITS = 300
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+# Expresiones escritas como en un chat: "3 x 4", "10 ÷ 2", "2^8".
+_REPLACEMENTS = (("×", "*"), ("÷", "/"), ("^", "**"))
+_LOOSE_TIMES = re.compile(r"(?<=[\d)\s])[xX](?=[\s\d(])")
+
+
+def normalize_expression(expression):
+    """
+    Convierte la notación habitual (×, ÷, ^, "3 x 4") a la de Python.
+    """
+    for old, new in _REPLACEMENTS:
+        expression = expression.replace(old, new)
+    return _LOOSE_TIMES.sub("*", expression).strip()
+
+
+def _digits(value):
+    # Orden de magnitud de un número (también de enteros demasiado grandes para un float).
+    return math.log10(abs(value)) if value else 0.0
+
+
+def _check_size(op, left, right):
+    # Estima el tamaño del resultado antes de calcularlo.
+    if isinstance(op, ast.Pow):
+        if abs(right) > MAX_EXPONENT or abs(left) > MAX_POWER_BASE:
+            raise ValueError("Potencia demasiado grande.")
+        digits = right * _digits(left) if left else 0.0
+    elif isinstance(op, ast.Mult):
+        digits = _digits(left) + _digits(right) if left and right else 0.0
+    elif isinstance(op, (ast.Div, ast.FloorDiv)):
+        digits = _digits(left) - _digits(right) if left and right else 0.0
+    else:
+        return
+    if digits > MAX_RESULT_DIGITS:
+        raise ValueError("Resultado demasiado grande.")
+
+
+def _check_result(value):
+    # Solo resultados reales y finitos: (-8) ** 0.5 es complejo y 1e308 + 1e308, inf.
+    if isinstance(value, complex):
+        raise ValueError("El resultado no es un número real.")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("Resultado demasiado grande.")
+    return value
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return _check_result(node.value)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        return _UNARY_OPERATORS[type(node.op)](_evaluate(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        left, right = _evaluate(node.left), _evaluate(node.right)
+        _check_size(node.op, left, right)
+        try:
+            return _check_result(_BINARY_OPERATORS[type(node.op)](left, right))
+        except ZeroDivisionError:
+            raise ValueError("División por cero.") from None
+        except OverflowError:
+            raise ValueError("Resultado demasiado grande.") from None
+    raise ValueError(f"Elemento no permitido en la expresión: {type(node).__name__}.")
+
+
+def safe_eval(expression):
+    """
+    Evalúa una expresión aritmética sin ejecutar código.
+
+    Args:
+        expression (str): La expresión (p. ej. "5 * (3 + 1)" o "2^10").
+
+    Returns:
+        int | float: El resultado.
+
+    Raises:
+        ValueError: Si la expresión no es aritmética, es demasiado larga o no se puede calcular.
+    """
+    expression = normalize_expression(expression)
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ValueError("Expresión demasiado larga.")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError:
+        raise ValueError(f"Expresión no válida: {expression}") from None
+    return _evaluate(tree)
+
+
+def format_result(expression, result):
+    # Mismo formato de respuesta que calculator_tool.
+    return f"El resultado de '{expression}' es {result}."
+
+
+if __name__ == "__main__":
+    for expr in ["5 * (3 + 1)", "2^10", "10 ÷ 4", "3 x 4", "__import__('os')", "9 ** 9 ** 9", "1 / 0",
+                 "999999.0^100", "999999^100/7", "(-8)^0.5", "1e308+1e308"]:
+        try:
+            print(f"{expr!r} -> {safe_eval(expr)}")
+        except ValueError as e:
+            print(f"{expr!r} -> error: {e}")
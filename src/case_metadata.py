@@ -0,0 +1,100 @@
+import re
+import unicodedata
+from typing import NamedTuple, Optional
+
+# Campos estructurados del encabezado de cada caso ("Nombre: M.G.P.", "Edad: 23 años",
+# "Motivo de consulta: ..."), para filtrar búsquedas y encontrar pacientes por nombre.
+
+# Etiquetas de los campos del encabezado: el nombre termina donde empieza la
+# siguiente, así también funciona con todos los campos en una misma línea
+# ("Nombre de la paciente: M.G.P. Edad: 27 años. Motivo de consulta: '...'").
+FIELD_LABELS = r"(?:Edad|Motivo\s+de\s+consulta|Sexo|G[eé]nero|Ocupaci[oó]n|Estado\s+civil|Fecha)\b"
+NAME_PATTERN = re.compile(
+    r"^\s*Nombre(?:\s+de\s+la\s+paciente|\s+del\s+paciente)?\s*:?\s*(.+?)\s*(?=[,;]?\s*" + FIELD_LABELS + r"|$)",
+    re.IGNORECASE | re.MULTILINE
+)
+AGE_PATTERN = re.compile(r"\bEdad\s*:?\s*(\d{1,3})", re.IGNORECASE)
+# El motivo entre comillas, o hasta el final de la frase (o de la línea) si no las lleva.
+REASON_PATTERN = re.compile(
+    r"\bMotivo\s+de\s+consulta\s*:?\s*(?:['\"“‘](?P<quoted>[^'\"”’\n]+)['\"”’]|(?P<plain>[^\n]+?)(?=\.\s|\.?$))",
+    re.IGNORECASE | re.MULTILINE
+)
+# Iniciales con puntos en una pregunta: "M.G.P.", "M. G. P." (al menos dos letras).
+INITIALS_PATTERN = re.compile(r"(?<![\wÁÉÍÓÚÑ])((?:[A-ZÁÉÍÓÚÑ]\.\s?){2,5})")
+# Partículas que no cuentan para las iniciales de un nombre completo.
+NAME_PARTICLES = {"de", "del", "la", "las", "los", "y"}
+
+
+class CaseMetadata(NamedTuple):
+    nombre: Optional[str]
+    iniciales: Optional[str]
+    edad: Optional[int]
+    motivo: Optional[str]
+
+
+def _strip_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def normalize_initials(name):
+    """
+    Iniciales normalizadas de un nombre: "M.G.P." -> "MGP", "M. G. P. (12)" -> "MGP",
+    "MGP" -> "MGP", "María del Pilar Gómez" -> "MPG".
+
+    Returns:
+        str: Las iniciales en mayúsculas sin tildes, o None si no hay letras.
+    """
+    name = re.sub(r"\(.*?\)", " ", name)
+    words = re.findall(r"[^\W\d_]+", name)
+    if len(words) == 1 and words[0].isupper() and len(words[0]) <= 5:
+        # Ya son iniciales sin puntos: "MGP".
+        letters = words
+    else:
+        letters = [word[0] for word in words if word.lower() not in NAME_PARTICLES]
+    initials = _strip_accents("".join(letters)).upper()
+    return initials or None
+
+
+def parse_case_metadata(text):
+    """
+    Extrae nombre, iniciales, edad y motivo de consulta del texto de un caso.
+    Los campos que no aparecen quedan en None.
+
+    Returns:
+        CaseMetadata: Los campos del caso.
+    """
+    name_match = NAME_PATTERN.search(text)
+    age_match = AGE_PATTERN.search(text)
+    reason_match = REASON_PATTERN.search(text)
+    nombre = name_match.group(1) if name_match else None
+    if nombre:
+        # El punto final de "María Gómez. Edad: ..." no es parte del nombre (el de "M.G.P." sí).
+        nombre = re.sub(r"(?<=[^\W\d_]{2})\.$", "", nombre)
+    motivo = (reason_match.group("quoted") or reason_match.group("plain")).strip() if reason_match else None
+    return CaseMetadata(
+        nombre=nombre,
+        iniciales=normalize_initials(nombre) if nombre else None,
+        edad=int(age_match.group(1)) if age_match else None,
+        motivo=motivo or None,
+    )
+
+
+def find_initials(query):
+    """
+    Iniciales de pacientes mencionadas en una pregunta ("¿Qué le pasa a M.G.P.?" -> ["MGP"]).
+    Solo se reconocen iniciales con puntos, para no confundirlas con siglas (TAG, TOC...).
+    """
+    return list(dict.fromkeys(normalize_initials(match) for match in INITIALS_PATTERN.findall(query)))
+
+
+if __name__ == "__main__":
+    caso = ("Nombre: M.G.P.\nEdad: 23 años\n"
+            "Motivo de consulta: 'No tengo ganas de hacer nada en la universidad.'")
+    print(parse_case_metadata(caso))
+    # Todos los campos en una misma línea (como el ejemplo de prompt_manager.py).
+    caso = ("Nombre de la paciente: M.G.P. Edad: 27 años. Motivo de consulta: 'No tengo ganas de hacer "
+            "nada en la universidad, siento que estoy estancada.' La paciente atribuye esta desmotivación "
+            "a su frustración por no conseguir trabajo.")
+    print(parse_case_metadata(caso))
+    print(parse_case_metadata("Nombre: María del Pilar Gómez. Edad: 31. Motivo de consulta: Insomnio. Refiere..."))
+    print(find_initials("¿Cuál es el motivo de consulta de M.G.P.?"))
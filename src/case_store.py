@@ -0,0 +1,311 @@
+import argparse
+import os
+import pickle
+import sqlite3
+import threading
+
+import numpy as np
+
+from case_metadata import CaseMetadata, normalize_initials, parse_case_metadata
+from index_files import artifact_path, CHUNK_MAP_SUFFIX, LEGACY_PASSAGES_SUFFIX
+
+# Tamaño máximo del archivo que SQLite lee mediante mmap (1 GB).
+MMAP_SIZE = 1 << 30
+
+
+class CaseStore:
+    """
+    Almacén en disco de los textos de los casos y de sus pasajes (SQLite).
+
+    Los textos se leen bajo demanda por id, así que cargar un Retriever no
+    depende del tamaño del corpus: solo se leen los textos de los resultados.
+
+    Al guardar cada caso se extraen también sus campos (nombre, iniciales, edad y
+    motivo de consulta, ver case_metadata.py) en la tabla `metadata`, con índices
+    para filtrar por iniciales o por edad.
+    """
+
+    def __init__(self, path, readonly=True):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cases (
+                    id INTEGER PRIMARY KEY,
+                    text TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS passages (
+                    id INTEGER PRIMARY KEY,
+                    case_id INTEGER NOT NULL,
+                    text TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS passages_case_id ON passages (case_id);
+                CREATE TABLE IF NOT EXISTS metadata (
+                    case_id INTEGER PRIMARY KEY,
+                    nombre TEXT,
+                    iniciales TEXT,
+                    edad INTEGER,
+                    motivo TEXT
+                );
+                CREATE INDEX IF NOT EXISTS metadata_iniciales ON metadata (iniciales);
+                CREATE INDEX IF NOT EXISTS metadata_edad ON metadata (edad);
+            """)
+        self.conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        self._lock = threading.Lock()
+        # Los almacenes creados antes de la tabla de metadatos no la tienen (en lectura)
+        # o la tienen vacía (en escritura, se rellena aquí).
+        self.has_metadata = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metadata'"
+        ).fetchone() is not None
+        if not readonly:
+            self._backfill_metadata()
+
+    def _get_many(self, table, ids):
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id, text FROM {table} WHERE id IN ({placeholders})", ids
+            ).fetchall()
+        return dict(rows)
+
+    def get_cases(self, ids):
+        """
+        Args:
+            ids (list): Ids de los casos.
+
+        Returns:
+            dict: id -> texto, solo para los ids que existen.
+        """
+        return self._get_many("cases", ids)
+
+    def get_passages(self, ids):
+        return self._get_many("passages", ids)
+
+    def get_case(self, case_id):
+        return self.get_cases([case_id])[case_id]
+
+    def iter_texts(self, table="cases"):
+        """
+        Recorre todos los pares (id, texto) de `cases` o `passages` sin cargarlos a la vez.
+        """
+        if table not in ("cases", "passages"):
+            raise ValueError(f"Tabla desconocida: {table}")
+        cursor = self.conn.execute(f"SELECT id, text FROM {table} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            yield from rows
+
+    def find_cases(self, initials=None, min_age=None, max_age=None):
+        """
+        Ids de los casos que cumplen los filtros (usa los índices de `metadata`).
+
+        Args:
+            initials (str): Iniciales del paciente, en cualquier formato ("M.G.P." o "MGP").
+            min_age (int): Edad mínima (incluida).
+            max_age (int): Edad máxima (incluida).
+
+        Returns:
+            list: Los ids de los casos, ordenados.
+        """
+        if not self.has_metadata:
+            raise ValueError("El almacén no tiene metadatos: reconstruye el índice con data_processor.py.")
+        conditions, params = [], []
+        if initials is not None:
+            conditions.append("iniciales = ?")
+            params.append(normalize_initials(initials))
+        if min_age is not None:
+            conditions.append("edad >= ?")
+            params.append(int(min_age))
+        if max_age is not None:
+            conditions.append("edad <= ?")
+            params.append(int(max_age))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self.conn.execute(f"SELECT case_id FROM metadata {where} ORDER BY case_id", params).fetchall()
+        return [case_id for case_id, in rows]
+
+    def get_metadata(self, ids):
+        """
+        Returns:
+            dict: id del caso -> CaseMetadata, solo para los ids que existen.
+        """
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        if not ids or not self.has_metadata:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT case_id, nombre, iniciales, edad, motivo FROM metadata WHERE case_id IN ({placeholders})",
+                ids
+            ).fetchall()
+        return {row[0]: CaseMetadata(*row[1:]) for row in rows}
+
+    def passage_ids_for_cases(self, case_ids):
+        """
+        Ids de todos los pasajes de los casos indicados.
+        """
+        case_ids = [int(i) for i in case_ids]
+        if not case_ids:
+            return []
+        placeholders = ",".join("?" * len(case_ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id FROM passages WHERE case_id IN ({placeholders}) ORDER BY id", case_ids
+            ).fetchall()
+        return [p_id for p_id, in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    # --- Escritura (solo desde el constructor del índice) ---
+
+    def put_cases(self, cases):
+        """
+        Args:
+            cases (dict): id -> texto. Reemplaza los casos con el mismo id.
+        """
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cases (id, text) VALUES (?, ?)",
+                ((int(case_id), text) for case_id, text in cases.items())
+            )
+            self._put_metadata(cases.items())
+
+    def _put_metadata(self, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO metadata (case_id, nombre, iniciales, edad, motivo) VALUES (?, ?, ?, ?, ?)",
+            ((int(case_id), *parse_case_metadata(text)) for case_id, text in items)
+        )
+
+    def _backfill_metadata(self):
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM metadata LIMIT 1").fetchone() is not None:
+                return
+            if self.conn.execute("SELECT 1 FROM cases LIMIT 1").fetchone() is None:
+                return
+            self._put_metadata(self.conn.execute("SELECT id, text FROM cases"))
+            self.conn.commit()
+
+    def put_passages(self, passages):
+        """
+        Args:
+            passages (list): Tuplas (id del pasaje, id del caso, texto).
+        """
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO passages (id, case_id, text) VALUES (?, ?, ?)",
+                ((int(p_id), int(case_id), text) for p_id, case_id, text in passages)
+            )
+
+    def delete_cases(self, ids):
+        ids = [(int(i),) for i in ids]
+        with self._lock:
+            self.conn.executemany("DELETE FROM cases WHERE id = ?", ids)
+            self.conn.executemany("DELETE FROM metadata WHERE case_id = ?", ids)
+
+    def delete_passages(self, ids):
+        with self._lock:
+            self.conn.executemany("DELETE FROM passages WHERE id = ?", ((int(i),) for i in ids))
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM cases")
+            self.conn.execute("DELETE FROM passages")
+            self.conn.execute("DELETE FROM metadata")
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def store_path_for(cases_path):
+    """
+    Ruta del almacén para una ruta de casos: "patient_cases.pkl" o "patient_cases.db"
+    -> "patient_cases.db". Así los llamadores que aún pasan el .pkl siguen funcionando.
+    """
+    return os.path.splitext(cases_path)[0] + ".db"
+
+
+def legacy_pickle_path(store_path):
+    """
+    Ruta del pickle de casos de versiones anteriores: "patient_cases.db" -> "patient_cases.pkl".
+    """
+    return os.path.splitext(store_path)[0] + ".pkl"
+
+
+def migrate_pickle(pkl_path, store_path, index_path=None):
+    """
+    Convierte el pickle de casos (lista o dict id -> texto) en un CaseStore.
+    Si el índice usa pasajes, migra también el pickle de pasajes que está junto a él.
+
+    Solo debe usarse con pickles generados por nuestro propio data_processor.py:
+    cargar un pickle de origen desconocido puede ejecutar código arbitrario.
+
+    Args:
+        pkl_path (str): El pickle de casos.
+        store_path (str): El almacén SQLite a crear.
+        index_path (str): Ruta del índice FAISS, para encontrar los pasajes.
+    """
+    with open(pkl_path, "rb") as f:
+        cases = pickle.load(f)
+    if isinstance(cases, list):
+        cases = dict(enumerate(cases))
+
+    store = CaseStore(store_path, readonly=False)
+    store.clear()
+    store.put_cases(cases)
+    if index_path:
+        passages_pkl_path = artifact_path(index_path, LEGACY_PASSAGES_SUFFIX)
+        if os.path.exists(passages_pkl_path):
+            chunk_map = np.load(artifact_path(index_path, CHUNK_MAP_SUFFIX))
+            with open(passages_pkl_path, "rb") as f:
+                passages = pickle.load(f)
+            if isinstance(passages, list):
+                passages = dict(enumerate(passages))
+            store.put_passages((p_id, chunk_map[p_id], text) for p_id, text in passages.items())
+    store.commit()
+    store.close()
+    print(f"Migrados {len(cases)} casos de {pkl_path} a {store_path}.")
+
+
+def open_case_store(cases_path, index_path=None):
+    """
+    Abre el almacén de casos en modo lectura. Si todavía no existe pero queda el
+    pickle de una versión anterior, lo migra primero.
+
+    Args:
+        cases_path (str): Ruta del almacén (.db) o del pickle antiguo (.pkl).
+        index_path (str): Ruta del índice FAISS, para migrar también los pasajes.
+
+    Returns:
+        CaseStore: El almacén abierto.
+    """
+    store_path = store_path_for(cases_path)
+    if not os.path.exists(store_path):
+        pkl_path = legacy_pickle_path(store_path)
+        if not os.path.exists(pkl_path):
+            raise FileNotFoundError(f"No se encontró el almacén de casos: {store_path}")
+        print(f"Migrando {pkl_path} al almacén {store_path}...")
+        migrate_pickle(pkl_path, store_path, index_path=index_path)
+    return CaseStore(store_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migra el pickle de casos al almacén SQLite.")
+    parser.add_argument("--pkl-path", default="../models/patient_cases.pkl")
+    parser.add_argument("--store-path", default="../models/patient_cases.db")
+    parser.add_argument("--index-path", default="../models/patient_cases.index")
+    args = parser.parse_args()
+
+    migrate_pickle(args.pkl_path, args.store_path, index_path=args.index_path)
@@ -1,8 +1,9 @@
 # =================================================================
 #  IMPORTACIONES Y CONFIGURACIÓN INICIAL
 # =================================================================
-import os
+import asyncio
 import uuid
+from functools import partial
 from typing import Annotated, List
 from typing_extensions import TypedDict
 
@@ -10,12 +11,18 @@ from dotenv import load_dotenv
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.checkpoint.memory import MemorySaver
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import END, StateGraph, START
 from langgraph.graph.message import add_messages
 
-from retriever import Retriever
+from async_retriever import get_async_retriever, get_executor
+from checkpointer import create_checkpointer
+from context_packer import DEFAULT_CONTEXT_TOKENS, count_tokens
+from history import HistoryManager, build_summary_chain, format_history
+from llm_client import get_chat_model
+from retriever_registry import get_retriever, warm_up
+from streaming import stream_graph_answer, print_latency_report
+from tracing import span
 
 load_dotenv()
 # =================================================================
@@ -28,23 +35,17 @@ class GraphState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages] # guarda el historial de mensajes.
     question: str # almacena la pregunta actual del usuario.
     context: str # almacena el contexto relevante recuperado para la pregunta.
+    summary: str # resumen de los turnos antiguos que ya salieron del historial.
 
 # --- Componentes de LangChain ---
 
-# El modelo de lenguaje que generará las respuestas.
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    google_api_key=os.getenv("GOOGLE_API_KEY")
-)
-
 # El sistema de recuperación (Retriever) que busca información relevante.
-print("Cargando Retriever...")
-retriever = Retriever(
-    index_path="./models/patient_cases.index",
-    cases_path="./models/patient_cases.pkl",
-    model_name="all-mpnet-base-v2"
-)
-print("Retriever listo.")
+# Se comparte a través del registro y se carga en la primera búsqueda.
+INDEX_PATH = "./models/patient_cases.index"
+CASES_PATH = "./models/patient_cases.db"
+MODEL_NAME = "all-mpnet-base-v2"
+# Tokens máximos del contexto recuperado que entra en el prompt (ver context_packer.py).
+CONTEXT_TOKENS = DEFAULT_CONTEXT_TOKENS
 
 prompt_template = ChatPromptTemplate.from_template(
     """Usa el siguiente contexto y el historial de la conversación para responder la pregunta.
@@ -61,43 +62,143 @@ Respuesta:
 """
 )
 
-# La cadena (chain) que une el prompt, el modelo y el formateador de salida.
-rag_chain = prompt_template | llm | StrOutputParser()
+def build_rag_chain(llm):
+    """
+    La cadena (chain) que une el prompt, el modelo y el formateador de salida.
+    """
+    return prompt_template | llm | StrOutputParser()
+
+_llm = None
+_rag_chain = None
+_history_manager = None
+
+def get_llm():
+    """
+    El modelo de Gemini. Se crea en el primer uso, así el grafo puede construirse
+    con otra cadena (p. ej. un LLM simulado) sin API key.
+    """
+    global _llm
+    if _llm is None:
+        # El modelo de lenguaje que generará las respuestas (compartido, ver llm_client.py).
+        _llm = get_chat_model()
+    return _llm
+
+def get_rag_chain():
+    """
+    La cadena RAG con Gemini.
+    """
+    global _rag_chain
+    if _rag_chain is None:
+        _rag_chain = build_rag_chain(get_llm())
+    return _rag_chain
+
+def get_history_manager():
+    """
+    El gestor del historial por defecto: ventana de turnos recientes y resumen
+    de los anteriores hecho por Gemini (ver history.py).
+    """
+    global _history_manager
+    if _history_manager is None:
+        _history_manager = HistoryManager(summarizer=build_summary_chain(get_llm()))
+    return _history_manager
 
 
 # =================================================================
 #  DEFINICIÓN DE LOS NODOS DEL GRAFO
 # =================================================================
 
+def manage_history_node(state: GraphState, config: RunnableConfig, history_manager=None):
+    """
+    Nodo 0: Mantiene acotado el historial. Los turnos que salen de la ventana se
+    añaden al resumen y se eliminan del estado.
+    """
+    manager = history_manager or get_history_manager()
+    with span("node.history", messages=len(state["messages"])):
+        return manager.update(state.get("summary", ""), state["messages"], config=config)
+
+
 def retrieve_context_node(state: GraphState):
     """
     Nodo 1: Recupera contexto relevante para la pregunta del usuario.
     """
     print("...recuperando contexto...")
     question = state["messages"][-1].content
-    context = retriever.search(question)
+    with span("node.retrieve"):
+        retriever = get_retriever(INDEX_PATH, CASES_PATH, MODEL_NAME)
+        context = retriever.get_context(question, max_tokens=CONTEXT_TOKENS)
     return {"question": question, "context": context}
 
 
-def generate_answer_node(state: GraphState):
+def build_chain_inputs(state: GraphState):
+    """
+    Prepara las entradas de la cadena RAG: pregunta, contexto e historial formateado
+    (el resumen de los turnos antiguos y los mensajes de la ventana reciente).
+    """
+    history = format_history(state.get("summary", ""), state["messages"][:-1])
+    return {
+        "context": state["context"],
+        "question": state["question"],
+        "history": history
+    }
+
+
+def inputs_tokens(inputs):
+    """
+    Tokens (aproximados, por palabras) de las entradas del prompt.
+    """
+    return sum(count_tokens(value) for value in inputs.values())
+
+
+def generate_answer_node(state: GraphState, config: RunnableConfig, chain=None):
     """
     Nodo 2: Genera una respuesta usando la pregunta, el contexto y el historial.
+    Recibe la `config` del grafo para que los tokens del LLM se emitan en streaming.
     """
     print("...generando respuesta...")
-    question = state["question"]
-    context = state["context"]
-
-    # Formatea el historial para pasarlo al prompt.
-    history = "\n".join(
-        f"{msg.type}: {msg.content}" for msg in state["messages"][:-1]
-    )
-
-    # Invoca la cadena RAG con toda la información necesaria.
-    response = rag_chain.invoke({
-        "context": context,
-        "question": question,
-        "history": history
-    })
+    with span("node.generate"):
+        with span("format_prompt"):
+            inputs = build_chain_inputs(state)
+        # Invoca la cadena RAG con toda la información necesaria.
+        with span("llm", prompt_tokens=inputs_tokens(inputs)) as s:
+            response = (chain or get_rag_chain()).invoke(inputs, config=config)
+            s.set(response_tokens=count_tokens(response))
+    return {"messages": [AIMessage(content=response)]}
+
+
+# --- Versiones asíncronas de los nodos, para atender muchas sesiones a la vez ---
+
+async def amanage_history_node(state: GraphState, config: RunnableConfig, history_manager=None):
+    manager = history_manager or get_history_manager()
+    with span("node.history", messages=len(state["messages"])):
+        return await manager.aupdate(state.get("summary", ""), state["messages"], config=config)
+
+
+async def aretrieve_context_node(state: GraphState):
+    """
+    Nodo 1 (async): la carga del Retriever y la búsqueda corren en el pool de hilos,
+    y las búsquedas concurrentes de varias sesiones se agrupan en un solo lote.
+    """
+    question = state["messages"][-1].content
+    with span("node.retrieve"):
+        loop = asyncio.get_running_loop()
+        retriever = await loop.run_in_executor(
+            get_executor(), partial(get_retriever, INDEX_PATH, CASES_PATH, MODEL_NAME)
+        )
+        hits = await get_async_retriever(retriever).search_hits(question)
+        context = retriever.pack_context(hits, max_tokens=CONTEXT_TOKENS).text
+    return {"question": question, "context": context}
+
+
+async def agenerate_answer_node(state: GraphState, config: RunnableConfig, chain=None):
+    """
+    Nodo 2 (async): la llamada al LLM no bloquea el event loop.
+    """
+    with span("node.generate"):
+        with span("format_prompt"):
+            inputs = build_chain_inputs(state)
+        with span("llm", prompt_tokens=inputs_tokens(inputs)) as s:
+            response = await (chain or get_rag_chain()).ainvoke(inputs, config=config)
+            s.set(response_tokens=count_tokens(response))
     return {"messages": [AIMessage(content=response)]}
 
 
@@ -105,62 +206,83 @@ def generate_answer_node(state: GraphState):
 #  CONSTRUCCIÓN Y COMPILACIÓN DEL GRAFO
 # =================================================================
 
-# Creamos una instancia del grafo y le asignamos la estructura de nuestro estado.
-workflow = StateGraph(GraphState)
+def build_app(chain=None, checkpointer=None, use_async=False, history_manager=None):
+    """
+    Construye y compila el grafo.
+
+    Args:
+        chain: La cadena RAG a usar (por defecto, la de Gemini).
+        checkpointer: Dónde se guarda el estado de cada conversación.
+        use_async (bool): Usar los nodos asíncronos (para `app.ainvoke`/`astream`).
+        history_manager (HistoryManager): Límites del historial y resumidor
+            (por defecto, `get_history_manager()`).
+    """
+    # Creamos una instancia del grafo y le asignamos la estructura de nuestro estado.
+    workflow = StateGraph(GraphState)
 
-# Registramos nuestras funciones como nodos dentro del grafo.
-workflow.add_node("retrieve", retrieve_context_node)
-workflow.add_node("generate", generate_answer_node)
+    # Registramos nuestras funciones como nodos dentro del grafo.
+    if use_async:
+        workflow.add_node("history", partial(amanage_history_node, history_manager=history_manager))
+        workflow.add_node("retrieve", aretrieve_context_node)
+        workflow.add_node("generate", partial(agenerate_answer_node, chain=chain))
+    else:
+        workflow.add_node("history", partial(manage_history_node, history_manager=history_manager))
+        workflow.add_node("retrieve", retrieve_context_node)
+        workflow.add_node("generate", partial(generate_answer_node, chain=chain))
 
-# Definimos el flujo de ejecución.
-workflow.add_edge(START, "retrieve")
-workflow.add_edge("retrieve", "generate")
-workflow.add_edge("generate", END)
+    # Definimos el flujo de ejecución.
+    workflow.add_edge(START, "history")
+    workflow.add_edge("history", "retrieve")
+    workflow.add_edge("retrieve", "generate")
+    workflow.add_edge("generate", END)
 
-# Compilamos el grafo y le añadimos un 'checkpointer' con memoria.
-memory = MemorySaver()
-app = workflow.compile(checkpointer=memory)
+    return workflow.compile(checkpointer=checkpointer)
 
 
 # =================================================================
 #  EJECUCIÓN DEL CHATBOT INTERACTIVO
 # =================================================================
 
-# Generamos un ID único para la conversación.
-thread_id = str(uuid.uuid4())
-config = {"configurable": {"thread_id": thread_id}}
-
-print("\n================================================================================")
-print(" Asistente RAG con Memoria Iniciado")
-print("================================================================================")
-print(f" ID de sesión: {thread_id}")
-print(" Escribe 'salir' para terminar la conversación.\n")
-
-
-while True:
-    user_input = input(">> ")
-    if user_input.lower() in ["salir", "exit"]:
-        print("\n================================================================================")
-        print(" Sesión Finalizada")
+if __name__ == "__main__":
+    # Compilamos el grafo y le añadimos un 'checkpointer' con memoria: en SQLite si se
+    # define CHECKPOINT_DB (persistente y acotado), o en memoria si no. Se hace aquí y
+    # no al importar el módulo, así rag_server.py no abre otro checkpointer.
+    memory = create_checkpointer()
+    app = build_app(checkpointer=memory)
+
+    # Cargamos el Retriever en segundo plano mientras el usuario escribe su primera pregunta.
+    warm_up(INDEX_PATH, CASES_PATH, MODEL_NAME, in_background=True)
+
+    # Generamos un ID único para la conversación.
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+
+    print("\n================================================================================")
+    print(" Asistente RAG con Memoria Iniciado")
+    print("================================================================================")
+    print(f" ID de sesión: {thread_id}")
+    print(" Escribe 'salir' para terminar la conversación.\n")
+
+
+    while True:
+        user_input = input(">> ")
+        if user_input.lower() in ["salir", "exit"]:
+            print("\n================================================================================")
+            print(" Sesión Finalizada")
+            print("================================================================================\n")
+            break
+
+        print("\n================================ Human Message =================================")
+        print(user_input)
+
+        # Enviamos la pregunta del usuario al grafo e imprimimos la respuesta
+        # token a token a medida que la genera el nodo "generate".
+        print("\n================================== Ai Message ==================================")
+        result = stream_graph_answer(
+            app,
+            {"messages": [HumanMessage(content=user_input)]},
+            config=config,
+            nodes=("generate",)
+        )
+        print_latency_report(result)
         print("================================================================================\n")
-        break
-
-    print("\n================================ Human Message =================================")
-    print(user_input)
-
-    # Enviamos la pregunta del usuario al grafo.
-    events = app.stream(
-        {"messages": [HumanMessage(content=user_input)]},
-        config=config,
-        stream_mode="values"
-    )
-
-    # Procesamos la salida del stream para obtener la respuesta final.
-    for event in events:
-        final_state = event
-
-    # Imprimimos la última respuesta generada por el asistente.
-    ai_response = final_state["messages"][-1].content
-    print("\n================================== Ai Message ==================================")
-    print(ai_response)
-    print("================================================================================\n")
@@ -0,0 +1,366 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import InMemorySaver, MemorySaver
+
+# Si se define, los grafos guardan las conversaciones en este archivo SQLite en
+# lugar de en memoria (ver `create_checkpointer`).
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, parent_id TEXT,
+    type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, task_id TEXT, idx INTEGER,
+    channel TEXT, type TEXT, value BLOB, task_path TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT, checkpoint_ns TEXT, channel TEXT, version, type TEXT, value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY, size INTEGER, last_access REAL
+);
+"""
+
+INSERT_SQL = {
+    "checkpoints": "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    "writes": "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "blobs": "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+}
+
+
+class SQLiteCheckpointer(InMemorySaver):
+    """
+    Checkpointer de LangGraph persistente en un archivo SQLite, con tamaño acotado.
+
+    Las conversaciones activas se sirven desde memoria (igual que MemorySaver),
+    así que leer el estado no toca el disco. Las escrituras se encolan y un hilo
+    en segundo plano las guarda por lotes (cada `flush_interval` segundos o cada
+    `batch_size` filas) en una sola transacción: guardar un checkpoint no añade
+    latencia al turno.
+
+    Límites:
+      - Conversaciones inactivas más de `max_idle_seconds`: se borran.
+      - Tamaño total por encima de `max_bytes`: se borran las menos usadas.
+      - Más de `max_memory_threads` conversaciones en memoria: las menos usadas
+        salen de memoria (siguen en disco y se recargan al volver a usarse).
+
+    Al reiniciar el proceso, las conversaciones se recuperan del archivo.
+    """
+
+    def __init__(self, path, max_idle_seconds=7 * 24 * 3600, max_bytes=512 * 1024 ** 2,
+                 max_memory_threads=1000, flush_interval=0.5, batch_size=512, evict_interval=60.0):
+        """
+        Args:
+            path (str): Ruta del archivo SQLite.
+            max_idle_seconds (float): Antigüedad máxima (sin uso) de una conversación.
+            max_bytes (int): Tamaño máximo de todas las conversaciones guardadas.
+            max_memory_threads (int): Conversaciones que se mantienen en memoria.
+            flush_interval (float): Segundos máximos que una escritura espera en la cola.
+            batch_size (int): Filas en cola que fuerzan a escribir el lote.
+            evict_interval (float): Cada cuántos segundos se aplican los límites.
+        """
+        super().__init__()
+        self.path = path
+        self.max_idle_seconds = max_idle_seconds
+        self.max_bytes = max_bytes
+        self.max_memory_threads = max_memory_threads
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.evict_interval = evict_interval
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+        self._lock = threading.RLock()
+        self._db_lock = threading.Lock()
+        # Operaciones pendientes de escribir, en orden: (tabla, fila) o ("delete", thread_id).
+        self._pending = []
+        # Conversaciones en memoria (orden LRU) -> claves de sus writes y blobs.
+        self._in_memory = OrderedDict()
+        # Todas las conversaciones conocidas (en memoria o solo en disco).
+        self._sizes = {}
+        self._last_access = {}
+        self._dirty_threads = set()
+        for thread_id, size, last_access in self.conn.execute("SELECT thread_id, size, last_access FROM threads"):
+            self._sizes[thread_id] = size
+            self._last_access[thread_id] = last_access
+        self.evict()
+
+        self._closed = False
+        self._wake = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="checkpointer-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # --- Estado en memoria ---
+
+    def _touch(self, thread_id):
+        self._last_access[thread_id] = time.time()
+        self._dirty_threads.add(thread_id)
+        self._in_memory.move_to_end(thread_id)
+
+    def _ensure_loaded(self, thread_id):
+        """
+        Carga en memoria una conversación que solo está en disco (o registra una nueva).
+        """
+        if thread_id in self._in_memory:
+            return
+        self._in_memory[thread_id] = {"writes": set(), "blobs": set()}
+        self._sizes.setdefault(thread_id, 0)
+        if self._sizes[thread_id] == 0:
+            return
+        keys = self._in_memory[thread_id]
+        with self._db_lock:
+            checkpoints = self.conn.execute(
+                "SELECT checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata "
+                "FROM checkpoints WHERE thread_id = ?", (thread_id,)).fetchall()
+            writes = self.conn.execute(
+                "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path "
+                "FROM writes WHERE thread_id = ?", (thread_id,)).fetchall()
+            blobs = self.conn.execute(
+                "SELECT checkpoint_ns, channel, version, type, value FROM blobs WHERE thread_id = ?",
+                (thread_id,)).fetchall()
+        for ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata in checkpoints:
+            self.storage[thread_id][ns][checkpoint_id] = ((type_, checkpoint), (metadata_type, metadata), parent_id)
+        for ns, checkpoint_id, task_id, idx, channel, type_, value, task_path in writes:
+            outer_key = (thread_id, ns, checkpoint_id)
+            self.writes.setdefault(outer_key, {})[(task_id, idx)] = (task_id, channel, (type_, value), task_path)
+            keys["writes"].add(outer_key)
+        for ns, channel, version, type_, value in blobs:
+            blob_key = (thread_id, ns, channel, version)
+            self.blobs[blob_key] = (type_, value)
+            keys["blobs"].add(blob_key)
+
+    def _drop_from_memory(self, thread_id):
+        keys = self._in_memory.pop(thread_id, None)
+        if keys is None:
+            return
+        self.storage.pop(thread_id, None)
+        for outer_key in keys["writes"]:
+            self.writes.pop(outer_key, None)
+        for blob_key in keys["blobs"]:
+            self.blobs.pop(blob_key, None)
+
+    def _enqueue(self, thread_id, table, row, size):
+        self._pending.append((table, row))
+        self._sizes[thread_id] = self._sizes.get(thread_id, 0) + size
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    # --- API de BaseCheckpointSaver ---
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._ensure_loaded(thread_id)
+            self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            if config:
+                thread_id = config["configurable"]["thread_id"]
+                self._ensure_loaded(thread_id)
+                self._touch(thread_id)
+            return iter(list(super().list(config, filter=filter, before=before, limit=limit)))
+
+    def get_delta_channel_history(self, *, config, channels):
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._ensure_loaded(thread_id)
+            return super().get_delta_channel_history(config=config, channels=channels)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            self._ensure_loaded(thread_id)
+            self._touch(thread_id)
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            checkpoint_id = next_config["configurable"]["checkpoint_id"]
+            (type_, data), (metadata_type, metadata_data), parent_id = self.storage[thread_id][ns][checkpoint_id]
+            self._enqueue(thread_id, "checkpoints",
+                          (thread_id, ns, checkpoint_id, parent_id, type_, data, metadata_type, metadata_data),
+                          len(data) + len(metadata_data))
+            keys = self._in_memory[thread_id]
+            for channel, version in new_versions.items():
+                blob_key = (thread_id, ns, channel, version)
+                blob_type, blob = self.blobs[blob_key]
+                keys["blobs"].add(blob_key)
+                self._enqueue(thread_id, "blobs", (thread_id, ns, channel, version, blob_type, blob), len(blob))
+            return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        outer_key = (thread_id, ns, checkpoint_id)
+        with self._lock:
+            self._ensure_loaded(thread_id)
+            self._touch(thread_id)
+            before = dict(self.writes.get(outer_key, {}))
+            super().put_writes(config, writes, task_id, task_path)
+            self._in_memory[thread_id]["writes"].add(outer_key)
+            for (write_task_id, idx), value in self.writes.get(outer_key, {}).items():
+                if before.get((write_task_id, idx)) is value:
+                    continue
+                _, channel, (type_, data), write_task_path = value
+                self._enqueue(thread_id, "writes",
+                              (thread_id, ns, checkpoint_id, write_task_id, idx, channel, type_, data, write_task_path),
+                              len(data))
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._drop_from_memory(thread_id)
+            self._sizes.pop(thread_id, None)
+            self._last_access.pop(thread_id, None)
+            self._dirty_threads.discard(thread_id)
+            self._pending.append(("delete", thread_id))
+            self._wake.set()
+
+    # --- Escritura por lotes y límites ---
+
+    def flush(self):
+        """
+        Escribe en disco, en una sola transacción, todas las operaciones en cola.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            threads = [(t, self._sizes.get(t, 0), self._last_access[t])
+                       for t in self._dirty_threads if t in self._last_access]
+            self._dirty_threads = set()
+        if not pending and not threads:
+            return
+        with self._db_lock:
+            batches = {}
+            for table, row in pending:
+                if table == "delete":
+                    self._write_batches(batches)
+                    self._delete_from_db([row])
+                else:
+                    batches.setdefault(table, []).append(row)
+            self._write_batches(batches)
+            self.conn.executemany("INSERT OR REPLACE INTO threads VALUES (?, ?, ?)", threads)
+            self.conn.commit()
+
+    def _write_batches(self, batches):
+        for table, rows in batches.items():
+            self.conn.executemany(INSERT_SQL[table], rows)
+        batches.clear()
+
+    def _delete_from_db(self, thread_ids):
+        rows = [(thread_id,) for thread_id in thread_ids]
+        for table in ("checkpoints", "writes", "blobs", "threads"):
+            self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", rows)
+
+    def evict(self):
+        """
+        Aplica los límites de antigüedad, tamaño total y conversaciones en memoria.
+
+        Returns:
+            int: Conversaciones borradas.
+        """
+        with self._lock:
+            # Las conversaciones con escrituras en cola no se tocan hasta que se escriban.
+            busy = {row[0] for table, row in self._pending if table != "delete"}
+            now = time.time()
+            expired = [t for t, last in self._last_access.items()
+                       if now - last > self.max_idle_seconds and t not in busy]
+            total = sum(self._sizes.values()) - sum(self._sizes.get(t, 0) for t in expired)
+            if total > self.max_bytes:
+                expired_set = set(expired)
+                for thread_id in sorted(self._last_access, key=self._last_access.get):
+                    if total <= self.max_bytes:
+                        break
+                    if thread_id in busy or thread_id in expired_set:
+                        continue
+                    expired.append(thread_id)
+                    total -= self._sizes.get(thread_id, 0)
+            for thread_id in expired:
+                self._drop_from_memory(thread_id)
+                self._sizes.pop(thread_id, None)
+                self._last_access.pop(thread_id, None)
+                self._dirty_threads.discard(thread_id)
+
+            for thread_id in list(self._in_memory):
+                if len(self._in_memory) <= self.max_memory_threads:
+                    break
+                if thread_id not in busy:
+                    self._drop_from_memory(thread_id)
+
+        if expired:
+            with self._db_lock:
+                self._delete_from_db(expired)
+                self.conn.commit()
+        return len(expired)
+
+    def _flush_loop(self):
+        last_evict = time.monotonic()
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if len(self._in_memory) > self.max_memory_threads or \
+                    time.monotonic() - last_evict > self.evict_interval:
+                self.evict()
+                last_evict = time.monotonic()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Conversaciones guardadas, en memoria, bytes totales y filas en cola.
+        """
+        with self._lock:
+            return {
+                "threads": len(self._sizes),
+                "in_memory": len(self._in_memory),
+                "bytes": sum(self._sizes.values()),
+                "pending": len(self._pending),
+            }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._flusher.join()
+        self.flush()
+        self.conn.close()
+
+
+# Un solo SQLiteCheckpointer por archivo: dos instancias sobre el mismo archivo
+# tendrían cada una su hilo de escritura y su desalojo, y una podría borrar
+# conversaciones que la otra está usando.
+_checkpointers = {}
+_checkpointers_lock = threading.Lock()
+
+
+def create_checkpointer(path=CHECKPOINT_DB, **kwargs):
+    """
+    El checkpointer de los grafos: SQLiteCheckpointer si se indica un archivo
+    (por defecto, la variable de entorno CHECKPOINT_DB) o MemorySaver si no.
+
+    Con un archivo, todas las llamadas con la misma ruta devuelven la misma
+    instancia (`kwargs` solo se aplica al crearla).
+    """
+    if not path:
+        return MemorySaver()
+    key = os.path.realpath(path)
+    with _checkpointers_lock:
+        checkpointer = _checkpointers.get(key)
+        if checkpointer is None or checkpointer._closed:
+            checkpointer = _checkpointers[key] = SQLiteCheckpointer(path, **kwargs)
+        return checkpointer
@@ -0,0 +1,146 @@
+import re
+from typing import NamedTuple
+
+# Presupuesto de tokens por defecto para el contexto del prompt.
+DEFAULT_CONTEXT_TOKENS = 1500
+CASE_SEPARATOR = "\n\n---\n\n"
+# Por debajo de este hueco no merece la pena añadir un caso recortado.
+MIN_TRIMMED_TOKENS = 32
+TRIM_MARKER = " […]"
+
+_SEGMENT_RE = re.compile(r'[^\n.!?]+(?:[.!?]+|$)', re.MULTILINE)
+
+
+class PackedContext(NamedTuple):
+    """
+    El contexto listo para el prompt y lo que se incluyó en él.
+    """
+    text: str
+    case_ids: list
+    tokens: int
+    truncated: bool
+
+
+def token_offsets(text, tokenizer=None):
+    """
+    Offsets (inicio, fin) de cada token del texto. Sin tokenizador, se cuentan
+    palabras separadas por espacios (como en `chunk_cases`).
+    """
+    if tokenizer is not None:
+        return tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    return [match.span() for match in re.finditer(r'\S+', text)]
+
+
+def count_tokens(text, tokenizer=None):
+    return len(token_offsets(text, tokenizer))
+
+
+def trim_to_tokens(text, max_tokens, tokenizer=None):
+    """
+    Recorta el texto a sus primeros `max_tokens` tokens, sin partir tokens.
+    """
+    offsets = token_offsets(text, tokenizer)
+    if len(offsets) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    return text[:offsets[max_tokens - 1][1]]
+
+
+def _order_hits(hits):
+    # Mayor `score` es mejor (RRF, cross-encoder); si no hay score, menor distancia.
+    if hits and all(hit.score is not None for hit in hits):
+        return sorted(hits, key=lambda hit: -hit.score)
+    return sorted(hits, key=lambda hit: hit.distance)
+
+
+def _segments(text):
+    return [m.group(0).strip() for m in _SEGMENT_RE.finditer(text) if m.group(0).strip()]
+
+
+def _case_blocks(hits):
+    """
+    Agrupa los resultados por caso, en el orden del mejor resultado de cada caso.
+
+    Los pasajes de un mismo caso se solapan (ver `chunk_cases`): las frases que ya
+    aparecieron en un pasaje anterior del caso se quitan del siguiente. Un texto
+    idéntico a otro ya incluido se descarta.
+    """
+    blocks = {}
+    seen_texts = set()
+    for hit in _order_hits(hits):
+        text = hit.text.strip()
+        key = " ".join(text.split())
+        if not text or key in seen_texts:
+            continue
+        seen_texts.add(key)
+        block = blocks.setdefault(hit.case_id, {"parts": [], "segments": set()})
+        if block["parts"]:
+            new_segments = [s for s in _segments(text) if s not in block["segments"]]
+            if not new_segments:
+                continue
+            text = " ".join(new_segments)
+        block["segments"].update(_segments(text))
+        block["parts"].append(text)
+    return [(case_id, "\n[…]\n".join(block["parts"])) for case_id, block in blocks.items()]
+
+
+def pack_context(hits, tokenizer=None, max_tokens=DEFAULT_CONTEXT_TOKENS):
+    """
+    Reúne los resultados de una búsqueda en un contexto para el prompt que no
+    supera `max_tokens` tokens.
+
+    Los casos se ordenan por relevancia y se añaden enteros mientras quepan; el
+    primero que no cabe se recorta al espacio restante y el resto se descarta.
+    Los pasajes solapados de un mismo caso se unen sin repetir texto.
+
+    Args:
+        hits (list): Los SearchHit de la búsqueda.
+        tokenizer: Tokenizador rápido de HuggingFace (p. ej. `retriever.tokenizer`).
+            Si es None, se cuentan palabras separadas por espacios.
+        max_tokens (int): Presupuesto de tokens del contexto.
+
+    Returns:
+        PackedContext: El texto, los ids de los casos incluidos, los tokens usados
+            y si se recortó o descartó algún caso.
+    """
+    separator_tokens = count_tokens(CASE_SEPARATOR, tokenizer)
+    parts = []
+    case_ids = []
+    used = 0
+    truncated = False
+    for case_id, text in _case_blocks(hits):
+        block = f"[Caso {case_id}]\n{text}"
+        cost = count_tokens(block, tokenizer) + (separator_tokens if parts else 0)
+        if used + cost <= max_tokens:
+            parts.append(block)
+            case_ids.append(case_id)
+            used += cost
+            continue
+
+        truncated = True
+        remaining = max_tokens - used - (separator_tokens if parts else 0) - count_tokens(TRIM_MARKER, tokenizer)
+        if remaining >= MIN_TRIMMED_TOKENS:
+            block = trim_to_tokens(block, remaining, tokenizer) + TRIM_MARKER
+            parts.append(block)
+            case_ids.append(case_id)
+            used += count_tokens(block, tokenizer) + (separator_tokens if len(parts) > 1 else 0)
+        break
+
+    return PackedContext(CASE_SEPARATOR.join(parts), case_ids, used, truncated)
+
+
+if __name__ == "__main__":
+    from retriever import SearchHit
+
+    caso = ("Nombre: M.G.P.\nEdad: 27 años\nMotivo de consulta: 'No tengo ganas de hacer nada en la "
+            "universidad, siento que estoy estancada.' La paciente atribuye esta desmotivación a su "
+            "frustración por no conseguir trabajo.")
+    hits = [
+        SearchHit(case_id=3, text=caso, distance=0.4),
+        SearchHit(case_id=3, text=caso.split("\n", 2)[2], distance=0.6, passage_id=8),
+        SearchHit(case_id=7, text="Nombre: J.R.T.\nEdad: 35 años\n" + "Insomnio persistente. " * 40, distance=0.9),
+    ]
+    packed = pack_context(hits, max_tokens=80)
+    print(packed.text)
+    print(f"\n[{packed.tokens} tokens | casos: {packed.case_ids} | recortado: {packed.truncated}]")
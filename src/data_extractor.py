@@ -1,8 +1,24 @@
+import os
+
 import docx
 
-def extract_text_from_docx(file_path):
+# Extensiones de los archivos de casos que se pueden ingerir.
+SUPPORTED_EXTENSIONS = (".docx", ".txt")
+
+
+class ExtractionError(Exception):
     """
-    Extrae el texto de un archivo .docx.
+    No se pudo leer el texto de un archivo de casos.
+    """
+
+
+def read_docx_text(file_path):
+    """
+    Extrae el texto de un archivo .docx, un párrafo por línea.
+
+    A diferencia de `extract_text_from_docx`, los errores se lanzan como
+    `ExtractionError` en lugar de devolverse como texto (que se segmentaría
+    como si fuera un caso).
 
     Args:
         file_path (str): La ruta al archivo .docx.
@@ -12,18 +28,48 @@ def extract_text_from_docx(file_path):
     """
     try:
         document = docx.Document(file_path)
+    except FileNotFoundError as e:
+        raise ExtractionError(f"El archivo no se encontró: {file_path}") from e
+    except Exception as e:
+        raise ExtractionError(f"No se pudo leer {file_path}: {e}") from e
+    return '\n'.join(para.text for para in document.paragraphs)
+
+
+def extract_text(file_path):
+    """
+    Extrae el texto de un archivo de casos (.docx o .txt en UTF-8).
 
-        full_text = []
+    Raises:
+        ExtractionError: Si la extensión no está soportada o el archivo no se puede leer.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".docx":
+        return read_docx_text(file_path)
+    if extension == ".txt":
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            raise ExtractionError(f"No se pudo leer {file_path}: {e}") from e
+    raise ExtractionError(f"Extensión no soportada: {file_path}")
 
-        for para in document.paragraphs:
-            full_text.append(para.text)
 
-        return '\n'.join(full_text)
+def extract_text_from_docx(file_path):
+    """
+    Extrae el texto de un archivo .docx.
 
-    except FileNotFoundError:
-        return "Error: El archivo no se encontró en la ruta especificada."
-    except Exception as e:
-        return f"Ha ocurrido un error inesperado: {e}"
+    Args:
+        file_path (str): La ruta al archivo .docx.
+
+    Returns:
+        str: El texto extraído del documento.
+    """
+    try:
+        return read_docx_text(file_path)
+    except ExtractionError as e:
+        if isinstance(e.__cause__, FileNotFoundError):
+            return "Error: El archivo no se encontró en la ruta especificada."
+        return f"Ha ocurrido un error inesperado: {e.__cause__}"
 
 if __name__ == "__main__":
     file_path = "./data/Casos.docx"
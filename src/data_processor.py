@@ -1,9 +1,18 @@
-from data_extractor import extract_text_from_docx
+from data_extractor import read_docx_text
 import re
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
-import pickle
+import argparse
+import hashlib
+import json
+import os
+import uuid
+
+from bm25 import BM25Index
+from encoders import ENCODER_BACKEND, ENCODER_BACKENDS, load_encoder
+from case_store import CaseStore, legacy_pickle_path, migrate_pickle, store_path_for
+from index_factory import create_index, prepare_vectors, supports_removal, DEFAULT_INDEX_SPEC, DEFAULT_METRIC, METRICS
+from index_files import artifact_path, CHUNK_MAP_SUFFIX, MANIFEST_SUFFIX, BM25_SUFFIX
 
 def segment_cases(full_text):
     """
@@ -32,32 +41,305 @@ def segment_cases(full_text):
 
     return [case for case in processed_cases if case.startswith("Nombre")]
 
+def chunk_cases(cases, tokenizer=None, max_tokens=256, overlap=64):
+    """
+    Divide cada caso clínico en pasajes solapados de como máximo `max_tokens` tokens.
+
+    Los pasajes se cortan sobre los offsets de los tokens, así que cada pasaje es
+    un fragmento literal del caso original.
+
+    Args:
+        cases (list): Los textos de los casos clínicos.
+        tokenizer: Tokenizador rápido de HuggingFace (p. ej. `model.tokenizer`).
+            Si es None, se cuentan palabras separadas por espacios.
+        max_tokens (int): Número máximo de tokens por pasaje.
+        overlap (int): Tokens compartidos entre pasajes consecutivos.
+
+    Returns:
+        tuple: (pasajes, chunk_map) donde chunk_map[i] es el id del caso del pasaje i.
+    """
+    if overlap >= max_tokens:
+        raise ValueError("El solapamiento debe ser menor que el tamaño del pasaje.")
+    step = max_tokens - overlap
+
+    passages = []
+    chunk_map = []
+    for case_id, case in enumerate(cases):
+        if tokenizer is not None:
+            encoding = tokenizer(case, add_special_tokens=False, return_offsets_mapping=True)
+            offsets = encoding["offset_mapping"]
+        else:
+            offsets = [match.span() for match in re.finditer(r'\S+', case)]
+
+        if not offsets:
+            continue
+        start = 0
+        while True:
+            window = offsets[start:start + max_tokens]
+            passages.append(case[window[0][0]:window[-1][1]])
+            chunk_map.append(case_id)
+            if start + max_tokens >= len(offsets):
+                break
+            start += step
+
+    return passages, chunk_map
+
 def embedding_encode(arr, model):
     passage_embeddings = model.encode(arr)
     # tensor -> numpy array
     passage_embeddings = np.array(passage_embeddings).astype('float32')  # Convertimos a float32 para FAISS
     return passage_embeddings
 
+def case_keys(cases):
+    """
+    Asigna una clave estable a cada caso: su primera línea (p. ej. "Nombre: M.G.P."),
+    con un sufijo si hay varios casos con la misma primera línea.
 
-if __name__ == "__main__":
-    file_path = "../data/Casos.docx"
+    Returns:
+        list: Una lista de pares (clave, texto del caso).
+    """
+    seen = {}
+    keyed = []
+    for case in cases:
+        first_line = case.split("\n", 1)[0].strip()
+        seen[first_line] = seen.get(first_line, 0) + 1
+        keyed.append((f"{first_line}#{seen[first_line]}", case))
+    return keyed
 
-    clinical_text = extract_text_from_docx(file_path)
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    patient_cases = segment_cases(clinical_text)
-    model = SentenceTransformer("all-mpnet-base-v2") # cargamos el modelo preentrenado embedding
-    patient_cases_embeddings = embedding_encode(patient_cases, model) # salida: shape [30, 786] -> 786 es el tamaño del embedding
-    print("Tamaño del embedding:", patient_cases_embeddings.shape)
-    # ahora vamos a crear el iindice faiss, usando la clase IndexFlatL2
-    index = faiss.IndexFlatL2(patient_cases_embeddings.shape[1])  # L2 distance
-    index.add(patient_cases_embeddings)
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_manifest(manifest_path, settings, next_case_id, next_vector_id, entries):
+    """
+    Guarda el manifiesto del índice (escritura atómica). Cada escritura recibe un
+    `build_id` nuevo, que invalida las cachés ligadas al índice anterior.
+    """
+    manifest = {
+        "settings": settings,
+        "build_id": uuid.uuid4().hex,
+        "next_case_id": next_case_id,
+        "next_vector_id": next_vector_id,
+        "cases": entries,
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+def build_index(patient_cases, model, index_path, cases_path, chunk_tokens=None, chunk_overlap=64,
+                model_name=None, incremental=False, index_spec=DEFAULT_INDEX_SPEC, metric=DEFAULT_METRIC,
+                backend=ENCODER_BACKEND):
+    """
+    Codifica los casos, construye el índice FAISS y guarda los textos en el CaseStore.
+
+    El tipo de índice se elige con `index_spec` (ver index_factory.py) y se envuelve
+    en un `IndexIDMap`: cada vector tiene un id propio (el id del caso, o el del
+    pasaje si se usan pasajes). Junto al índice se guarda un manifiesto con
+    el hash del contenido de cada caso. En modo incremental solo se codifican los
+    casos nuevos o modificados, y los eliminados se quitan del índice con `remove_ids`.
+
+    Si se indica `chunk_tokens`, el índice se construye sobre pasajes solapados y
+    se guardan también los pasajes (en el CaseStore) y el mapa pasaje -> caso junto al índice.
+
+    Junto al índice denso se guarda también un índice léxico BM25 sobre las mismas
+    unidades (casos o pasajes) para la búsqueda híbrida.
+
+    Args:
+        patient_cases (list): Los textos de los casos clínicos.
+        model (SentenceTransformer): El modelo de embeddings.
+        index_path (str): Dónde guardar el índice FAISS.
+        cases_path (str): Dónde guardar los casos (almacén SQLite .db).
+        chunk_tokens (int): Tokens por pasaje, o None para un vector por caso.
+        chunk_overlap (int): Tokens de solapamiento entre pasajes.
+        model_name (str): Nombre del modelo; si cambia, se reconstruye todo.
+        incremental (bool): Reutilizar el índice existente si el manifiesto es compatible.
+        index_spec (str): Tipo de índice FAISS: "Flat", "IVF1024,Flat", "IVF1024,PQ32", "HNSW32"...
+        metric (str): "l2", o "cosine" para un índice de producto interno sobre
+            embeddings normalizados (el Retriever devuelve entonces el coseno como `score`).
+        backend (str): Backend con el que se cargó `model` (ver encoders.py); si
+            cambia, se reconstruye todo para no mezclar embeddings de backends distintos.
+    """
+    manifest_path = artifact_path(index_path, MANIFEST_SUFFIX)
+    store_path = store_path_for(cases_path)
+    chunk_map_path = artifact_path(index_path, CHUNK_MAP_SUFFIX)
+    settings = {"model_name": model_name, "chunk_tokens": chunk_tokens, "chunk_overlap": chunk_overlap,
+                "index_spec": index_spec, "metric": metric, "backend": backend}
+
+    previous = load_manifest(manifest_path) if incremental else None
+    if previous is not None:
+        # Los manifiestos anteriores a la opción de métrica son todos L2, y los
+        # anteriores a la opción de backend, de PyTorch.
+        previous["settings"].setdefault("metric", "l2")
+        previous["settings"].setdefault("backend", "torch")
+    if previous is not None and previous["settings"] != settings:
+        print("La configuración del índice cambió: se reconstruye desde cero.")
+        previous = None
+    if previous is not None and not os.path.exists(store_path):
+        # Índice construido con una versión anterior, que guardaba los casos en un pickle.
+        legacy_path = legacy_pickle_path(store_path)
+        if os.path.exists(legacy_path):
+            migrate_pickle(legacy_path, store_path, index_path=index_path)
+        else:
+            previous = None
+
+    store = CaseStore(store_path, readonly=False)
+    if previous is None:
+        store.clear()
+        index = None
+        chunk_map = np.empty(0, dtype='int64')
+        entries = {}
+        next_case_id = 0
+        next_vector_id = 0
+    else:
+        index = faiss.read_index(index_path)
+        chunk_map = np.empty(0, dtype='int64')
+        if chunk_tokens:
+            chunk_map = np.load(chunk_map_path)
+        entries = previous["cases"]
+        next_case_id = previous["next_case_id"]
+        next_vector_id = previous["next_vector_id"]
+
+    # 1. Comparamos los hashes con el manifiesto para saber qué cambió.
+    new_entries = {}
+    to_add = []  # (clave, id del caso, texto, hash)
+    for key, text in case_keys(patient_cases):
+        text_hash = content_hash(text)
+        old = entries.get(key)
+        if old is not None and old["hash"] == text_hash:
+            new_entries[key] = old
+            continue
+        if old is not None:
+            case_id = old["case_id"]  # caso modificado: conserva su id
+        else:
+            case_id = next_case_id
+            next_case_id += 1
+        to_add.append((key, case_id, text, text_hash))
+
+    to_add_keys = {key for key, _, _, _ in to_add}
+    removed = [key for key in entries if key not in new_entries and key not in to_add_keys]
+    modified = len(to_add_keys & entries.keys())
+    stale = [entries[key] for key in removed] + [entries[key] for key in to_add_keys if key in entries]
+    print(f"Casos: {len(to_add) - modified} nuevos, {modified} modificados, "
+          f"{len(removed)} eliminados, {len(new_entries)} sin cambios.")
+
+    # 2. Quitamos los vectores de los casos eliminados o modificados.
+    remove_ids = [vector_id for entry in stale for vector_id in entry["vector_ids"]]
+    if index is not None and remove_ids and not supports_removal(index_spec):
+        print(f"El índice {index_spec} no permite quitar vectores: se reconstruye desde cero.")
+        return build_index(patient_cases, model, index_path, cases_path, chunk_tokens=chunk_tokens,
+                           chunk_overlap=chunk_overlap, model_name=model_name, incremental=False,
+                           index_spec=index_spec, metric=metric, backend=backend)
+    store.delete_cases(entries[key]["case_id"] for key in removed)
+    if chunk_tokens:
+        store.delete_passages(remove_ids)
+    for vector_id in remove_ids:
+        if vector_id < len(chunk_map):
+            chunk_map[vector_id] = -1
+    if index is not None and remove_ids:
+        index.remove_ids(np.array(remove_ids, dtype='int64'))
+
+    # 3. Codificamos solo los casos nuevos o modificados.
+    if chunk_tokens:
+        new_passages, local_map = chunk_cases(
+            [text for _, _, text, _ in to_add],
+            tokenizer=getattr(model, "tokenizer", None),
+            max_tokens=chunk_tokens,
+            overlap=chunk_overlap
+        )
+        vector_ids = list(range(next_vector_id, next_vector_id + len(new_passages)))
+        next_vector_id += len(new_passages)
+        texts_to_encode = new_passages
+        vector_case_ids = [to_add[i][1] for i in local_map]
+        if to_add:
+            print(f"{len(to_add)} casos divididos en {len(new_passages)} pasajes.")
+    else:
+        texts_to_encode = [text for _, _, text, _ in to_add]
+        vector_ids = [case_id for _, case_id, _, _ in to_add]
+        vector_case_ids = vector_ids
+
+    store.put_cases({case_id: text for _, case_id, text, _ in to_add})
+    for key, case_id, text, text_hash in to_add:
+        new_entries[key] = {"hash": text_hash, "case_id": case_id, "vector_ids": []}
+    case_to_key = {case_id: key for key, case_id, _, _ in to_add}
+    for vector_id, case_id in zip(vector_ids, vector_case_ids):
+        new_entries[case_to_key[case_id]]["vector_ids"].append(vector_id)
+
+    if index is None:
+        # ahora vamos a crear el indice faiss (por defecto IndexFlatL2) envuelto en un IndexIDMap
+        index = create_index(index_spec, model.get_sentence_embedding_dimension(), metric=metric)
+    if texts_to_encode:
+        embeddings = embedding_encode(texts_to_encode, model) # salida: shape [N, 768] -> 768 es el tamaño del embedding
+        embeddings = prepare_vectors(embeddings, metric)
+        print("Tamaño del embedding:", embeddings.shape)
+        if not index.is_trained:
+            # Los índices IVF/PQ aprenden sus centroides de los propios embeddings.
+            print(f"Entrenando el índice {index_spec} con {len(embeddings)} vectores...")
+            index.train(embeddings)
+        index.add_with_ids(embeddings, np.array(vector_ids, dtype='int64'))
     print("Tamaño del indice:", index.ntotal)
-    # ahora guardamos el indice
-    faiss.write_index(index, "../models/patient_cases.index")
-    # guardamos la lista de casos patient_cases, en el formato pickle
-    with open("../models/patient_cases.pkl", "wb") as f:
-        pickle.dump(patient_cases, f)
-    f.close()
 
+    # 4. Guardamos el índice, los casos y el manifiesto.
+    faiss.write_index(index, index_path)
+
+    if chunk_tokens:
+        store.put_passages(zip(vector_ids, vector_case_ids, texts_to_encode))
+        if len(chunk_map) < next_vector_id:
+            chunk_map = np.concatenate([chunk_map, np.full(next_vector_id - len(chunk_map), -1, dtype='int64')])
+        chunk_map[vector_ids] = vector_case_ids
+        np.save(chunk_map_path, chunk_map)
+    elif os.path.exists(chunk_map_path):
+        # Un índice por casos no debe dejar atrás el mapa de una construcción anterior.
+        os.remove(chunk_map_path)
+
+    # El índice BM25 se reconstruye entero: tokenizar es mucho más barato que codificar.
+    bm25 = BM25Index.build(store.iter_texts("passages" if chunk_tokens else "cases"))
+    bm25.save(artifact_path(index_path, BM25_SUFFIX))
+    store.commit()
+    store.close()
 
+    write_manifest(manifest_path, settings, next_case_id, next_vector_id, new_entries)
 
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye el índice FAISS de casos clínicos.")
+    parser.add_argument("--docx-path", default="../data/Casos.docx")
+    parser.add_argument("--index-path", default="../models/patient_cases.index")
+    parser.add_argument("--cases-path", default="../models/patient_cases.db")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    parser.add_argument("--chunk-tokens", type=int, default=None,
+                        help="Divide los casos en pasajes de este número de tokens.")
+    parser.add_argument("--chunk-overlap", type=int, default=64)
+    parser.add_argument("--incremental", action="store_true",
+                        help="Codifica solo los casos nuevos o modificados según el manifiesto.")
+    parser.add_argument("--index-spec", default=DEFAULT_INDEX_SPEC,
+                        help='Tipo de índice FAISS: "Flat", "IVF1024,Flat", "IVF1024,PQ32", "HNSW32"...')
+    parser.add_argument("--backend", default=ENCODER_BACKEND, choices=ENCODER_BACKENDS,
+                        help="Backend del encoder (ver encoders.py).")
+    parser.add_argument("--metric", default=DEFAULT_METRIC, choices=METRICS,
+                        help="Métrica del índice: distancia L2 o coseno (producto interno).")
+    args = parser.parse_args()
+
+    # Si el documento no se puede leer, se lanza un error en lugar de indexar el mensaje.
+    clinical_text = read_docx_text(args.docx_path)
+
+    patient_cases = segment_cases(clinical_text)
+    model = load_encoder(args.model_name, args.backend) # cargamos el modelo preentrenado embedding
+    build_index(
+        patient_cases,
+        model,
+        index_path=args.index_path,
+        cases_path=args.cases_path,
+        chunk_tokens=args.chunk_tokens,
+        chunk_overlap=args.chunk_overlap,
+        model_name=args.model_name,
+        incremental=args.incremental,
+        index_spec=args.index_spec,
+        metric=args.metric,
+        backend=args.backend
+    )
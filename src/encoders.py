@@ -0,0 +1,229 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+# Backends del encoder de embeddings:
+#   "torch"     -> SentenceTransformer en PyTorch (float32), el original.
+#   "onnx"      -> el mismo modelo exportado a ONNX (ONNX Runtime).
+#   "onnx-int8" -> el modelo ONNX con cuantización dinámica int8 (más rápido en CPU).
+# Los backends ONNX necesitan `pip install "sentence-transformers[onnx]"` y, para
+# int8, exportar antes el modelo con `python encoders.py export`.
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+ONNX_EXPORT_DIR = os.getenv("ONNX_EXPORT_DIR", "../models/onnx")
+# Conjunto de instrucciones para la cuantización ("avx512_vnni", "avx512", "avx2" o "arm64").
+DEFAULT_QUANTIZATION = "avx512_vnni"
+
+
+def export_path(model_name, export_dir=ONNX_EXPORT_DIR):
+    """
+    Directorio donde se guarda el modelo exportado a ONNX.
+    """
+    return os.path.join(export_dir, model_name.replace("/", "__"))
+
+
+def quantized_file_name(quantization=DEFAULT_QUANTIZATION):
+    # Nombre con el que `export_dynamic_quantized_onnx_model` guarda el modelo cuantizado.
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+def load_encoder(model_name, backend=None, export_dir=ONNX_EXPORT_DIR, quantization=DEFAULT_QUANTIZATION):
+    """
+    Carga el encoder de embeddings con el backend indicado.
+
+    Args:
+        model_name (str): Nombre del modelo (p. ej. "all-mpnet-base-v2").
+        backend (str): "torch", "onnx" u "onnx-int8". Por defecto, ENCODER_BACKEND.
+        export_dir (str): Directorio de los modelos exportados con `export_onnx`.
+        quantization (str): Variante de la cuantización int8 a cargar.
+
+    Returns:
+        SentenceTransformer: El encoder (misma interfaz con cualquier backend).
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or ENCODER_BACKEND
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend}. Opciones: {', '.join(ENCODER_BACKENDS)}.")
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+
+    path = export_path(model_name, export_dir)
+    if backend == "onnx":
+        # Sin exportación previa, sentence-transformers exporta el modelo al cargarlo.
+        return SentenceTransformer(path if os.path.isdir(path) else model_name, backend="onnx")
+
+    file_name = quantized_file_name(quantization)
+    if not os.path.exists(os.path.join(path, file_name)):
+        raise FileNotFoundError(
+            f"No existe {os.path.join(path, file_name)}: exporta antes el modelo con "
+            f"`python encoders.py export --model-name {model_name}`."
+        )
+    return SentenceTransformer(path, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def export_onnx(model_name, export_dir=ONNX_EXPORT_DIR, quantization=DEFAULT_QUANTIZATION):
+    """
+    Exporta el modelo a ONNX y guarda además una versión cuantizada a int8.
+
+    Returns:
+        str: El directorio del modelo exportado.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    path = export_path(model_name, export_dir)
+    model = SentenceTransformer(model_name, backend="onnx")
+    model.save_pretrained(path)
+    if quantization:
+        export_dynamic_quantized_onnx_model(model, quantization, path)
+    return path
+
+
+def encoder_cache_name(model_name, backend=None):
+    """
+    Nombre para la caché de embeddings: los de backends distintos no se mezclan.
+    """
+    backend = backend or ENCODER_BACKEND
+    return model_name if backend == "torch" else f"{model_name}:{backend}"
+
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype='float32')
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def compare_embeddings(reference_docs, candidate_docs, reference_queries, candidate_queries, k=5):
+    """
+    Compara los embeddings de un encoder candidato con los del de referencia.
+
+    El recall@k se calcula como en producción: las preguntas codificadas con el
+    candidato se buscan (por L2, como el índice) entre los documentos codificados
+    con la referencia, y se comparan con los top-k de la propia referencia.
+
+    Returns:
+        dict: Coseno medio y mínimo entre ambos embeddings de cada texto,
+            recall@k con el índice de referencia y recall@k con un índice
+            reconstruido con el candidato.
+    """
+    cosines = np.concatenate([
+        np.sum(_normalize(reference_docs) * _normalize(candidate_docs), axis=1),
+        np.sum(_normalize(reference_queries) * _normalize(candidate_queries), axis=1),
+    ])
+
+    def top_k(queries, docs):
+        distances = (np.sum(queries ** 2, axis=1)[:, None] - 2 * queries @ docs.T
+                     + np.sum(docs ** 2, axis=1)[None, :])
+        return np.argsort(distances, axis=1)[:, :k]
+
+    expected = top_k(reference_queries, reference_docs)
+
+    def recall(found):
+        return float(np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)]))
+
+    return {
+        "cosine_mean": float(cosines.mean()),
+        "cosine_min": float(cosines.min()),
+        f"recall@{k}_reference_index": recall(top_k(candidate_queries, reference_docs)),
+        f"recall@{k}_rebuilt_index": recall(top_k(candidate_queries, candidate_docs)),
+    }
+
+
+def time_encoder(model, queries, docs, batch_size=32):
+    """
+    Latencia de una pregunta suelta (p50/p99) y throughput codificando documentos en lotes.
+    """
+    from tracing import percentile_ms
+
+    model.encode(queries[:1])
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model.encode([query])
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    model.encode(docs, batch_size=batch_size)
+    seconds = time.perf_counter() - start
+    return {
+        "query_p50_ms": percentile_ms(latencies, 50),
+        "query_p99_ms": percentile_ms(latencies, 99),
+        "docs_per_second": len(docs) / seconds,
+    }
+
+
+def validate_backends(model_name, docs, queries, backends=ENCODER_BACKENDS, k=5,
+                      export_dir=ONNX_EXPORT_DIR, quantization=DEFAULT_QUANTIZATION):
+    """
+    Compara cada backend con PyTorch: precisión (ver `compare_embeddings`) y latencia.
+
+    Returns:
+        dict: backend -> métricas.
+    """
+    reference = load_encoder(model_name, "torch")
+    reference_docs = reference.encode(docs, convert_to_numpy=True)
+    reference_queries = reference.encode(queries, convert_to_numpy=True)
+
+    results = {}
+    for backend in backends:
+        model = reference if backend == "torch" else load_encoder(
+            model_name, backend, export_dir=export_dir, quantization=quantization
+        )
+        result = compare_embeddings(
+            reference_docs, model.encode(docs, convert_to_numpy=True),
+            reference_queries, model.encode(queries, convert_to_numpy=True), k=k
+        )
+        result.update(time_encoder(model, queries, docs))
+        results[backend] = result
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta y valida los backends ONNX del encoder.")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    parser.add_argument("--export-dir", default=ONNX_EXPORT_DIR)
+    parser.add_argument("--quantization", default=DEFAULT_QUANTIZATION,
+                        help='Instrucciones de la cuantización int8: "avx512_vnni", "avx512", "avx2" o "arm64".')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("export", help="exporta el modelo a ONNX (float32 e int8)")
+
+    validate_parser = subparsers.add_parser("validate", help="precisión y latencia frente a PyTorch")
+    validate_parser.add_argument("--cases-path", default="../models/patient_cases.db")
+    validate_parser.add_argument("--num-docs", type=int, default=500)
+    validate_parser.add_argument("--num-queries", type=int, default=100)
+    validate_parser.add_argument("--k", type=int, default=5)
+    validate_parser.add_argument("--backends", nargs="+", default=list(ENCODER_BACKENDS))
+    validate_parser.add_argument("--min-cosine", type=float, default=0.99,
+                                 help="Coseno medio mínimo para dar por válido un backend.")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        path = export_onnx(args.model_name, args.export_dir, args.quantization)
+        print(f"Modelo exportado en {path}")
+    else:
+        from itertools import islice
+
+        from benchmarks import make_queries
+        from case_store import open_case_store
+
+        store = open_case_store(args.cases_path)
+        docs = [text for _, text in islice(store.iter_texts("cases"), args.num_docs)]
+        store.close()
+        results = validate_backends(args.model_name, docs, make_queries(args.num_queries),
+                                    backends=args.backends, k=args.k, export_dir=args.export_dir,
+                                    quantization=args.quantization)
+
+        print(f"\n========= Backends del encoder ({len(docs)} casos, recall@{args.k}) =========")
+        print(f"{'backend':<11}{'cos medio':>10}{'cos mín':>9}{'recall ref':>12}{'recall nuevo':>14}"
+              f"{'p50 (ms)':>10}{'p99 (ms)':>10}{'docs/s':>9}")
+        failed = False
+        for backend, r in results.items():
+            ok = r["cosine_mean"] >= args.min_cosine
+            failed = failed or not ok
+            print(f"{backend:<11}{r['cosine_mean']:>10.4f}{r['cosine_min']:>9.4f}"
+                  f"{r[f'recall@{args.k}_reference_index']:>12.3f}{r[f'recall@{args.k}_rebuilt_index']:>14.3f}"
+                  f"{r['query_p50_ms']:>10.2f}{r['query_p99_ms']:>10.2f}{r['docs_per_second']:>9.1f}"
+                  f"{'' if ok else '  <-- por debajo de --min-cosine'}")
+        if failed:
+            raise SystemExit(1)
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+
+from stub_llm import STUB_ANSWER, word_chunks
+
+# Servidor local que imita la API REST de Gemini (generateContent y
+# streamGenerateContent con SSE), para probar llm_client.py sin red ni API key:
+# latencia fija, cuota de peticiones por segundo (429), errores 503 aleatorios y
+# conexiones keep-alive. Cuenta peticiones, conexiones y concurrencia máxima.
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+           503: "Service Unavailable"}
+
+
+class FakeGeminiServer:
+    """
+    Se usa como context manager: arranca en un hilo propio y expone `url`.
+
+        with FakeGeminiServer(latency=0.2, quota=20) as server:
+            client = LLMClient(base_url=server.url, api_key="local")
+    """
+
+    def __init__(self, latency=0.2, quota=None, error_rate=0.0, retry_after=None, answer=STUB_ANSWER, seed=0):
+        """
+        Args:
+            latency (float): Segundos que tarda cada respuesta.
+            quota (int): Peticiones admitidas por segundo; las demás reciben 429.
+            error_rate (float): Fracción de peticiones que fallan con 503.
+            retry_after (float): Si se indica, se envía como `Retry-After` en los 429.
+            answer (str): Texto de las respuestas.
+            seed (int): Semilla de los errores aleatorios.
+        """
+        self.latency = latency
+        self.quota = quota
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.answer = answer
+        self.rng = random.Random(seed)
+        self.host = "127.0.0.1"
+        self.port = None
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._recent = deque()
+        self._handlers = set()
+        self.reset_stats()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def reset_stats(self):
+        self.requests = 0
+        self.connections = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.active = 0
+        self.max_active = 0
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+            "max_concurrency": self.max_active,
+        }
+
+    def _over_quota(self):
+        if self.quota is None:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1.0:
+            self._recent.popleft()
+        if len(self._recent) >= self.quota:
+            return True
+        self._recent.append(now)
+        return False
+
+    async def _respond(self, method, path):
+        # Devuelve (estado, cabeceras extra, cuerpo o lista de eventos SSE).
+        route = path.split("?", 1)[0]
+        if method != "POST" or not route.startswith("/v1beta/models/"):
+            return 404, {}, {"error": {"code": 404, "message": f"Ruta no encontrada: {path}"}}
+        self.requests += 1
+        if self._over_quota():
+            self.rate_limited += 1
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+            return 429, headers, {"error": {"code": 429, "message": "Resource has been exhausted (quota)."}}
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        if self.rng.random() < self.error_rate:
+            self.failed += 1
+            return 503, {}, {"error": {"code": 503, "message": "The model is overloaded."}}
+        if route.endswith(":streamGenerateContent"):
+            return 200, {}, [{"candidates": [{"content": {"parts": [{"text": chunk}]}}]}
+                             for chunk in word_chunks(self.answer)]
+        return 200, {}, {"candidates": [{"content": {"parts": [{"text": self.answer}], "role": "model"}}]}
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                await reader.readexactly(int(headers.get("content-length", 0)))
+                status, extra, payload = await self._respond(method, path)
+                if isinstance(payload, list):
+                    data = "".join(f"data: {json.dumps(event)}\r\n\r\n" for event in payload).encode("utf-8")
+                    content_type = "text/event-stream"
+                else:
+                    data = json.dumps(payload).encode("utf-8")
+                    content_type = "application/json"
+                head = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}",
+                        f"Content-Length: {len(data)}"]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _shutdown(self):
+        # Cierra las conexiones keep-alive que siguen abiertas antes de parar el loop.
+        self._server.close()
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, 0))
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de Gemini.")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--quota", type=int, default=None, help="Peticiones por segundo antes de responder 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(latency=args.latency, quota=args.quota, error_rate=args.error_rate).start()
+    print(f"Gemini simulado en {server.url} (usa GEMINI_BASE_URL={server.url}). Ctrl+C para salir.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
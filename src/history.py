@@ -0,0 +1,219 @@
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+from context_packer import count_tokens, token_offsets, trim_to_tokens
+
+# Límites por defecto del historial que se envía al LLM en cada turno.
+DEFAULT_MAX_TURNS = 6
+DEFAULT_WINDOW_TOKENS = 1200
+DEFAULT_SUMMARY_TOKENS = 250
+
+summary_prompt = ChatPromptTemplate.from_template(
+    """Actualiza el resumen de una conversación entre un usuario y un asistente de historiales clínicos.
+
+Resumen actual (vacío si aún no hay ninguno):
+{summary}
+
+Nuevos mensajes a incorporar:
+{conversation}
+
+Escribe el resumen actualizado en español, en menos de {max_words} palabras. Conserva los
+nombres o iniciales de pacientes, edades, diagnósticos y las preguntas importantes del usuario.
+
+Resumen actualizado:
+"""
+)
+
+
+def build_summary_chain(llm):
+    """
+    Cadena que actualiza el resumen con un LLM.
+    Entrada: {"summary", "conversation", "max_words"}. Salida: el nuevo resumen.
+    """
+    return summary_prompt | llm | StrOutputParser()
+
+
+def _extractive_summary(inputs):
+    # Sin LLM: el resumen anterior más las preguntas del usuario; si no cabe en
+    # `max_words` palabras, se descarta lo más antiguo.
+    questions = [line for line in inputs["conversation"].splitlines() if line.startswith("usuario:")]
+    summary = "\n".join(filter(None, [inputs["summary"]] + questions))
+    offsets = token_offsets(summary)
+    if len(offsets) > inputs["max_words"]:
+        summary = summary[offsets[-inputs["max_words"]][0]:]
+    return summary
+
+
+# Resumidor local, sin llamadas al LLM (útil en pruebas y benchmarks).
+extractive_summarizer = RunnableLambda(_extractive_summary)
+
+
+def format_messages(messages):
+    """
+    Serializa mensajes como "usuario: ..." / "asistente: ...". Se omiten las
+    llamadas a herramientas sin texto; los resultados de herramientas se incluyen.
+    """
+    lines = []
+    for msg in messages:
+        content = msg.content if isinstance(msg.content, str) else str(msg.content)
+        if not content.strip():
+            continue
+        if isinstance(msg, HumanMessage):
+            role = "usuario"
+        elif isinstance(msg, ToolMessage):
+            role = "herramienta"
+        elif isinstance(msg, AIMessage):
+            role = "asistente"
+        else:
+            role = msg.type
+        lines.append(f"{role}: {content}")
+    return "\n".join(lines)
+
+
+def split_turns(messages):
+    """
+    Agrupa los mensajes en turnos: cada turno empieza con un mensaje del usuario
+    e incluye las llamadas a herramientas y respuestas que lo siguen.
+    """
+    turns = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage) or not turns:
+            turns.append([msg])
+        else:
+            turns[-1].append(msg)
+    return turns
+
+
+class HistoryManager:
+    """
+    Mantiene acotado el historial que se envía al LLM.
+
+    Se conserva una ventana con los últimos turnos completos. Cuando la ventana
+    supera `max_turns` turnos o `window_tokens` tokens, los turnos más antiguos se
+    incorporan a un resumen (que se actualiza de forma incremental: solo se le
+    pasan los turnos que salen de la ventana) y se eliminan del estado. La ventana
+    se reduce entonces a la mitad de sus límites, para no resumir en cada turno.
+
+    El tamaño del prompt queda así acotado por `window_tokens + summary_tokens`,
+    sea cual sea la longitud de la conversación.
+    """
+
+    def __init__(self, summarizer=None, max_turns=DEFAULT_MAX_TURNS,
+                 window_tokens=DEFAULT_WINDOW_TOKENS, summary_tokens=DEFAULT_SUMMARY_TOKENS,
+                 tokenizer=None):
+        """
+        Args:
+            summarizer: Runnable {"summary", "conversation", "max_words"} -> resumen
+                (ver `build_summary_chain`). Por defecto, `extractive_summarizer`.
+            max_turns (int): Turnos máximos en la ventana.
+            window_tokens (int): Tokens máximos de la ventana.
+            summary_tokens (int): Tokens máximos del resumen.
+            tokenizer: Tokenizador para contar tokens (por defecto, palabras).
+        """
+        self.summarizer = summarizer or extractive_summarizer
+        self.max_turns = max_turns
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.tokenizer = tokenizer
+
+    def _turn_tokens(self, turn):
+        return count_tokens(format_messages(turn), self.tokenizer)
+
+    def select_evicted(self, messages):
+        """
+        Returns:
+            list: Los mensajes que deben salir de la ventana (vacía si cabe todo).
+        """
+        turns = split_turns(messages)
+        sizes = [self._turn_tokens(turn) for turn in turns]
+        if len(turns) <= self.max_turns and sum(sizes) <= self.window_tokens:
+            return []
+
+        # Se conservan los turnos más recientes que quepan en la mitad de los
+        # límites; el último turno (la pregunta actual) siempre se conserva.
+        keep_turns = max(1, self.max_turns // 2)
+        budget = self.window_tokens // 2
+        kept = 1
+        used = sizes[-1]
+        while kept < min(keep_turns, len(turns)) and used + sizes[-kept - 1] <= budget:
+            used += sizes[-kept - 1]
+            kept += 1
+        return [msg for turn in turns[:-kept] for msg in turn]
+
+    def _summary_inputs(self, summary, evicted):
+        return {
+            "summary": summary or "",
+            "conversation": format_messages(evicted),
+            "max_words": self.summary_tokens,
+        }
+
+    def _result(self, summary, evicted):
+        summary = trim_to_tokens(summary.strip(), self.summary_tokens, self.tokenizer)
+        return {
+            "summary": summary,
+            "messages": [RemoveMessage(id=msg.id) for msg in evicted],
+        }
+
+    def update(self, summary, messages, config=None):
+        """
+        Incorpora al resumen los turnos que salen de la ventana.
+
+        Args:
+            summary (str): El resumen actual.
+            messages (list): Todos los mensajes del estado (el último es la pregunta actual).
+            config: La config del grafo (para propagar callbacks al resumidor).
+
+        Returns:
+            dict: Actualización del estado: el nuevo "summary" y los RemoveMessage
+                de los mensajes resumidos. Vacío si no hay que resumir.
+        """
+        evicted = self.select_evicted(messages)
+        if not evicted:
+            return {}
+        new_summary = self.summarizer.invoke(self._summary_inputs(summary, evicted), config=config)
+        return self._result(new_summary, evicted)
+
+    async def aupdate(self, summary, messages, config=None):
+        evicted = self.select_evicted(messages)
+        if not evicted:
+            return {}
+        new_summary = await self.summarizer.ainvoke(self._summary_inputs(summary, evicted), config=config)
+        return self._result(new_summary, evicted)
+
+
+def format_history(summary, messages):
+    """
+    El historial para el prompt: el resumen de lo anterior y los mensajes recientes.
+    """
+    recent = format_messages(messages)
+    if summary:
+        return f"Resumen de la conversación anterior:\n{summary}\n\nMensajes recientes:\n{recent}"
+    return recent
+
+
+if __name__ == "__main__":
+    # Comprobación: en una conversación de 120 turnos, el historial que recibe el
+    # LLM en cada turno nunca supera el presupuesto (ventana + resumen), tanto con
+    # respuestas cortas (manda `max_turns`) como largas (manda `window_tokens`).
+    from langgraph.graph.message import add_messages
+
+    manager = HistoryManager()
+    # Margen para los encabezados de `format_history` ("Resumen de la conversación anterior:"...).
+    budget = manager.window_tokens + manager.summary_tokens + 10
+    for repeats in (1, 20):
+        answer = "Según el caso, se aplicó terapia cognitivo conductual con higiene del sueño. " * repeats
+        summary, messages, largest = "", [], 0
+        for turn in range(120):
+            question = f"¿Qué tratamiento recibió el paciente {turn} con ansiedad y problemas de sueño?"
+            messages = add_messages(messages, [HumanMessage(content=question)])
+            update = manager.update(summary, messages)
+            summary = update.get("summary", summary)
+            messages = add_messages(messages, update.get("messages", []))
+            tokens = count_tokens(format_history(summary, messages))
+            assert tokens <= budget, f"Turno {turn}: {tokens} tokens de historial (máximo {budget})."
+            largest = max(largest, tokens)
+            messages = add_messages(messages, [AIMessage(content=answer)])
+        print(f"120 turnos con respuestas de {count_tokens(answer)} tokens: historial máximo de "
+              f"{largest} tokens (presupuesto {budget}), {len(messages)} mensajes al final.")
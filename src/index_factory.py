@@ -0,0 +1,167 @@
+import faiss
+import numpy as np
+
+# Tipos de índice soportados, como cadenas de `faiss.index_factory`:
+#   "Flat"           búsqueda exacta (fuerza bruta)
+#   "IVF1024,Flat"   listas invertidas; en búsqueda se revisan `nprobe` listas
+#   "IVF1024,PQ32"   listas invertidas con vectores comprimidos por cuantización de producto
+#   "HNSW32"         grafo HNSW; en búsqueda se exploran `efSearch` candidatos
+DEFAULT_INDEX_SPEC = "Flat"
+
+# Métricas: "l2" (distancia euclídea, la original) o "cosine" (producto interno
+# sobre embeddings normalizados; FAISS devuelve directamente el coseno).
+METRICS = ("l2", "cosine")
+DEFAULT_METRIC = "l2"
+
+
+def create_index(index_spec, dim, metric=DEFAULT_METRIC):
+    """
+    Crea un índice FAISS vacío a partir de una cadena de configuración.
+
+    El índice se envuelve en un `IndexIDMap` para que cada vector lleve su propio id.
+
+    Args:
+        index_spec (str): Cadena de `faiss.index_factory` (p. ej. "IVF256,Flat").
+        dim (int): Dimensión de los embeddings.
+        metric (str): "l2" o "cosine". Con "cosine", los vectores que se añaden y
+            las preguntas deben normalizarse (ver `prepare_vectors`).
+
+    Returns:
+        faiss.Index: El índice vacío (los IVF/PQ deben entrenarse antes de añadir).
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Métrica desconocida: {metric}. Opciones: {', '.join(METRICS)}.")
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+    return faiss.index_factory(dim, "IDMap," + index_spec, faiss_metric)
+
+
+def index_metric(index):
+    """
+    La métrica de un índice cargado: "cosine" si es de producto interno, si no "l2".
+    """
+    return "cosine" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def prepare_vectors(vectors, metric):
+    """
+    Normaliza los vectores (en una copia) si la métrica es el coseno.
+
+    Returns:
+        np.ndarray: Los vectores listos para añadir o buscar en el índice.
+    """
+    if metric != "cosine":
+        return vectors
+    vectors = vectors.copy()
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def supports_removal(index_spec):
+    """
+    HNSW no permite quitar vectores: en ese caso hay que reconstruir el índice.
+    """
+    return "HNSW" not in index_spec
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Ajusta los parámetros de búsqueda de un índice aproximado.
+
+    Los parámetros que no aplican al tipo de índice (p. ej. `nprobe` en un HNSW)
+    se ignoran.
+
+    Args:
+        index (faiss.Index): El índice cargado.
+        nprobe (int): Listas invertidas a revisar por búsqueda (IVF).
+        ef_search (int): Tamaño de la lista de candidatos en la búsqueda (HNSW).
+    """
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+
+def index_memory_bytes(index):
+    """
+    Tamaño del índice serializado, como aproximación de su memoria.
+    """
+    return faiss.serialize_index(index).nbytes
+
+
+# Hasta este número de vectores permitidos, las búsquedas filtradas en índices
+# aproximados se hacen de forma exacta sobre esos vectores (ver `filtered_search`).
+EXACT_FILTER_LIMIT = 20000
+
+
+def _selector_params(inner, selector):
+    # Cada tipo de índice exige su propia clase de parámetros de búsqueda.
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = inner.nprobe
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = inner.hnsw.efSearch
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    return params
+
+
+def filtered_search(index, queries, k, allowed_ids, metric=DEFAULT_METRIC, exact_limit=EXACT_FILTER_LIMIT):
+    """
+    Busca solo entre los vectores con ids en `allowed_ids` (búsqueda prefiltrada).
+
+    En un índice Flat se usa un `IDSelector` (exacto). En IVF y HNSW el selector
+    pierde resultados cuando el filtro es muy selectivo (los vectores permitidos
+    pueden no estar en las listas o el grafo que se exploran), así que, si hay
+    pocos vectores permitidos, se reconstruyen y se comparan todos.
+
+    Args:
+        index (faiss.Index): Índice envuelto en un IndexIDMap.
+        queries (np.ndarray): Preguntas [n, dim], ya preparadas para la métrica.
+        k (int): Resultados por pregunta.
+        allowed_ids (list): Ids (externos) de los vectores permitidos.
+        metric (str): "l2" o "cosine".
+        exact_limit (int): Máximo de vectores para la búsqueda exacta.
+
+    Returns:
+        tuple: (distancias, ids), como `index.search` (-1 si no hay suficientes).
+    """
+    allowed_ids = np.asarray(allowed_ids, dtype='int64')
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexFlat) or len(allowed_ids) > exact_limit:
+        selector = faiss.IDSelectorBatch(allowed_ids)
+        return index.search(queries, k, params=_selector_params(inner, selector))
+
+    # Posición interna de cada id permitido (el IDMap guarda interno -> externo).
+    id_map = faiss.vector_to_array(index.id_map)
+    order = np.argsort(id_map)
+    positions = np.searchsorted(id_map, allowed_ids, sorter=order)
+    positions = np.minimum(positions, len(order) - 1)
+    found = id_map[order[positions]] == allowed_ids
+    allowed_ids, internal_ids = allowed_ids[found], order[positions[found]]
+
+    distances = np.full((len(queries), k), np.inf if metric != "cosine" else -np.inf, dtype='float32')
+    labels = np.full((len(queries), k), -1, dtype='int64')
+    if len(internal_ids) == 0:
+        return distances, labels
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        # Las IVF solo reconstruyen vectores por id con el mapa directo (se crea una vez).
+        ivf.make_direct_map()
+    vectors = inner.reconstruct_batch(internal_ids)
+    if metric == "cosine":
+        scores = queries @ vectors.T
+        top = np.argsort(-scores, axis=1)[:, :k]
+    else:
+        scores = (np.sum(queries ** 2, axis=1)[:, None] - 2 * queries @ vectors.T
+                  + np.sum(vectors ** 2, axis=1)[None, :])
+        top = np.argsort(scores, axis=1)[:, :k]
+    n = top.shape[1]
+    distances[:, :n] = np.take_along_axis(scores, top, axis=1)
+    labels[:, :n] = allowed_ids[top]
+    return distances, labels
@@ -0,0 +1,50 @@
+import json
+import os
+
+# Archivos auxiliares que el constructor del índice guarda junto al índice FAISS.
+# Todos comparten el nombre base del índice: "patient_cases.index" ->
+# "patient_cases_chunk_map.npy", "patient_cases_manifest.json", ...
+# Los pasajes se guardaban antes en un pickle; ahora viven en el CaseStore.
+LEGACY_PASSAGES_SUFFIX = "_passages.pkl"
+CHUNK_MAP_SUFFIX = "_chunk_map.npy"
+MANIFEST_SUFFIX = "_manifest.json"
+BM25_SUFFIX = "_bm25.npz"
+
+
+def artifact_path(index_path, suffix):
+    """
+    Devuelve la ruta de un archivo auxiliar del índice.
+
+    Args:
+        index_path (str): Ruta del índice FAISS.
+        suffix (str): Sufijo del archivo auxiliar (p. ej. CHUNK_MAP_SUFFIX).
+
+    Returns:
+        str: La ruta del archivo auxiliar.
+    """
+    base, _ = os.path.splitext(index_path)
+    return base + suffix
+
+
+def read_build_id(index_path):
+    """
+    Identificador de la construcción actual del índice: cambia cada vez que se
+    reconstruye o se actualiza. Sirve para invalidar cachés derivadas del índice.
+
+    Se toma del manifest; los índices antiguos sin manifest usan la fecha de
+    modificación y el tamaño del archivo del índice.
+
+    Args:
+        index_path (str): Ruta del índice FAISS.
+
+    Returns:
+        str: El identificador de la construcción.
+    """
+    manifest_path = artifact_path(index_path, MANIFEST_SUFFIX)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            build_id = json.load(f).get("build_id")
+        if build_id:
+            return build_id
+    stat = os.stat(index_path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
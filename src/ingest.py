@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import faiss
+import numpy as np
+
+from bm25 import BM25Index
+from case_store import CaseStore, store_path_for
+from data_extractor import SUPPORTED_EXTENSIONS, extract_text
+from data_processor import content_hash, segment_cases, write_manifest
+from encoders import ENCODER_BACKEND
+from index_factory import create_index, prepare_vectors, DEFAULT_INDEX_SPEC, DEFAULT_METRIC, METRICS
+from index_files import artifact_path, BM25_SUFFIX, CHUNK_MAP_SUFFIX, MANIFEST_SUFFIX
+
+# Ingesta masiva: recorre un directorio de archivos de casos (.docx y .txt), los
+# extrae y segmenta en un pool de procesos y va codificando los casos en lotes de
+# tamaño fijo a medida que llegan. En memoria solo hay los archivos en curso, un
+# lote de casos y el propio índice FAISS.
+
+
+def iter_case_files(root, extensions=SUPPORTED_EXTENSIONS):
+    """
+    Recorre `root` (recursivamente, en orden) y devuelve las rutas de los archivos de casos.
+    Se omiten los temporales de Word ("~$...").
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions) and not filename.startswith("~$"):
+                yield os.path.join(dirpath, filename)
+
+
+def process_file(path):
+    """
+    Extrae y segmenta un archivo (se ejecuta en los procesos del pool).
+
+    Returns:
+        tuple: (ruta, casos, error). Si falla, `casos` está vacío y `error` lo describe.
+    """
+    try:
+        cases = segment_cases(extract_text(path))
+    except Exception as e:
+        return path, [], str(e)
+    if not cases:
+        return path, [], "No se encontraron casos (ninguno empieza con 'Nombre')."
+    return path, cases, None
+
+
+def iter_processed_files(paths, workers, max_pending=None):
+    """
+    Procesa los archivos en un pool de `workers` procesos y devuelve los
+    resultados de `process_file` según terminan.
+
+    Como mucho hay `max_pending` archivos en curso, así que la memoria no crece
+    con el tamaño del directorio aunque el consumidor (el encoder) sea más lento.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield process_file(path)
+        return
+    max_pending = max_pending or 4 * workers
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            for path in paths:
+                pending.add(executor.submit(process_file, path))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def ingest_directory(root, model, index_path, cases_path, workers=None, batch_size=256,
+                     index_spec=DEFAULT_INDEX_SPEC, model_name=None, train_size=20000,
+                     failures_path=None, progress_every=500, metric=DEFAULT_METRIC, backend=ENCODER_BACKEND):
+    """
+    Construye el índice FAISS y el almacén de casos a partir de todos los archivos
+    de un directorio.
+
+    Los archivos se extraen y segmentan en paralelo; los casos se codifican en
+    lotes de `batch_size` y se añaden al índice y al CaseStore lote a lote. Los
+    archivos que no se pueden leer no detienen la ingesta: se informan aparte.
+
+    El resultado es el mismo que el de `build_index` (un vector por caso, índice
+    BM25 y manifiesto), así que después se puede actualizar con `--incremental`.
+
+    Args:
+        root (str): Directorio con los archivos .docx / .txt.
+        model (SentenceTransformer): El modelo de embeddings.
+        index_path (str): Dónde guardar el índice FAISS.
+        cases_path (str): Dónde guardar los casos (almacén SQLite .db).
+        workers (int): Procesos para extraer y segmentar (por defecto, los núcleos).
+        batch_size (int): Casos por llamada al encoder.
+        index_spec (str): Tipo de índice FAISS (ver index_factory.py).
+        model_name (str): Nombre del modelo (se guarda en el manifiesto).
+        train_size (int): Vectores con los que se entrenan los índices IVF/PQ antes
+            de empezar a añadir.
+        failures_path (str): Si se indica, los fallos se guardan ahí en JSON lines.
+        progress_every (int): Cada cuántos archivos se informa del progreso.
+        metric (str): Métrica del índice: "l2" o "cosine".
+        backend (str): Backend con el que se cargó `model` (se guarda en el manifiesto).
+
+    Returns:
+        dict: Archivos, casos, fallos, segundos, archivos/s y casos/s.
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    settings = {"model_name": model_name, "chunk_tokens": None, "chunk_overlap": 64,
+                "index_spec": index_spec, "metric": metric, "backend": backend}
+
+    store = CaseStore(store_path_for(cases_path), readonly=False)
+    store.clear()
+    index = create_index(index_spec, model.get_sentence_embedding_dimension(), metric=metric)
+
+    entries = {}
+    seen_first_lines = {}
+    failures = []
+    batch = []  # (id del caso, texto)
+    untrained = []  # (ids, embeddings) a la espera de entrenar el índice
+    num_files = 0
+    next_case_id = 0
+
+    def flush():
+        ids = np.array([case_id for case_id, _ in batch], dtype='int64')
+        embeddings = np.asarray(
+            model.encode([text for _, text in batch], batch_size=batch_size, convert_to_numpy=True),
+            dtype='float32'
+        )
+        embeddings = prepare_vectors(embeddings, metric)
+        store.put_cases(dict(batch))
+        store.commit()
+        batch.clear()
+        if index.is_trained:
+            index.add_with_ids(embeddings, ids)
+            return
+        untrained.append((ids, embeddings))
+        if sum(len(ids) for ids, _ in untrained) >= train_size:
+            train_and_add()
+
+    def train_and_add():
+        embeddings = np.concatenate([emb for _, emb in untrained])
+        print(f"Entrenando el índice {index_spec} con {len(embeddings)} vectores...")
+        index.train(embeddings)
+        index.add_with_ids(embeddings, np.concatenate([ids for ids, _ in untrained]))
+        untrained.clear()
+
+    for path, cases, error in iter_processed_files(iter_case_files(root), workers):
+        num_files += 1
+        if error is not None:
+            failures.append({"path": path, "error": error})
+        for text in cases:
+            # Misma clave que `case_keys`: la primera línea, con sufijo si se repite.
+            first_line = text.split("\n", 1)[0].strip()
+            seen_first_lines[first_line] = seen_first_lines.get(first_line, 0) + 1
+            key = f"{first_line}#{seen_first_lines[first_line]}"
+            entries[key] = {"hash": content_hash(text), "case_id": next_case_id, "vector_ids": [next_case_id]}
+            batch.append((next_case_id, text))
+            next_case_id += 1
+            if len(batch) >= batch_size:
+                flush()
+        if num_files % progress_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"{num_files} archivos, {next_case_id} casos ({num_files / elapsed:.1f} archivos/s, "
+                  f"{next_case_id / elapsed:.1f} casos/s), {len(failures)} fallos")
+
+    if batch:
+        flush()
+    if untrained:
+        train_and_add()
+
+    faiss.write_index(index, index_path)
+    chunk_map_path = artifact_path(index_path, CHUNK_MAP_SUFFIX)
+    if os.path.exists(chunk_map_path):
+        os.remove(chunk_map_path)
+    bm25 = BM25Index.build(store.iter_texts("cases"))
+    bm25.save(artifact_path(index_path, BM25_SUFFIX))
+    store.close()
+    write_manifest(artifact_path(index_path, MANIFEST_SUFFIX), settings, next_case_id, next_case_id, entries)
+
+    if failures_path:
+        with open(failures_path, "w", encoding="utf-8") as f:
+            for failure in failures:
+                f.write(json.dumps(failure, ensure_ascii=False) + "\n")
+
+    seconds = time.perf_counter() - start
+    return {
+        "files": num_files,
+        "cases": next_case_id,
+        "failures": failures,
+        "seconds": seconds,
+        "files_per_second": num_files / seconds if seconds else 0.0,
+        "cases_per_second": next_case_id / seconds if seconds else 0.0,
+    }
+
+
+def print_ingest_report(result, failures_path=None):
+    print(f"\nIngesta terminada en {result['seconds']:.1f} s: {result['files']} archivos "
+          f"({result['files_per_second']:.1f}/s), {result['cases']} casos ({result['cases_per_second']:.1f}/s).")
+    if result["failures"]:
+        print(f"{len(result['failures'])} archivos no se pudieron ingerir:")
+        for failure in result["failures"][:10]:
+            print(f"  {failure['path']}: {failure['error']}")
+        if len(result["failures"]) > 10:
+            print(f"  ... y {len(result['failures']) - 10} más" +
+                  (f" (ver {failures_path})" if failures_path else ""))
+
+
+if __name__ == "__main__":
+    from encoders import ENCODER_BACKENDS, load_encoder
+
+    parser = argparse.ArgumentParser(description="Ingesta masiva de un directorio de casos (.docx / .txt).")
+    parser.add_argument("--input-dir", default="../data")
+    parser.add_argument("--index-path", default="../models/patient_cases.index")
+    parser.add_argument("--cases-path", default="../models/patient_cases.db")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de extracción (por defecto, los núcleos).")
+    parser.add_argument("--batch-size", type=int, default=256, help="Casos por llamada al encoder.")
+    parser.add_argument("--index-spec", default=DEFAULT_INDEX_SPEC)
+    parser.add_argument("--failures-path", default="ingest_failures.jsonl")
+    parser.add_argument("--backend", default=ENCODER_BACKEND, choices=ENCODER_BACKENDS,
+                        help="Backend del encoder (ver encoders.py).")
+    parser.add_argument("--metric", default=DEFAULT_METRIC, choices=METRICS)
+    args = parser.parse_args()
+
+    model = load_encoder(args.model_name, args.backend)
+    result = ingest_directory(
+        args.input_dir, model, args.index_path, args.cases_path,
+        workers=args.workers, batch_size=args.batch_size, index_spec=args.index_spec,
+        model_name=args.model_name, failures_path=args.failures_path, metric=args.metric,
+        backend=args.backend
+    )
+    print_ingest_report(result, args.failures_path)
@@ -1,16 +1,16 @@
 import os
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from retriever import Retriever
+from retriever_registry import get_retriever
+from llm_client import get_chat_model
 
 load_dotenv()
 api_key = os.getenv("GOOGLE_API_KEY")
 if not api_key:
     raise ValueError("No se encontró la GOOGLE_API_KEY en el archivo .env")
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=api_key)
+llm = get_chat_model()
 
 prompt_template_str = """
 Responde la pregunta basándote únicamente en el siguiente contexto:
@@ -26,9 +26,9 @@ prompt = ChatPromptTemplate.from_template(prompt_template_str)
 
 chain = prompt | llm | StrOutputParser()
 
-retriever = Retriever(
+retriever = get_retriever(
         index_path="./models/patient_cases.index",
-        cases_path="./models/patient_cases.pkl",
+        cases_path="./models/patient_cases.db",
         model_name="all-mpnet-base-v2"
     )
 query = "¿Qué es la ansiedad y cómo se relaciona con la búsqueda de empleo?"
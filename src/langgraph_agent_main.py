@@ -1,51 +1,124 @@
 # --- Importaciones de librerías y módulos necesarios ---
-import os
+import time
 import uuid
+from functools import partial
 from typing import Annotated
 from dotenv import load_dotenv
-from langchain_core.messages import BaseMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from typing_extensions import TypedDict
 
 # --- Importaciones específicas para trabajar con LangGraph (estructura tipo grafo) ---
 from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition  # Herramientas ya preparadas por LangGraph
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import START, END
 
 # --- Importamos nuestras herramientas personalizadas ---
-from rag_tools import patient_case_rag_tool, calculator_tool
+from rag_tools import patient_case_rag_tool, calculator_tool, INDEX_PATH, CASES_PATH, MODEL_NAME
+from checkpointer import create_checkpointer
+from llm_client import get_chat_model
+from history import HistoryManager, build_summary_chain
+from retriever_registry import get_retriever, warm_up
+from router import CALCULATOR_TOOL, Router, print_router_report
+from calculator import format_result
+from streaming import stream_graph_answer, print_latency_report
+from tracing import message_tokens, span
 
 # --- 1. CONFIGURACIÓN INICIAL ---
 
 # Carga las variables de entorno desde el archivo .env (por ejemplo, la API key de Google)
 load_dotenv()
 
-# Inicializamos el modelo de lenguaje de Google (Gemini)
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    google_api_key=os.getenv("GOOGLE_API_KEY")
-)
-
 # --- 2. DEFINICIÓN DE HERRAMIENTAS Y ESTADO ---
 
 # Lista de herramientas disponibles para el agente
 tools = [patient_case_rag_tool, calculator_tool]
 
-# Asociamos las herramientas al modelo, así podrá decidir cuándo usarlas
-llm_with_tools = llm.bind_tools(tools)
+# El modelo de lenguaje de Google (Gemini), compartido con las herramientas (ver
+# llm_client.py). Se crea en el primer uso, así el grafo puede construirse con un
+# modelo simulado (p. ej. en benchmarks.py) sin API key.
+_llm_with_tools = None
+_history_manager = None
+
+def get_llm_with_tools():
+    # Asociamos las herramientas al modelo, así podrá decidir cuándo usarlas
+    global _llm_with_tools
+    if _llm_with_tools is None:
+        _llm_with_tools = get_chat_model().bind_tools(tools)
+    return _llm_with_tools
 
 # Definimos el estado del agente como una lista de mensajes. LangGraph gestionará el historial.
+# `summary` resume los turnos antiguos, que ya no se envían al modelo.
 class AgentState(TypedDict):
     messages: Annotated[list, add_messages]
+    summary: str
+
+# El historial que se envía al modelo se limita a los últimos turnos; los anteriores
+# los resume el propio Gemini de forma incremental (ver history.py).
+def get_history_manager():
+    global _history_manager
+    if _history_manager is None:
+        _history_manager = HistoryManager(summarizer=build_summary_chain(get_chat_model()))
+    return _history_manager
+
+# Enrutador local (ver router.py): los turnos que son claramente aritmética o
+# preguntas sobre casos no pasan por la elección de herramienta del LLM. El
+# clasificador por embeddings usa el encoder (y la caché de preguntas) del Retriever.
+agent_router = Router(encode_fn=lambda texts: get_retriever(INDEX_PATH, CASES_PATH, MODEL_NAME).encode_queries(texts))
 
 # --- 3. DEFINICIÓN DE NODOS DEL GRAFO ---
 
-# Nodo principal (agente): decide si responder o usar una herramienta
-def agent_node(state: AgentState):
+# Nodo de historial: se ejecuta al inicio de cada turno y mantiene acotado el
+# número de mensajes que recibe el agente.
+def history_node(state: AgentState, config: RunnableConfig, history_manager=None):
+    manager = history_manager or get_history_manager()
+    with span("node.history", messages=len(state["messages"])):
+        return manager.update(state.get("summary", ""), state["messages"], config=config)
+
+# Nodo enrutador: antes del agente. Las cuentas se resuelven aquí mismo (sin LLM);
+# las preguntas sobre casos se convierten en una llamada a la herramienta RAG.
+def router_node(state: AgentState, router=None):
+    router = router or agent_router
+    last = state["messages"][-1]
+    with span("node.router") as s:
+        route = router.route(str(last.content)) if last.type == "human" else None
+        s.set(route=route.reason if route else None)
+    if route is None:
+        return {}
+    print(f"--- Enrutador: {route.tool} ({route.reason}) ---")
+    if route.tool == CALCULATOR_TOOL:
+        # El enrutador ya calculó el resultado al clasificar el turno.
+        return {"messages": [AIMessage(content=format_result(route.args["expression"], route.result))]}
+    tool_call = {"name": route.tool, "args": route.args, "id": f"enrutador-{uuid.uuid4().hex[:8]}"}
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+# Tras el enrutador: a las herramientas, al final (respuesta ya calculada) o al agente.
+def route_after_router(state: AgentState):
+    last = state["messages"][-1]
+    if last.type != "ai":
+        return "agent"
+    return "tools" if last.tool_calls else END
+
+# Nodo principal (agente): decide si responder o usar una herramienta.
+# Recibe la `config` del grafo para que sus tokens se emitan en streaming.
+# `model` permite usar otro modelo (ya con las herramientas asociadas), p. ej. en benchmarks.
+def agent_node(state: AgentState, config: RunnableConfig, model=None, router=None):
     print("---  Agente pensando... ---")
-    response = llm_with_tools.invoke(state["messages"])
+    messages = state["messages"]
+    if state.get("summary"):
+        messages = [SystemMessage(content=f"Resumen de la conversación anterior:\n{state['summary']}")] + messages
+    with span("node.agent"), span("llm") as s:
+        start = time.perf_counter()
+        response = (model or get_llm_with_tools()).invoke(messages, config=config)
+        seconds = time.perf_counter() - start
+        prompt_tokens, response_tokens = message_tokens(response)
+        s.set(prompt_tokens=prompt_tokens, response_tokens=response_tokens,
+              tool_calls=len(getattr(response, "tool_calls", [])))
+    if getattr(response, "tool_calls", None) and state["messages"][-1].type == "human":
+        # Una elección de herramienta que el enrutador no resolvió: sirve para
+        # estimar la latencia que ahorra cuando sí lo hace.
+        (router or agent_router).observe_tool_selection(seconds)
     return {"messages": [response]}
 
 # Nodo de herramientas: ejecuta la herramienta que el agente haya elegido
@@ -53,59 +126,81 @@ tool_node = ToolNode(tools)  # Nodo predefinido de LangGraph
 
 # --- 4. CONSTRUCCIÓN DEL GRAFO ---
 
-# Creamos el grafo que define el flujo del agente
-graph_builder = StateGraph(AgentState)
+def build_agent_app(model=None, checkpointer=None, router=None, history_manager=None):
+    """
+    Construye y compila el grafo del agente.
 
-# Añadimos los nodos (acciones) al grafo
-graph_builder.add_node("agent", agent_node)
-graph_builder.add_node("tools", tool_node)
+    Args:
+        model: Chat model del agente (por defecto, Gemini). Se le asocian las herramientas.
+        checkpointer: Dónde se guarda el estado de cada conversación.
+        router (Router): Enrutador local (por defecto, el del módulo).
+        history_manager (HistoryManager): Límites del historial y resumidor
+            (por defecto, `get_history_manager()`, que resume con Gemini).
+    """
+    # Creamos el grafo que define el flujo del agente
+    graph_builder = StateGraph(AgentState)
 
-# Establecemos que el flujo siempre inicia en el nodo del agente
-graph_builder.add_edge(START, "agent")
+    # Añadimos los nodos (acciones) al grafo
+    model_with_tools = model.bind_tools(tools) if model is not None else None
+    graph_builder.add_node("history", partial(history_node, history_manager=history_manager))
+    graph_builder.add_node("router", partial(router_node, router=router))
+    graph_builder.add_node("agent", partial(agent_node, model=model_with_tools, router=router))
+    graph_builder.add_node("tools", tool_node)
 
-# Luego del nodo del agente, verificamos si se debe ir a una herramienta o finalizar
-graph_builder.add_conditional_edges("agent", tools_condition)
+    # Cada turno empieza acotando el historial; el enrutador decide si hace falta el agente
+    graph_builder.add_edge(START, "history")
+    graph_builder.add_edge("history", "router")
+    graph_builder.add_conditional_edges("router", route_after_router, ["agent", "tools", END])
 
-# Si se usó una herramienta, el resultado vuelve al agente para continuar el razonamiento
-graph_builder.add_edge("tools", "agent")
+    # Luego del nodo del agente, verificamos si se debe ir a una herramienta o finalizar
+    graph_builder.add_conditional_edges("agent", tools_condition)
 
-# --- 5. COMPILAR Y EJECUTAR LA APLICACIÓN ---
+    # Si se usó una herramienta, el resultado vuelve al agente para continuar el razonamiento
+    graph_builder.add_edge("tools", "agent")
+
+    return graph_builder.compile(checkpointer=checkpointer)
 
-# Guardamos el estado automáticamente en memoria con MemorySaver
-memory = MemorySaver()
-app = graph_builder.compile(checkpointer=memory)
+# --- 5. COMPILAR Y EJECUTAR LA APLICACIÓN ---
 
 # --- INTERFAZ INTERACTIVA EN CONSOLA ---
 
-# Generamos un ID único para la sesión del usuario
-thread_id = str(uuid.uuid4())
-config = {"configurable": {"thread_id": thread_id}}
-
-# Mensaje de bienvenida
-print("\n================================================================================")
-print(" Agente Inteligente con Herramientas Iniciado")
-print("================================================================================")
-print(f" ID de sesión: {thread_id}")
-print(" Puedes hacer preguntas sobre casos de pacientes, matemáticas o simplemente conversar.\n")
-
-# Bucle de interacción con el usuario
-while True:
-    user_input = input(">> ")
-    if user_input.lower() in ["salir", "exit"]:
-        break
-
-    # Enviamos el mensaje del usuario al grafo del agente
-    events = app.stream(
-        {"messages": [("user", user_input)]},
-        config=config,
-        stream_mode="values"
-    )
-
-    # Recolectamos e imprimimos la respuesta final del agente
-    for event in events:
-        final_state = event
-
-    ai_response = final_state["messages"][-1]
-    print("\n================================== Ai Response =================================")
-    print(ai_response.content)
-    print("================================================================================\n")
+if __name__ == "__main__":
+    # Guardamos el estado automáticamente: en SQLite si se define CHECKPOINT_DB
+    # (persistente y acotado, ver checkpointer.py), o en memoria con MemorySaver.
+    # El grafo se compila aquí y no al importar el módulo (p. ej. desde benchmarks.py).
+    memory = create_checkpointer()
+    app = build_agent_app(checkpointer=memory)
+
+    # Cargamos el índice y el modelo en segundo plano mientras el usuario escribe.
+    warm_up(INDEX_PATH, CASES_PATH, MODEL_NAME, in_background=True)
+
+    # Generamos un ID único para la sesión del usuario
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+
+    # Mensaje de bienvenida
+    print("\n================================================================================")
+    print(" Agente Inteligente con Herramientas Iniciado")
+    print("================================================================================")
+    print(f" ID de sesión: {thread_id}")
+    print(" Puedes hacer preguntas sobre casos de pacientes, matemáticas o simplemente conversar.\n")
+
+    # Bucle de interacción con el usuario
+    while True:
+        user_input = input(">> ")
+        if user_input.lower() in ["salir", "exit"]:
+            print_router_report(agent_router.stats())
+            break
+
+        # Enviamos el mensaje del usuario al grafo del agente e imprimimos su
+        # respuesta token a token (solo los tokens del nodo "agent", no los de las herramientas)
+        print("\n================================== Ai Response =================================")
+        result = stream_graph_answer(
+            app,
+            {"messages": [("user", user_input)]},
+            config=config,
+            nodes=("agent",),
+            message_nodes=("router",)
+        )
+        print_latency_report(result)
+        print("================================================================================\n")
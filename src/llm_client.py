@@ -0,0 +1,469 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from functools import partial
+
+import httpx
+from langchain_core.rate_limiters import BaseRateLimiter
+
+# Capa común de acceso a Gemini para todo el proyecto:
+#   - un único cliente HTTP por proceso, con conexiones reutilizadas (keep-alive);
+#   - un limitador de peticiones (token bucket) compartido con los chat models de LangChain;
+#   - reintentos con backoff exponencial y jitter ante cuota agotada (429) y errores 5xx;
+#   - las peticiones idénticas en curso se agrupan en una sola llamada al proveedor.
+# Con GEMINI_BASE_URL se puede apuntar a un servidor local (ver fake_gemini_server.py).
+
+# Modelo único para todos los módulos (antes cada uno usaba uno distinto).
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+# Peticiones por segundo sostenidas y ráfaga máxima del token bucket.
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "5"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+
+# Estados HTTP que se reintentan: cuota agotada y errores del servidor.
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class LLMError(Exception):
+    """
+    Error al llamar al LLM. `retryable` indica si tiene sentido reintentar.
+    """
+
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TokenBucket(BaseRateLimiter):
+    """
+    Limitador token bucket: `rate` peticiones por segundo sostenidas, con ráfagas
+    de hasta `capacity`. Es seguro entre hilos y sirve también como `rate_limiter`
+    de los chat models de LangChain, así todo el proceso comparte el mismo límite.
+
+    Cada `acquire` reserva un token aunque aún no exista (el saldo puede quedar en
+    negativo) y espera lo que tarde en generarse: las esperas quedan en orden de
+    llegada sin sondear.
+    """
+
+    def __init__(self, rate=LLM_RATE_LIMIT, capacity=LLM_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, blocking):
+        # Devuelve los segundos a esperar, o None si no hay token y no se quiere esperar.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1 and not blocking:
+                return None
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate)
+            self.wait_seconds += wait
+            return wait
+
+    def acquire(self, *, blocking=True):
+        wait = self._reserve(blocking)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+    async def aacquire(self, *, blocking=True):
+        wait = self._reserve(blocking)
+        if wait is None:
+            return False
+        if wait:
+            await asyncio.sleep(wait)
+        return True
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=20.0, retry_after=None):
+    """
+    Espera antes del reintento `attempt` (0, 1, ...): backoff exponencial con jitter
+    completo, para que los clientes que fallaron a la vez no reintenten a la vez.
+    Si el servidor indica `Retry-After`, se espera al menos eso.
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _response_text(data):
+    # Texto de una respuesta (o de un fragmento en streaming) de generateContent.
+    candidates = data.get("candidates") or []
+    if not candidates:
+        reason = (data.get("promptFeedback") or {}).get("blockReason")
+        if reason:
+            raise LLMError(f"El prompt fue bloqueado: {reason}")
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+def _raise_for_status(response):
+    if response.status_code == 200:
+        return
+    try:
+        message = response.json().get("error", {}).get("message", response.text)
+    except ValueError:
+        message = response.text
+    retry_after = response.headers.get("retry-after")
+    raise LLMError(
+        f"Gemini respondió {response.status_code}: {message}",
+        status=response.status_code,
+        retryable=response.status_code in RETRYABLE_STATUSES,
+        retry_after=float(retry_after) if retry_after and retry_after.replace(".", "", 1).isdigit() else None,
+    )
+
+
+class LLMClient:
+    """
+    Cliente de Gemini (API REST generateContent) compartido por todo el proceso.
+
+    Uso: `generate(prompt)`, `agenerate(prompt)` y `stream(prompt)`. Las tres
+    devuelven texto y lanzan `LLMError` si la llamada falla tras los reintentos.
+    """
+
+    def __init__(self, model=LLM_MODEL, api_key=None, base_url=GEMINI_BASE_URL, rate_limiter=None,
+                 max_retries=LLM_MAX_RETRIES, base_delay=0.5, max_delay=20.0, timeout=LLM_TIMEOUT,
+                 max_connections=LLM_MAX_CONNECTIONS, coalesce=True):
+        """
+        Args:
+            model (str): Modelo de Gemini.
+            api_key (str): API key (por defecto, GOOGLE_API_KEY).
+            base_url (str): URL base de la API (un servidor local en las pruebas).
+            rate_limiter (TokenBucket): Limitador de peticiones (por defecto, uno propio).
+            max_retries (int): Reintentos ante 429, 5xx o errores de red.
+            base_delay (float): Espera máxima (s) del primer reintento; se dobla en cada uno.
+            max_delay (float): Tope de la espera entre reintentos (s).
+            timeout (float): Timeout de cada petición (s).
+            max_connections (int): Conexiones simultáneas del pool.
+            coalesce (bool): Agrupar los prompts idénticos en curso en una sola petición.
+        """
+        self.model = model
+        self.api_key = api_key if api_key is not None else os.getenv("GOOGLE_API_KEY")
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.coalesce = coalesce
+        self._client = None
+        # Loop -> AsyncClient. Débil: si un loop desaparece sin `aclose`, su cliente no queda retenido.
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._inflight = {}
+        self._ainflight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.errors = 0
+
+    # --- Conexiones ---
+
+    def _headers(self):
+        return {"x-goog-api-key": self.api_key or "", "Content-Type": "application/json"}
+
+    def _url(self, method):
+        return f"{self.base_url}/v1beta/models/{self.model}:{method}"
+
+    @staticmethod
+    def _body(prompt):
+        return {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+    def _sync_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(timeout=self.timeout, limits=self.limits)
+            return self._client
+
+    def _async_client(self):
+        # Un AsyncClient por event loop (sus conexiones no se pueden compartir entre loops).
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return client
+
+    def close(self):
+        """
+        Cierra el cliente síncrono y los AsyncClient de los event loops que aún se
+        pueden usar. Lo correcto es hacer `await aclose()` dentro de cada loop antes
+        de que termine (p. ej. al final de la corrutina de `asyncio.run`): el cliente
+        de un loop ya cerrado no se puede cerrar desde fuera.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+        for loop, client in list(self._async_clients.items()):
+            if loop.is_closed():
+                continue
+            if not loop.is_running():
+                loop.run_until_complete(client.aclose())
+            elif loop is _running_loop():
+                # No se puede esperar al propio loop desde dentro: se cierra en segundo plano.
+                loop.create_task(client.aclose())
+            else:
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=self.timeout)
+        self._async_clients.clear()
+
+    async def aclose(self):
+        """
+        Cierra el AsyncClient del event loop actual. Hay que llamarlo en cada loop
+        que haya usado `agenerate` antes de que termine.
+        """
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    # --- Reintentos ---
+
+    def _retry_delay(self, error, attempt):
+        if not error.retryable or attempt >= self.max_retries:
+            with self._lock:
+                self.errors += 1
+            return None
+        with self._lock:
+            self.retries += 1
+        return backoff_delay(attempt, self.base_delay, self.max_delay, error.retry_after)
+
+    def _post(self, prompt):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self._sync_client().post(self._url("generateContent"), headers=self._headers(),
+                                                    json=self._body(prompt))
+                _raise_for_status(response)
+                return _response_text(response.json())
+            except httpx.TransportError as e:
+                error = LLMError(f"Error de conexión con Gemini: {e}", retryable=True)
+            except LLMError as e:
+                error = e
+            delay = self._retry_delay(error, attempt)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+
+    async def _apost(self, prompt):
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.aacquire()
+            with self._lock:
+                self.requests += 1
+            try:
+                response = await self._async_client().post(self._url("generateContent"), headers=self._headers(),
+                                                           json=self._body(prompt))
+                _raise_for_status(response)
+                return _response_text(response.json())
+            except httpx.TransportError as e:
+                error = LLMError(f"Error de conexión con Gemini: {e}", retryable=True)
+            except LLMError as e:
+                error = e
+            delay = self._retry_delay(error, attempt)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+
+    # --- API ---
+
+    def generate(self, prompt):
+        """
+        Envía el prompt y devuelve la respuesta. Si el mismo prompt ya está en
+        curso (en otro hilo), espera a esa respuesta en lugar de repetir la petición.
+
+        Raises:
+            LLMError: Si la llamada falla tras los reintentos.
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(prompt) if self.coalesce else None
+            leader = future is None
+            if leader:
+                future = Future()
+                if self.coalesce:
+                    self._inflight[prompt] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = self._post(prompt)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if self.coalesce:
+                with self._lock:
+                    self._inflight.pop(prompt, None)
+
+    async def agenerate(self, prompt):
+        """
+        Versión asíncrona de `generate`: no bloquea el event loop y agrupa los
+        prompts idénticos de distintas corrutinas.
+
+        La petición agrupada es una tarea del cliente, no de la corrutina que la
+        inició: si una de las que esperan se cancela, las demás siguen esperando la
+        misma respuesta. Solo si se cancelan todas se cancela la petición.
+        """
+        with self._lock:
+            self.calls += 1
+        if not self.coalesce:
+            return await self._apost(prompt)
+        loop = asyncio.get_running_loop()
+        key = (loop, prompt)
+        inflight = self._ainflight.get(key)
+        if inflight is None:
+            task = loop.create_task(self._apost(prompt))
+            inflight = self._ainflight[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(partial(self._finish_inflight, key))
+        else:
+            with self._lock:
+                self.coalesced += 1
+        inflight["waiters"] += 1
+        try:
+            return await asyncio.shield(inflight["task"])
+        finally:
+            inflight["waiters"] -= 1
+            if inflight["waiters"] == 0 and not inflight["task"].done():
+                # Ya no espera nadie (todas las corrutinas se cancelaron).
+                inflight["task"].cancel()
+
+    def _finish_inflight(self, key, task):
+        if self._ainflight.get(key, {}).get("task") is task:
+            del self._ainflight[key]
+        if not task.cancelled():
+            # Marca la excepción como recuperada aunque ya no la espere nadie.
+            task.exception()
+
+    def stream(self, prompt):
+        """
+        Envía el prompt y devuelve la respuesta en fragmentos, a medida que se genera
+        (streamGenerateContent). Solo se reintenta si aún no se ha entregado nada.
+
+        Yields:
+            str: Fragmentos de texto de la respuesta.
+        """
+        with self._lock:
+            self.calls += 1
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            with self._lock:
+                self.requests += 1
+            started = False
+            try:
+                with self._sync_client().stream("POST", self._url("streamGenerateContent"), params={"alt": "sse"},
+                                                headers=self._headers(), json=self._body(prompt)) as response:
+                    if response.status_code != 200:
+                        response.read()
+                        _raise_for_status(response)
+                    for line in response.iter_lines():
+                        if line.startswith("data:"):
+                            text = _response_text(json.loads(line[5:]))
+                            if text:
+                                started = True
+                                yield text
+                return
+            except httpx.TransportError as e:
+                error = LLMError(f"Error de conexión con Gemini: {e}", retryable=True)
+            except LLMError as e:
+                error = e
+            delay = None if started else self._retry_delay(error, attempt)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Llamadas, peticiones al proveedor (con reintentos), llamadas
+                agrupadas, reintentos, errores finales y segundos de espera del limitador.
+        """
+        return {
+            "calls": self.calls,
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "errors": self.errors,
+            "rate_limit_wait_s": self.rate_limiter.wait_seconds,
+        }
+
+
+# El limitador y el cliente del proceso, compartidos por todos los módulos.
+_rate_limiter = TokenBucket()
+_client = None
+_chat_models = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    return _rate_limiter
+
+
+def get_llm_client():
+    """
+    El LLMClient del proceso (se crea en el primer uso).
+    """
+    global _client
+    with _registry_lock:
+        if _client is None:
+            _client = LLMClient(rate_limiter=_rate_limiter)
+        return _client
+
+
+def get_chat_model(model=LLM_MODEL):
+    """
+    El chat model de LangChain para Gemini, compartido por los grafos y las
+    herramientas: una sola instancia (y sus conexiones) por modelo, con el mismo
+    limitador de peticiones que `get_llm_client()` y sus reintentos.
+    """
+    with _registry_lock:
+        if model not in _chat_models:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+
+            _chat_models[model] = ChatGoogleGenerativeAI(
+                model=model,
+                google_api_key=os.getenv("GOOGLE_API_KEY"),
+                rate_limiter=_rate_limiter,
+                max_retries=LLM_MAX_RETRIES,
+            )
+        return _chat_models[model]
+
+
+if __name__ == "__main__":
+    from fake_gemini_server import FakeGeminiServer
+
+    with FakeGeminiServer(latency=0.05, error_rate=0.3) as server:
+        client = LLMClient(base_url=server.url, api_key="local", base_delay=0.05)
+        print(client.generate("¿Qué es la Terapia de Aceptación y Compromiso?"))
+        print("".join(client.stream("Explica la ansiedad en pocas palabras.")))
+        print(client.stats(), server.stats())
+        client.close()
@@ -1,19 +1,25 @@
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+from llm_client import LLMError, get_llm_client
+
+# Las llamadas a Gemini pasan por el cliente compartido de llm_client.py:
+# conexiones reutilizadas, límite de peticiones, reintentos y agrupación de
+# prompts idénticos en curso. Si la llamada falla tras los reintentos, se lanza
+# LLMError en lugar de devolver el error como si fuera la respuesta.
+
 def configure_llm():
     """
-    Carga la API key desde el archivo .env y configura el modelo generativo.
+    Carga la API key desde el archivo .env y prepara el cliente compartido.
     """
     load_dotenv()
-    
+
     api_key = os.getenv("GOOGLE_API_KEY")
-    
+
     if not api_key:
         raise ValueError("No se encontró la GOOGLE_API_KEY en el archivo .env")
-        
-    genai.configure(api_key=api_key)
+
+    get_llm_client().api_key = api_key
 
 def generate_test_answer(prompt):
     """
@@ -24,25 +30,55 @@ def generate_test_answer(prompt):
 
     Returns:
         str: La respuesta del modelo como texto.
+
+    Raises:
+        LLMError: Si la llamada falla tras los reintentos.
     """
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        
-        response = model.generate_content(prompt)
-        
-        return response.text
-    except Exception as e:
-        return f"Error al generar la respuesta: {e}"
+    return get_llm_client().generate(prompt)
+
+async def agenerate_test_answer(prompt):
+    """
+    Versión asíncrona de `generate_test_answer`: no bloquea el event loop mientras
+    espera a Gemini.
+
+    Args:
+        prompt (str): La pregunta o instrucción para el modelo.
+
+    Returns:
+        str: La respuesta del modelo como texto.
+
+    Raises:
+        LLMError: Si la llamada falla tras los reintentos.
+    """
+    return await get_llm_client().agenerate(prompt)
+
+def generate_answer_stream(prompt):
+    """
+    Envía un prompt a Gemini y devuelve la respuesta en fragmentos, a medida que se genera.
+
+    Args:
+        prompt (str): La pregunta o instrucción para el modelo.
+
+    Yields:
+        str: Fragmentos de texto de la respuesta.
+
+    Raises:
+        LLMError: Si la llamada falla antes de empezar la respuesta o a mitad de ella.
+    """
+    yield from get_llm_client().stream(prompt)
 
 if __name__ == "__main__":
     configure_llm()
-    
+
     test_prompt = "Explica qué es la Terapia de Aceptación y Compromiso (ACT) en menos de 50 palabras."
-    
+
     print(f"Prompt: '{test_prompt}'")
     print("-" * 20)
 
-    answer = generate_test_answer(test_prompt)
+    try:
+        answer = generate_test_answer(test_prompt)
+    except LLMError as e:
+        answer = f"Error al generar la respuesta: {e}"
 
     print("Respuesta:")
-    print(answer)
\ No newline at end of file
+    print(answer)
@@ -1,8 +1,24 @@
-from retriever import Retriever
-from llm_generator import configure_llm, generate_test_answer
+import asyncio
+
+from caching import SemanticAnswerCache
+from context_packer import DEFAULT_CONTEXT_TOKENS, count_tokens
+from retriever_registry import get_retriever
+from llm_client import LLMError
+from llm_generator import configure_llm, generate_test_answer, generate_answer_stream, agenerate_test_answer
 from prompt_manager import create_rag_prompt_template, format_prompt
+from streaming import consume_stream, print_token, print_latency_report
+from tracing import span
 
-def run_rag_pipeline(question, retriever, top_k=5):
+def build_rag_prompt(question, contexto):
+    """
+    Genera el prompt final con el contexto ya empaquetado (ver context_packer.py).
+    """
+    prompt_template = create_rag_prompt_template()
+    return format_prompt(template=prompt_template, contexto=contexto, pregunta=question)
+
+def run_rag_pipeline(question, retriever, top_k=5, rerank=False, stream=False, on_token=print_token,
+                     generate_fn=generate_test_answer, stream_fn=generate_answer_stream, answer_cache=None,
+                     context_tokens=DEFAULT_CONTEXT_TOKENS):
     """
     Ejecuta el pipeline completo de RAG.
     
@@ -10,41 +26,144 @@ def run_rag_pipeline(question, retriever, top_k=5):
         question (str): La pregunta del usuario.
         retriever (Retriever): El retriever a usar.
         top_k (int): El número de casos a recuperar como contexto.
+        rerank (bool): Reordenar los candidatos con el cross-encoder antes de
+            quedarse con los top_k (permite enviar menos casos al LLM).
+        stream (bool): Entregar la respuesta token a token a `on_token` mientras se
+            genera, e informar del tiempo hasta el primer token.
+        on_token (callable): Recibe cada fragmento de la respuesta en modo stream.
+        generate_fn (callable): prompt -> respuesta. Por defecto, Gemini.
+        stream_fn (callable): prompt -> fragmentos de la respuesta. Por defecto, Gemini.
+        answer_cache (SemanticAnswerCache): Si se indica, una paráfrasis de una
+            pregunta anterior con los mismos casos recuperados reutiliza su
+            respuesta sin llamar al LLM.
+        context_tokens (int): Presupuesto de tokens del contexto: los casos se
+            añaden por relevancia hasta llenarlo y el último se recorta.
 
     Returns:
         str: La respuesta final generada por el LLM.
     """
+    # Cada etapa se mide con un span (ver tracing.py).
+    with span("rag_pipeline", top_k=top_k, stream=stream):
+        return _run_rag_pipeline(question, retriever, top_k, rerank, stream, on_token,
+                                 generate_fn, stream_fn, answer_cache, context_tokens)
+
+def _run_rag_pipeline(question, retriever, top_k, rerank, stream, on_token,
+                      generate_fn, stream_fn, answer_cache, context_tokens):
     print("--- INICIANDO PIPELINE RAG ---")
 
     # 1. RETRIEVE
     print(f"1. Buscando los {top_k} casos más relevantes para: '{question}'")
 
-    retrieved_cases = retriever.search(query=question, top_k=top_k)
-    
-    contexto = "\n\n---\n\n".join(retrieved_cases)
-    print("2. Contexto recuperado.")
+    with span("retrieve"):
+        hits = retriever.search_batch([question], top_k=top_k, rerank=rerank)[0]
+    packed = retriever.pack_context(hits, max_tokens=context_tokens)
+    print(f"2. Contexto recuperado ({len(packed.case_ids)} casos, {packed.tokens} tokens).")
 
     # 2. FORMAT PROMPT
-    prompt_template = create_rag_prompt_template()
-    final_prompt = format_prompt(template=prompt_template, contexto=contexto, pregunta=question)
+    with span("format_prompt"):
+        final_prompt = build_rag_prompt(question, packed.text)
     print("3. Prompt final generado.")
 
-    # 3. GENERATE
-    print("4. Enviando prompt a Gemini para generar la respuesta...")
-    final_answer = generate_test_answer(final_prompt)
+    # 3. GENERATE (o reutilizar la respuesta de una pregunta equivalente)
+    cached_answer = None
+    if answer_cache is not None:
+        # El embedding de la pregunta ya está en la caché del Retriever tras la búsqueda.
+        with span("cache_lookup") as s:
+            query_embedding = retriever.encode_queries([question])[0]
+            case_ids = packed.case_ids
+            cached_answer = answer_cache.get(query_embedding, case_ids, retriever.build_id)
+            s.set(hit=cached_answer is not None)
+
+    if cached_answer is not None:
+        print("4. Respuesta tomada de la caché semántica (sin llamar a Gemini).")
+        chunks = [cached_answer]
+    else:
+        print("4. Enviando prompt a Gemini para generar la respuesta...")
+        chunks = stream_fn(final_prompt) if stream else None
+
+    if stream:
+        print("\n========= RESPUESTA DEL ASISTENTE =========\n")
+        if cached_answer is not None:
+            result = consume_stream(chunks, on_token=on_token)
+        else:
+            with span("llm", prompt_tokens=count_tokens(final_prompt), stream=True) as s:
+                result = consume_stream(chunks, on_token=on_token)
+                s.set(response_tokens=count_tokens(result["answer"]),
+                      time_to_first_token_ms=1000 * result["time_to_first_token"])
+        print_latency_report(result)
+        final_answer = result["answer"]
+    elif cached_answer is not None:
+        final_answer = cached_answer
+    else:
+        with span("llm", prompt_tokens=count_tokens(final_prompt)) as s:
+            final_answer = generate_fn(final_prompt)
+            s.set(response_tokens=count_tokens(final_answer))
+
+    if answer_cache is not None and cached_answer is None:
+        answer_cache.put(query_embedding, case_ids, final_answer, retriever.build_id)
 
     print("--- PIPELINE FINALIZADO ---")
     return final_answer
 
+async def arun_rag_pipeline(question, async_retriever, top_k=5, rerank=False,
+                            agenerate_fn=agenerate_test_answer, answer_cache=None,
+                            context_tokens=DEFAULT_CONTEXT_TOKENS):
+    """
+    Versión asíncrona de `run_rag_pipeline`, para atender muchas sesiones a la vez.
+
+    La búsqueda se hace en el pool de hilos (agrupada con las de otras sesiones,
+    ver async_retriever.py) y la llamada al LLM no bloquea el event loop.
+
+    Args:
+        question (str): La pregunta del usuario.
+        async_retriever (AsyncRetriever): El retriever asíncrono a usar.
+        top_k (int): El número de casos a recuperar como contexto.
+        rerank (bool): Reordenar los candidatos con el cross-encoder.
+        agenerate_fn (callable): Corrutina prompt -> respuesta. Por defecto, Gemini.
+        answer_cache (SemanticAnswerCache): Caché semántica de respuestas (opcional).
+        context_tokens (int): Presupuesto de tokens del contexto.
+
+    Returns:
+        str: La respuesta final generada por el LLM.
+    """
+    with span("rag_pipeline", top_k=top_k, mode="async"):
+        with span("retrieve"):
+            hits = await async_retriever.search_hits(question, top_k=top_k, rerank=rerank)
+        retriever = async_retriever.retriever
+        packed = retriever.pack_context(hits, max_tokens=context_tokens)
+        if answer_cache is not None:
+            with span("cache_lookup") as s:
+                loop = asyncio.get_running_loop()
+                query_embedding = (await loop.run_in_executor(
+                    async_retriever.executor, retriever.encode_queries, [question]
+                ))[0]
+                case_ids = packed.case_ids
+                cached_answer = answer_cache.get(query_embedding, case_ids, retriever.build_id)
+                s.set(hit=cached_answer is not None)
+            if cached_answer is not None:
+                return cached_answer
+
+        with span("format_prompt"):
+            final_prompt = build_rag_prompt(question, packed.text)
+        with span("llm", prompt_tokens=count_tokens(final_prompt)) as s:
+            answer = await agenerate_fn(final_prompt)
+            s.set(response_tokens=count_tokens(answer))
+    if answer_cache is not None:
+        answer_cache.put(query_embedding, case_ids, answer, retriever.build_id)
+    return answer
+
 if __name__ == "__main__":
     configure_llm()
     
-    retriever = Retriever(
+    retriever = get_retriever(
         index_path="../models/patient_cases.index",
-        cases_path="../models/patient_cases.pkl",
+        cases_path="../models/patient_cases.db",
         model_name="all-mpnet-base-v2"
     )
 
+    # Las paráfrasis de preguntas ya respondidas (con los mismos casos) no vuelven a llamar a Gemini.
+    answer_cache = SemanticAnswerCache()
+
     print("\n¡Bienvenido al Asistente de Historiales Clínicos!")
     print("Puedes hacer preguntas sobre los pacientes. Escribe 'salir' para terminar.")
     
@@ -52,11 +171,17 @@ if __name__ == "__main__":
         user_question = input("\n>Pregunta: ")
         
         if user_question.lower() in ["salir", "exit", "quit"]:
+            stats = answer_cache.stats()
+            print(f"Caché de respuestas: {stats['hits']} aciertos de {stats['hits'] + stats['misses']} "
+                  f"preguntas ({stats['hit_rate']:.0%}).")
             print("Gracias por usar el asistente. ¡Hasta luego!")
             break
             
-        answer = run_rag_pipeline(user_question, retriever)
-        
-        print("\n========= RESPUESTA DEL ASISTENTE =========\n")
-        print(answer)
+        # Con el reordenamiento bastan 3 casos de contexto en lugar de 5.
+        # La respuesta se imprime token a token a medida que llega.
+        try:
+            run_rag_pipeline(user_question, retriever, top_k=3, rerank=True, stream=True,
+                             answer_cache=answer_cache)
+        except LLMError as e:
+            print(f"\nError al generar la respuesta: {e}")
         print("\n===========================================\n")
\ No newline at end of file
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from functools import partial
+
+from langchain_core.messages import HumanMessage
+
+from async_retriever import get_async_retriever, get_executor
+from caching import SemanticAnswerCache
+from checkpointer import CHECKPOINT_DB, create_checkpointer
+from history import HistoryManager, build_summary_chain
+from chat_pipeline_rag import build_app, build_rag_chain, INDEX_PATH, CASES_PATH, MODEL_NAME
+from llm_client import LLMError, get_llm_client
+from llm_generator import configure_llm, agenerate_test_answer
+from rag_chatbot import arun_rag_pipeline
+from retriever_registry import get_retriever
+from stub_llm import StubChatModel, StubLLM
+from synthetic_cases import SAMPLE_QUERIES
+from tracing import percentile_ms, tracer
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+# Casos máximos que se pueden pedir en /ask.
+MAX_TOP_K = 50
+
+
+class RAGServer:
+    """
+    Servidor HTTP local mínimo (asyncio) que atiende muchas sesiones a la vez.
+
+    Endpoints (JSON):
+        POST /chat  {"thread_id": ..., "message": ...}  -> grafo con memoria por thread_id
+        POST /ask   {"question": ..., "top_k": 5}        -> pipeline RAG sin memoria
+        GET  /health                                     -> estado y métricas de la caché
+        GET  /metrics                                    -> histogramas por etapa (texto Prometheus)
+
+    /ask usa una caché semántica de respuestas (ver caching.SemanticAnswerCache).
+    """
+
+    def __init__(self, app, agenerate_fn, answer_cache=None):
+        self.app = app
+        self.agenerate_fn = agenerate_fn
+        self.answer_cache = answer_cache if answer_cache is not None else SemanticAnswerCache()
+        self.requests = 0
+
+    async def _async_retriever(self):
+        loop = asyncio.get_running_loop()
+        retriever = await loop.run_in_executor(
+            get_executor(), partial(get_retriever, INDEX_PATH, CASES_PATH, MODEL_NAME)
+        )
+        return get_async_retriever(retriever)
+
+    async def dispatch(self, method, path, body):
+        if method == "GET" and path == "/metrics":
+            # Histogramas de latencia y tokens por etapa, para Prometheus (ver tracing.py).
+            return 200, tracer.prometheus_text()
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "requests": self.requests, "answer_cache": self.answer_cache.stats()}
+        if method != "POST" or path not in ("/chat", "/ask"):
+            return 404, {"error": f"Ruta no encontrada: {method} {path}"}
+
+        payload = json.loads(body or b"{}")
+        self.requests += 1
+        start = time.perf_counter()
+        if path == "/chat":
+            if "message" not in payload:
+                return 400, {"error": "Falta el campo 'message'."}
+            thread_id = payload.get("thread_id") or str(uuid.uuid4())
+            state = await self.app.ainvoke(
+                {"messages": [HumanMessage(content=payload["message"])]},
+                config={"configurable": {"thread_id": thread_id}},
+            )
+            answer = state["messages"][-1].content
+            return 200, {"thread_id": thread_id, "answer": answer, "latency": time.perf_counter() - start}
+
+        if "question" not in payload:
+            return 400, {"error": "Falta el campo 'question'."}
+        top_k = payload.get("top_k", 5)
+        if type(top_k) is not int or not 1 <= top_k <= MAX_TOP_K:
+            return 400, {"error": f"'top_k' debe ser un entero entre 1 y {MAX_TOP_K}."}
+        answer = await arun_rag_pipeline(
+            payload["question"], await self._async_retriever(),
+            top_k=top_k, agenerate_fn=self.agenerate_fn,
+            answer_cache=self.answer_cache
+        )
+        return 200, {"answer": answer, "latency": time.perf_counter() - start}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, payload = await self.dispatch(method, path, body)
+        except (ValueError, json.JSONDecodeError) as e:
+            status, payload = 400, {"error": str(e)}
+        except LLMError as e:
+            # Gemini no respondió ni tras los reintentos (cuota agotada, caída...).
+            status, payload = 503, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": str(e)}
+
+        if isinstance(payload, str):
+            data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+        writer.close()
+
+    async def start(self, host="127.0.0.1", port=8000):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def post_json(host, port, path, payload):
+    """
+    Cliente HTTP mínimo: envía un POST con JSON y devuelve la respuesta decodificada.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    _, _, response_body = response.partition(b"\r\n\r\n")
+    return json.loads(response_body)
+
+
+async def load_test(host, port, sessions, turns, questions):
+    """
+    Lanza `sessions` conversaciones concurrentes, cada una con su thread_id y
+    `turns` preguntas seguidas.
+
+    Returns:
+        dict: Turnos atendidos, throughput (turnos/s) y latencias p50/p99.
+    """
+    latencies = []
+
+    async def session(i):
+        thread_id = f"carga-{i}-{uuid.uuid4().hex[:8]}"
+        for turn in range(turns):
+            start = time.perf_counter()
+            result = await post_json(host, port, "/chat", {
+                "thread_id": thread_id,
+                "message": questions[(i + turn) % len(questions)],
+            })
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "turns": len(latencies),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+    }
+
+
+def build_server(stub_llm=False, stub_latency=0.5, checkpoint_db=CHECKPOINT_DB):
+    """
+    Crea el servidor con el grafo asíncrono. Con `stub_llm` se usa un LLM local
+    simulado (sin red ni API key) para pruebas de carga. Con `checkpoint_db`, las
+    conversaciones se guardan en ese archivo SQLite en lugar de en memoria.
+    """
+    if stub_llm:
+        stub_model = StubChatModel(latency=stub_latency)
+        chain = build_rag_chain(stub_model)
+        # El resumen del historial también usa el LLM simulado: sin él, las sesiones
+        # largas llamarían a Gemini (y sin API key fallaría).
+        history_manager = HistoryManager(summarizer=build_summary_chain(stub_model))
+        agenerate_fn = StubLLM(latency=stub_latency).agenerate
+    else:
+        configure_llm()
+        chain = None
+        history_manager = None
+        agenerate_fn = agenerate_test_answer
+    app = build_app(chain=chain, checkpointer=create_checkpointer(checkpoint_db), use_async=True,
+                    history_manager=history_manager)
+    return RAGServer(app, agenerate_fn)
+
+
+async def run_load_tests(server, session_counts, turns):
+    tcp_server = await server.start("127.0.0.1", 0)
+    host, port = tcp_server.sockets[0].getsockname()[:2]
+    # Un turno previo para cargar el Retriever y el modelo antes de medir.
+    await post_json(host, port, "/chat", {"message": SAMPLE_QUERIES[0]})
+
+    print("\n========= PRUEBA DE CARGA: sesiones concurrentes =========")
+    print(f"{'sesiones':>9}{'turnos':>8}{'turnos/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for sessions in session_counts:
+        r = await load_test(host, port, sessions, turns, SAMPLE_QUERIES)
+        print(f"{r['sessions']:>9}{r['turns']:>8}{r['throughput']:>10.1f}{r['p50_ms']:>10.0f}{r['p99_ms']:>10.0f}")
+    tcp_server.close()
+    await tcp_server.wait_closed()
+    await get_llm_client().aclose()
+
+
+async def serve(server, host, port):
+    tcp_server = await server.start(host, port)
+    print(f"Servidor RAG escuchando en http://{host}:{port} (POST /chat, POST /ask, GET /health)")
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        await get_llm_client().aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor RAG asíncrono con sesiones concurrentes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stub-llm", action="store_true", help="Usa un LLM local simulado en lugar de Gemini.")
+    parser.add_argument("--stub-latency", type=float, default=0.5, help="Latencia del LLM simulado (s).")
+    parser.add_argument("--checkpoint-db", default=CHECKPOINT_DB,
+                        help="Archivo SQLite para las conversaciones (por defecto, en memoria).")
+    parser.add_argument("--load-test", action="store_true",
+                        help="En lugar de servir, mide el throughput con N sesiones concurrentes.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--turns", type=int, default=3)
+    args = parser.parse_args()
+
+    server = build_server(stub_llm=args.stub_llm, stub_latency=args.stub_latency,
+                          checkpoint_db=args.checkpoint_db)
+    if args.load_test:
+        asyncio.run(run_load_tests(server, args.sessions, args.turns))
+    else:
+        asyncio.run(serve(server, args.host, args.port))
@@ -1,36 +1,46 @@
+import asyncio
 import os
+from functools import partial
 from dotenv import load_dotenv
 
 # --- Importaciones de LangChain ---
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.tools import tool
+from langchain_core.tools import StructuredTool
 
-# Importa tu Retriever personalizado
-from retriever import Retriever
+# Registro de Retrievers compartidos (se cargan en el primer uso, no al importar)
+from retriever_registry import get_retriever
+from async_retriever import get_async_retriever, get_executor
+from caching import SemanticAnswerCache
+from calculator import format_result, safe_eval
+from llm_client import get_chat_model
+from context_packer import DEFAULT_CONTEXT_TOKENS, count_tokens
+from tracing import span
 
 # --- 1. CONFIGURACIÓN DE COMPONENTES ---
 # Cada herramienta puede necesitar sus propios componentes para funcionar.
 load_dotenv()
 
-# El LLM que usará la herramienta RAG internamente.
-llm = ChatGoogleGenerativeAI(
-    model="gemini-1.5-flash",
-    google_api_key=os.getenv("GOOGLE_API_KEY")
-)
+# El sistema de recuperación (Retriever). Se carga la primera vez que se usa la herramienta.
+INDEX_PATH = "./models/patient_cases.index"
+CASES_PATH = "./models/patient_cases.db"
+MODEL_NAME = "all-mpnet-base-v2"
+# Tokens máximos del contexto que se pasa al LLM (ver context_packer.py).
+CONTEXT_TOKENS = DEFAULT_CONTEXT_TOKENS
 
-# El sistema de recuperación (Retriever).
-retriever = Retriever(
-    index_path="./models/patient_cases.index",
-    cases_path="./models/patient_cases.pkl",
-    model_name="all-mpnet-base-v2"
-)
+# Qué devuelve la herramienta RAG (configurable por despliegue con RAG_TOOL_MODE):
+#   "answer"  -> responde con su propio LLM (`get_rag_chain`) y el agente vuelve a redactar.
+#   "context" -> devuelve los casos recuperados y empaquetados, con sus puntuaciones,
+#                y es el agente quien responde: una llamada al LLM menos por pregunta.
+RAG_TOOL_MODES = ("answer", "context")
+RAG_TOOL_MODE = os.getenv("RAG_TOOL_MODE", "answer")
+if RAG_TOOL_MODE not in RAG_TOOL_MODES:
+    raise ValueError(f"RAG_TOOL_MODE desconocido: {RAG_TOOL_MODE}. Opciones: {', '.join(RAG_TOOL_MODES)}.")
 
-# La cadena (chain) específica para la lógica RAG.
-rag_chain = (
-    ChatPromptTemplate.from_template(
-        """Responde la pregunta basándote únicamente en el siguiente contexto:
+# La cadena (chain) específica para la lógica RAG (solo se usa en modo "answer").
+rag_prompt = ChatPromptTemplate.from_template(
+    """Responde la pregunta basándote únicamente en el siguiente contexto:
 
 Contexto:
 {context}
@@ -39,27 +49,130 @@ Pregunta: {question}
 
 Respuesta:
 """
-    )
-    | llm
-    | StrOutputParser()
 )
 
 
+def build_rag_chain(llm):
+    """
+    La cadena RAG de la herramienta con el modelo indicado.
+    """
+    return rag_prompt | llm | StrOutputParser()
+
+
+# Se crea en el primer uso (ver `get_rag_chain`): importar el módulo no necesita
+# API key, y en modo "context" nunca se llega a crear. Se puede sustituir, p. ej.
+# por una cadena con un LLM simulado en los benchmarks.
+rag_chain = None
+
+
+def get_rag_chain():
+    """
+    La cadena RAG de la herramienta, con el chat model compartido (ver llm_client.py).
+    """
+    global rag_chain
+    if rag_chain is None:
+        rag_chain = build_rag_chain(get_chat_model())
+    return rag_chain
+
+
+# Caché semántica de respuestas: una paráfrasis de una pregunta ya respondida,
+# con los mismos casos recuperados, reutiliza la respuesta sin llamar al LLM.
+answer_cache = SemanticAnswerCache()
+
+
 # --- 2. DEFINICIÓN DE HERRAMIENTAS ---
 
-@tool
-def patient_case_rag_tool(query: str) -> str:
+def format_retrieved_context(hits, packed):
+    """
+    Resultado de la herramienta en modo "context": la lista de casos incluidos,
+    con su mejor puntuación (o distancia), seguida del contexto empaquetado.
+
+    Args:
+        hits (list): Los SearchHit de la búsqueda.
+        packed (PackedContext): El contexto empaquetado a partir de `hits`.
+
+    Returns:
+        str: El texto que recibe el agente como resultado de la herramienta.
+    """
+    if not packed.case_ids:
+        return "No se encontraron casos relacionados con la pregunta."
+    best = {}
+    for hit in hits:
+        # Mejor resultado de cada caso (con pasajes, un caso puede aparecer varias veces).
+        value = hit.score if hit.score is not None else -hit.distance
+        if hit.case_id not in best or value > best[hit.case_id][0]:
+            best[hit.case_id] = (value, hit)
+    lines = ["Casos recuperados, en el orden del contexto (responde basándote únicamente en ellos):"]
+    for case_id in packed.case_ids:
+        hit = best[case_id][1]
+        if hit.score is not None:
+            lines.append(f"- Caso {case_id} (puntuación {hit.score:.3f})")
+        else:
+            lines.append(f"- Caso {case_id} (distancia {hit.distance:.3f})")
+    return "\n".join(lines) + "\n\nContexto:\n" + packed.text
+
+
+def _patient_case_rag(query: str) -> str:
     """
     Útil para responder preguntas sobre casos de pacientes, tratamientos,
     diagnósticos y temas psicológicos documentados. La entrada debe ser
     una pregunta completa sobre una condición o caso.
     """
     print("--- Ejecutando Herramienta RAG ---")
-    context = retriever.search(query)
-    response = rag_chain.invoke({"context": context, "question": query})
+    with span("tool.patient_case_rag", mode=RAG_TOOL_MODE) as tool_span:
+        retriever = get_retriever(INDEX_PATH, CASES_PATH, MODEL_NAME)
+        with span("retrieve"):
+            hits = retriever.search_batch([query])[0]
+        packed = retriever.pack_context(hits, max_tokens=CONTEXT_TOKENS)
+        if RAG_TOOL_MODE == "context":
+            return format_retrieved_context(hits, packed)
+        query_embedding = retriever.encode_queries([query])[0]
+        case_ids = packed.case_ids
+        cached = answer_cache.get(query_embedding, case_ids, retriever.build_id)
+        tool_span.set(cache_hit=cached is not None)
+        if cached is not None:
+            print("--- Respuesta tomada de la caché semántica ---")
+            return cached
+        with span("llm", prompt_tokens=count_tokens(packed.text) + count_tokens(query)) as s:
+            response = get_rag_chain().invoke({"context": packed.text, "question": query})
+            s.set(response_tokens=count_tokens(response))
+    answer_cache.put(query_embedding, case_ids, response, retriever.build_id)
     return response
 
 
+async def _apatient_case_rag(query: str) -> str:
+    # Versión asíncrona: búsqueda en el pool de hilos y LLM sin bloquear el event loop.
+    with span("tool.patient_case_rag", mode=RAG_TOOL_MODE) as tool_span:
+        loop = asyncio.get_running_loop()
+        retriever = await loop.run_in_executor(
+            get_executor(), partial(get_retriever, INDEX_PATH, CASES_PATH, MODEL_NAME)
+        )
+        with span("retrieve"):
+            hits = await get_async_retriever(retriever).search_hits(query)
+        packed = retriever.pack_context(hits, max_tokens=CONTEXT_TOKENS)
+        if RAG_TOOL_MODE == "context":
+            return format_retrieved_context(hits, packed)
+        query_embedding = (await loop.run_in_executor(get_executor(), retriever.encode_queries, [query]))[0]
+        case_ids = packed.case_ids
+        cached = answer_cache.get(query_embedding, case_ids, retriever.build_id)
+        tool_span.set(cache_hit=cached is not None)
+        if cached is not None:
+            return cached
+        with span("llm", prompt_tokens=count_tokens(packed.text) + count_tokens(query)) as s:
+            response = await get_rag_chain().ainvoke({"context": packed.text, "question": query})
+            s.set(response_tokens=count_tokens(response))
+    answer_cache.put(query_embedding, case_ids, response, retriever.build_id)
+    return response
+
+
+# La herramienta se puede usar tanto con `invoke` como con `ainvoke` (grafos asíncronos).
+patient_case_rag_tool = StructuredTool.from_function(
+    func=_patient_case_rag,
+    coroutine=_apatient_case_rag,
+    name="patient_case_rag_tool",
+)
+
+
 @tool
 def calculator_tool(expression: str) -> str:
     """
@@ -67,11 +180,10 @@ def calculator_tool(expression: str) -> str:
     La entrada debe ser una expresión matemática válida (p. ej., '5 * (3 + 1)').
     """
     print(f"--- Ejecutando Herramienta Calculadora con la expresión: {expression} ---")
-    try:
-        # Nota: eval() es potente pero puede ser inseguro en producción.
-        # Para este ejemplo controlado, es suficiente.
-        result = eval(expression)
-        return f"El resultado de '{expression}' es {result}."
-    except Exception as e:
-        return f"Error al evaluar la expresión: {e}"
+    with span("tool.calculator"):
+        try:
+            # Evaluador sobre el AST (ver calculator.py): solo aritmética, sin eval().
+            return format_result(expression, safe_eval(expression))
+        except Exception as e:
+            return f"Error al evaluar la expresión: {e}"
 
@@ -0,0 +1,66 @@
+from caching import LRUCache, normalize_query
+
+# Cross-encoder multilingüe (entrenado con mMARCO, incluye español) y pequeño
+# para que corra en CPU.
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+
+class CrossEncoderReranker:
+    """
+    Reordena los candidatos de una búsqueda con un cross-encoder, que lee la
+    pregunta y el caso juntos y es más preciso que la distancia entre embeddings.
+
+    Las puntuaciones (pregunta, caso) se guardan en una caché LRU, así que los
+    candidatos que se repiten entre preguntas iguales no se vuelven a puntuar.
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, batch_size=16, cache_size=4096, model=None):
+        if model is None:
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(model_name, device="cpu")
+        self.model = model
+        self.batch_size = batch_size
+        self.cache = LRUCache(max_size=cache_size)
+
+    def rerank_batch(self, queries, hits_per_query, top_k=5):
+        """
+        Puntúa los candidatos de varias preguntas en una sola pasada por lotes.
+
+        Args:
+            queries (list): Las preguntas.
+            hits_per_query (list): Por pregunta, sus candidatos (SearchHit).
+            top_k (int): Candidatos a conservar por pregunta.
+
+        Returns:
+            list: Por pregunta, los top_k SearchHit ordenados por la puntuación del
+                cross-encoder, que queda en `score`.
+        """
+        keys = [
+            [(normalize_query(query), hit.case_id, hit.passage_id) for hit in hits]
+            for query, hits in zip(queries, hits_per_query)
+        ]
+        scores = {}
+        pending = {}
+        for hits, hit_keys in zip(hits_per_query, keys):
+            for hit, key in zip(hits, hit_keys):
+                if key in scores or key in pending:
+                    continue
+                cached = self.cache.get(key)
+                if cached is None:
+                    # Se puntúa la pregunta normalizada, la misma que forma la clave de la caché.
+                    pending[key] = (key[0], hit.text)
+                else:
+                    scores[key] = cached
+
+        if pending:
+            predicted = self.model.predict(list(pending.values()), batch_size=self.batch_size)
+            for key, score in zip(pending, predicted):
+                scores[key] = float(score)
+                self.cache.put(key, float(score))
+
+        results = []
+        for hits, hit_keys in zip(hits_per_query, keys):
+            rescored = [hit._replace(score=scores[key]) for hit, key in zip(hits, hit_keys)]
+            rescored.sort(key=lambda hit: hit.score, reverse=True)
+            results.append(rescored[:top_k])
+        return results
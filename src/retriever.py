@@ -1,32 +1,435 @@
-import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
+import os
+from typing import NamedTuple, Optional
 import numpy as np
 
+from bm25 import BM25Index, reciprocal_rank_fusion
+from caching import QueryEmbeddingCache, normalize_query
+from case_metadata import find_initials
+from context_packer import pack_context, DEFAULT_CONTEXT_TOKENS
+from encoders import encoder_cache_name, load_encoder
+from case_store import open_case_store
+from index_files import artifact_path, read_build_id, CHUNK_MAP_SUFFIX, BM25_SUFFIX
+from tracing import span
+
+# EXACT_LOOKUP=1 activa por defecto la búsqueda directa por paciente (ver
+# `Retriever.lookup_patients`). Está desactivada porque cualquier pregunta con
+# iniciales ("O.M.S.") que coincidan con un paciente dejaría de ordenarse por similitud.
+EXACT_LOOKUP = os.getenv("EXACT_LOOKUP", "0") == "1"
+
+class SearchHit(NamedTuple):
+    """
+    Un resultado de búsqueda: el caso recuperado y su distancia al query.
+    En búsquedas por pasajes, `text` es el pasaje y `passage_id` su id.
+    `score` es el coseno en índices por coseno, la puntuación RRF en búsquedas
+    híbridas, o la del cross-encoder si se reordenó (siempre, mayor es mejor).
+    """
+    case_id: int
+    text: str
+    distance: float
+    passage_id: Optional[int] = None
+    score: Optional[float] = None
+
+
+def apply_cutoffs(hits, min_score=None, relative_gap=None, min_hits=1):
+    """
+    Recorta una lista de resultados (ordenada de mejor a peor) cuando la señal es clara.
+
+    Args:
+        hits (list): Los SearchHit, con `score`.
+        min_score (float): Se descartan los resultados con `score` menor.
+        relative_gap (float): Se corta en la primera caída entre resultados
+            consecutivos mayor que esta fracción del anterior (p. ej. 0.25: de
+            0.60 a 0.40 se corta, de 0.60 a 0.50 no).
+        min_hits (int): Resultados que se conservan siempre.
+
+    Returns:
+        list: Los primeros resultados que pasan los umbrales.
+    """
+    if min_score is None and relative_gap is None:
+        return hits
+    if any(hit.score is None for hit in hits):
+        raise ValueError("Los umbrales necesitan puntuaciones: usa un índice por coseno "
+                         "(--metric cosine), la búsqueda híbrida o el reordenamiento.")
+    kept = []
+    for hit in hits:
+        if len(kept) >= min_hits:
+            if min_score is not None and hit.score < min_score:
+                break
+            if relative_gap is not None and kept[-1].score - hit.score > relative_gap * abs(kept[-1].score):
+                break
+        kept.append(hit)
+    return kept
+
+
 class Retriever:
-    def __init__(self, index_path, cases_path, model_name):
+    def __init__(self, index_path, cases_path, model_name, batch_size=32,
+                 cache_size=1024, cache_path=None, candidates_per_case=4,
+                 nprobe=None, ef_search=None, model=None,
+                 hybrid=False, hybrid_candidates=50, rrf_k=60,
+                 rerank=False, reranker=None, rerank_candidates=20, backend=None,
+                 min_score=None, relative_gap=None, exact_lookup=EXACT_LOOKUP):
+        # faiss y sentence_transformers (torch) tardan en importarse: se importan
+        # aquí y no al importar el módulo. Ver retriever_registry.py.
+        import faiss
+        from index_factory import index_metric, set_search_params
+
         print("Cargando Retriever...")
         self.index = faiss.read_index(index_path)
-        with open(cases_path, "rb") as f:
-            self.patient_cases = pickle.load(f)
-        self.model = SentenceTransformer(model_name)
+        # "cosine" si el índice es de producto interno (ver index_factory.py).
+        self.metric = index_metric(self.index)
+        # Cambia con cada reconstrucción del índice (invalida la caché de respuestas).
+        self.build_id = read_build_id(index_path)
+        # Parámetros de búsqueda de los índices aproximados (IVF: nprobe, HNSW: efSearch).
+        set_search_params(self.index, nprobe=nprobe, ef_search=ef_search)
+        # Los textos se leen del almacén en disco solo para los resultados de cada búsqueda.
+        # `cases_path` puede ser el .db o el .pkl antiguo (que se migra la primera vez).
+        self.store = open_case_store(cases_path, index_path=index_path)
+        # Si el índice se construyó por pasajes, junto a él está el mapa pasaje -> caso.
+        # Los vectores del índice son entonces pasajes.
+        self.chunk_map = None
+        chunk_map_path = artifact_path(index_path, CHUNK_MAP_SUFFIX)
+        if os.path.exists(chunk_map_path):
+            self.chunk_map = np.load(chunk_map_path, mmap_mode='r')
+        # Pasajes que se piden a FAISS por cada caso final al colapsar a casos.
+        self.candidates_per_case = candidates_per_case
+        # Índice léxico BM25 para la búsqueda híbrida (se construye junto al índice FAISS).
+        self.bm25 = None
+        bm25_path = artifact_path(index_path, BM25_SUFFIX)
+        if os.path.exists(bm25_path):
+            self.bm25 = BM25Index.load(bm25_path)
+        self.hybrid = hybrid
+        self.hybrid_candidates = hybrid_candidates
+        self.rrf_k = rrf_k
+        # Reordenamiento con cross-encoder: se piden `rerank_candidates` candidatos y
+        # se conservan los top_k mejores. El reranker por defecto se carga al primer uso.
+        self.rerank = rerank
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        # Umbrales por defecto para devolver menos de top_k casos (ver `apply_cutoffs`).
+        self.min_score = min_score
+        self.relative_gap = relative_gap
+        # Con `exact_lookup`, si una pregunta nombra a un paciente conocido ("M.G.P."),
+        # se devuelven sus casos directamente, sin pasar por el encoder (ver `lookup_patients`).
+        self.exact_lookup = exact_lookup
+        # Backend del encoder: "torch", "onnx" u "onnx-int8" (ver encoders.py).
+        if model is None:
+            model = load_encoder(model_name, backend)
+        # El encoder puede venir ya cargado (compartido entre Retrievers del mismo modelo).
+        self.model = model
+        self.batch_size = batch_size
+        # Caché de embeddings de preguntas (cache_size=0 la desactiva). Cada backend
+        # tiene la suya: sus embeddings no son idénticos.
+        self.query_cache = QueryEmbeddingCache(encoder_cache_name(model_name, backend),
+                                               max_size=cache_size, path=cache_path)
         print("Retriever listo.")
 
-    def search(self, query, top_k=5):
-        query_embedding = self.model.encode(query)
-        query_embedding_2d = np.array([query_embedding]).astype('float32')
-        distances, indices = self.index.search(query_embedding_2d, top_k)
-        results = []
-        for idx in indices[0]:
-            if idx != -1:
-                results.append(self.patient_cases[idx])
-        return results
+    def encode_queries(self, queries, batch_size=None):
+        """
+        Codifica una lista de preguntas con una sola llamada vectorizada al modelo.
+        Las preguntas ya vistas se toman de la caché y solo se codifican las nuevas.
+
+        Args:
+            queries (list): Las preguntas a codificar.
+            batch_size (int): Tamaño de lote del encoder. Por defecto, el del Retriever.
+
+        Returns:
+            np.ndarray: Matriz float32 de shape [len(queries), dim].
+        """
+        # Se codifica el mismo texto normalizado que sirve de clave en la caché: así
+        # dos preguntas que solo difieren en mayúsculas o espacios tienen el mismo embedding.
+        queries = [normalize_query(query) for query in queries]
+        embeddings = [self.query_cache.get_embedding(query) for query in queries]
+        missing = list(dict.fromkeys(q for q, emb in zip(queries, embeddings) if emb is None))
+        if missing:
+            with span("encode", queries=len(missing), cached=len(queries) - len(missing)):
+                new_embeddings = self.model.encode(
+                    missing,
+                    batch_size=batch_size or self.batch_size,
+                    convert_to_numpy=True
+                )
+            new_embeddings = np.asarray(new_embeddings, dtype='float32')
+            encoded = dict(zip(missing, new_embeddings))
+            for query, embedding in encoded.items():
+                self.query_cache.put_embedding(query, embedding)
+            embeddings = [encoded[q] if emb is None else emb for q, emb in zip(queries, embeddings)]
+        return np.stack(embeddings).astype('float32')
+
+    def tune_search(self, nprobe=None, ef_search=None):
+        """
+        Cambia en caliente nprobe (IVF) o efSearch (HNSW) del índice cargado.
+        """
+        from index_factory import set_search_params
+        set_search_params(self.index, nprobe=nprobe, ef_search=ef_search)
+
+    @property
+    def tokenizer(self):
+        """
+        El tokenizador del encoder (None si el modelo no expone uno).
+        """
+        return getattr(self.model, "tokenizer", None)
+
+    def search(self, query, top_k=5, passages=False, hybrid=None, rerank=None, scored=False, **kwargs):
+        """
+        Busca una pregunta. Devuelve los textos, o los SearchHit (con distancia y
+        puntuación) si `scored=True`. `kwargs`: umbrales de `search_batch`.
+        """
+        hits = self.search_batch([query], top_k=top_k, passages=passages, hybrid=hybrid, rerank=rerank,
+                                 **kwargs)[0]
+        return hits if scored else [hit.text for hit in hits]
+
+    def pack_context(self, hits, max_tokens=DEFAULT_CONTEXT_TOKENS):
+        """
+        Reúne los resultados en un contexto de como máximo `max_tokens` tokens del
+        encoder (ver context_packer.py).
+
+        Returns:
+            PackedContext: El contexto y los casos incluidos.
+        """
+        with span("pack_context") as s:
+            packed = pack_context(hits, tokenizer=self.tokenizer, max_tokens=max_tokens)
+            s.set(cases=len(packed.case_ids), context_tokens=packed.tokens)
+        return packed
+
+    def get_context(self, query, top_k=5, max_tokens=DEFAULT_CONTEXT_TOKENS, **kwargs):
+        """
+        Busca la pregunta y devuelve el contexto ya formateado para el prompt.
+
+        Args:
+            query (str): La pregunta.
+            top_k (int): Número de casos a recuperar.
+            max_tokens (int): Presupuesto de tokens del contexto.
+            **kwargs: Opciones de `search_batch` (passages, hybrid, rerank).
+
+        Returns:
+            str: El contexto.
+        """
+        hits = self.search_batch([query], top_k=top_k, **kwargs)[0]
+        return self.pack_context(hits, max_tokens=max_tokens).text
+
+    def lookup_patients(self, query):
+        """
+        Casos de los pacientes cuyas iniciales aparecen en la pregunta
+        ("¿Cuál es el motivo de consulta de M.G.P.?"), buscados en la tabla de metadatos.
+
+        Returns:
+            list: Ids de los casos (vacía si la pregunta no nombra a ningún paciente conocido).
+        """
+        if not self.store.has_metadata:
+            return []
+        case_ids = []
+        for initials in find_initials(query):
+            case_ids.extend(self.store.find_cases(initials=initials))
+        return list(dict.fromkeys(case_ids))
+
+    def search_batch(self, queries, top_k=5, batch_size=None, passages=False, hybrid=None, rerank=None,
+                     min_score=None, relative_gap=None, filters=None, exact_lookup=None):
+        """
+        Busca los casos más cercanos para varias preguntas a la vez.
+
+        Todas las preguntas se codifican en una sola llamada al encoder y se
+        buscan con una única llamada a FAISS sobre la matriz completa.
+
+        En modo híbrido, los candidatos densos se fusionan con los del índice
+        léxico BM25 mediante Reciprocal Rank Fusion (ver bm25.py). Con `rerank`,
+        se recuperan `rerank_candidates` candidatos y un cross-encoder elige los
+        top_k mejores (ver reranker.py).
+
+        Con un índice por pasajes, los pasajes encontrados se colapsan a sus casos
+        (cada caso aparece una vez, con la distancia de su mejor pasaje), o bien se
+        devuelven los propios pasajes si `passages=True`.
+
+        Con un índice por coseno, `score` es el coseno y `distance` es 1 - coseno.
+        Con `min_score` o `relative_gap` se devuelven menos de top_k resultados
+        cuando los siguientes son claramente peores (ver `apply_cutoffs`).
+
+        Con `filters` (p. ej. {"min_age": 18, "max_age": 30} o {"initials": "M.G.P."})
+        solo se buscan los casos que los cumplen. Con `exact_lookup`, las preguntas
+        que nombran a un paciente conocido devuelven sus casos sin codificarse
+        (`distance` 0, `score` 1); con `passages=True`, en cambio, se buscan por
+        similitud solo los pasajes de esos casos.
+
+        Args:
+            queries (list): Las preguntas a buscar.
+            top_k (int): Número de casos (o pasajes) a recuperar por pregunta.
+            batch_size (int): Tamaño de lote del encoder.
+            passages (bool): Devolver pasajes en lugar de casos completos.
+            hybrid (bool): Búsqueda híbrida densa + BM25. Por defecto, la del Retriever.
+            rerank (bool): Reordenar con el cross-encoder. Por defecto, lo del Retriever.
+            min_score (float): Puntuación mínima. Por defecto, la del Retriever.
+            relative_gap (float): Caída relativa máxima entre resultados consecutivos.
+                Por defecto, la del Retriever.
+            filters (dict): Filtros de metadatos: initials, min_age, max_age.
+            exact_lookup (bool): Búsqueda directa por paciente (por defecto, la del
+                Retriever: EXACT_LOOKUP).
+
+        Returns:
+            list: Una lista por pregunta con sus SearchHit, ordenados por relevancia.
+        """
+        allowed_cases = allowed_ids = None
+        if filters:
+            # Los vectores permitidos son los de los casos que cumplen los filtros
+            # (o los de sus pasajes, si el índice es por pasajes).
+            with span("metadata_filter") as s:
+                allowed_cases = self.store.find_cases(**filters)
+                allowed_ids = (allowed_cases if self.chunk_map is None
+                               else self.store.passage_ids_for_cases(allowed_cases))
+                s.set(allowed=len(allowed_ids))
+
+        exact_lookup = self.exact_lookup if exact_lookup is None else exact_lookup
+        found = {}
+        if exact_lookup:
+            with span("exact_lookup") as s:
+                allowed = set(allowed_cases) if allowed_cases is not None else None
+                for i, query in enumerate(queries):
+                    case_ids = [case_id for case_id in self.lookup_patients(query)
+                                if allowed is None or case_id in allowed]
+                    if case_ids:
+                        found[i] = case_ids
+                s.set(hits=len(found))
+
+        if passages and self.chunk_map is not None:
+            # En modo pasajes no se devuelven casos completos: se buscan por similitud
+            # los pasajes de los casos del paciente.
+            for i, case_ids in found.items():
+                found[i] = self._search_batch([queries[i]], top_k, batch_size, passages, hybrid, rerank,
+                                              self.store.passage_ids_for_cases(case_ids))[0]
+        elif found:
+            found = {i: case_ids[:top_k] for i, case_ids in found.items()}
+            texts = self.store.get_cases(case_id for case_ids in found.values() for case_id in case_ids)
+            found = {i: [SearchHit(case_id, texts[case_id], 0.0, None, 1.0) for case_id in case_ids]
+                     for i, case_ids in found.items()}
+        pending = [query for i, query in enumerate(queries) if i not in found]
+        searched = iter(self._search_batch(pending, top_k, batch_size, passages, hybrid, rerank, allowed_ids))
+        results = [found[i] if i in found else next(searched) for i in range(len(queries))]
+        min_score = self.min_score if min_score is None else min_score
+        relative_gap = self.relative_gap if relative_gap is None else relative_gap
+        if min_score is None and relative_gap is None:
+            return results
+        with span("cutoffs") as s:
+            cut = [apply_cutoffs(hits, min_score, relative_gap) for hits in results]
+            s.set(dropped=sum(len(hits) for hits in results) - sum(len(hits) for hits in cut))
+        return cut
+
+    def _search_batch(self, queries, top_k, batch_size, passages, hybrid, rerank, allowed_ids=None):
+        if len(queries) == 0:
+            return []
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            return [[] for _ in queries]
+        rerank = self.rerank if rerank is None else rerank
+        if rerank:
+            candidates = self._search_batch(queries, top_k=max(top_k, self.rerank_candidates),
+                                            batch_size=batch_size, passages=passages,
+                                            hybrid=hybrid, rerank=False, allowed_ids=allowed_ids)
+            with span("rerank", queries=len(queries)):
+                return self._get_reranker().rerank_batch(queries, candidates, top_k=top_k)
+        hybrid = self.hybrid if hybrid is None else hybrid
+        if hybrid and self.bm25 is None:
+            raise ValueError("No hay índice BM25 junto al índice FAISS: reconstruye el índice.")
+        collapse = self.chunk_map is not None and not passages
+
+        num_candidates = top_k * self.candidates_per_case if collapse else top_k
+        if hybrid:
+            num_candidates = max(num_candidates, self.hybrid_candidates)
+        query_embeddings = self.encode_queries(queries, batch_size=batch_size)
+        if self.metric == "cosine":
+            query_embeddings = query_embeddings / np.maximum(
+                np.linalg.norm(query_embeddings, axis=1, keepdims=True), 1e-12
+            )
+        with span("faiss_search", queries=len(queries), k=num_candidates, filtered=allowed_ids is not None):
+            if allowed_ids is None:
+                distances, indices = self.index.search(query_embeddings, num_candidates)
+            else:
+                from index_factory import filtered_search
+                distances, indices = filtered_search(self.index, query_embeddings, num_candidates,
+                                                     allowed_ids, metric=self.metric)
+
+        rows = []
+        for query, row_distances, row_indices in zip(queries, distances, indices):
+            # Candidatos como (id del vector, distancia, puntuación), de mejor a peor.
+            if self.metric == "cosine":
+                # FAISS devuelve el producto interno (el coseno, con vectores normalizados).
+                candidates = [(int(idx), 1.0 - float(sim), float(sim))
+                              for sim, idx in zip(row_distances, row_indices) if idx != -1]
+            else:
+                candidates = [(int(idx), float(distance), None)
+                              for distance, idx in zip(row_distances, row_indices) if idx != -1]
+            if hybrid:
+                candidates = self._fuse(query, candidates, num_candidates, allowed_ids)
+            rows.append(self._collapse(candidates, top_k, collapse))
+        with span("fetch_texts"):
+            return self._attach_texts(rows, passages=passages and self.chunk_map is not None)
+
+    def _get_reranker(self):
+        if self.reranker is None:
+            from reranker import CrossEncoderReranker
+            self.reranker = CrossEncoderReranker()
+        return self.reranker
+
+    def _fuse(self, query, dense_candidates, num_candidates, allowed_ids=None):
+        """
+        Fusiona los candidatos densos con los de BM25 (Reciprocal Rank Fusion).
+        Los candidatos que solo encontró BM25 no tienen distancia (inf).
+        Con `allowed_ids`, se descartan los candidatos de BM25 que no cumplen los filtros.
+        """
+        sparse_ids = [doc_id for doc_id, _ in self.bm25.search(query, top_k=num_candidates)]
+        if allowed_ids is not None:
+            allowed = set(allowed_ids)
+            sparse_ids = [doc_id for doc_id in sparse_ids if doc_id in allowed]
+        dense_distances = {vector_id: distance for vector_id, distance, _ in dense_candidates}
+        fused = reciprocal_rank_fusion(
+            [[vector_id for vector_id, _, _ in dense_candidates], sparse_ids], k=self.rrf_k
+        )
+        return [(vector_id, dense_distances.get(vector_id, float("inf")), score)
+                for vector_id, score in fused]
+
+    def _collapse(self, candidates, top_k, collapse):
+        """
+        Convierte candidatos (id del vector, distancia, puntuación) en filas
+        (id del caso, distancia, puntuación, id del pasaje) y se queda con las top_k.
+        Si `collapse`, cada caso aparece una sola vez (con su mejor pasaje).
+        """
+        rows = []
+        seen_cases = set()
+        for vector_id, distance, score in candidates:
+            if self.chunk_map is None:
+                rows.append((vector_id, distance, score, None))
+            else:
+                case_id = int(self.chunk_map[vector_id])
+                if collapse:
+                    if case_id in seen_cases:
+                        continue
+                    seen_cases.add(case_id)
+                rows.append((case_id, distance, score, vector_id))
+            if len(rows) == top_k:
+                break
+        return rows
+
+    def _attach_texts(self, rows, passages=False):
+        """
+        Lee del almacén, en una sola consulta, los textos de todos los resultados.
+
+        Args:
+            rows (list): Por pregunta, tuplas (id del caso, distancia, puntuación, id del pasaje).
+            passages (bool): Leer el texto de los pasajes en lugar del de los casos.
+
+        Returns:
+            list: Por pregunta, la lista de SearchHit.
+        """
+        if passages:
+            texts = self.store.get_passages(p_id for row in rows for _, _, _, p_id in row)
+            return [[SearchHit(case_id, texts[p_id], distance, p_id, score)
+                     for case_id, distance, score, p_id in row]
+                    for row in rows]
+        texts = self.store.get_cases(case_id for row in rows for case_id, _, _, _ in row)
+        return [[SearchHit(case_id, texts[case_id], distance, p_id, score)
+                 for case_id, distance, score, p_id in row]
+                for row in rows]
 
 if __name__ == "__main__":
     query = "paciente con ansiedad por no encontrar trabajo"
     retriever = Retriever(
         index_path="../models/patient_cases.index",
-        cases_path="../models/patient_cases.pkl",
+        cases_path="../models/patient_cases.db",
         model_name="all-mpnet-base-v2"
     )
     results = retriever.search(query)
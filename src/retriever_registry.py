@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+from encoders import ENCODER_BACKEND, load_encoder
+from retriever import Retriever
+
+# Registro de procesos: un solo encoder por modelo y un solo Retriever por
+# (índice, modelo), creados la primera vez que se piden. Así importar un módulo
+# no carga nada pesado, y varios puntos de entrada en el mismo proceso
+# comparten el índice FAISS y el modelo de embeddings.
+_encoders = {}
+_retrievers = {}
+_lock = threading.RLock()
+
+
+def get_encoder(model_name, backend=None):
+    """
+    Devuelve el encoder de `model_name` con el backend indicado (por defecto,
+    ENCODER_BACKEND; ver encoders.py), cargándolo solo la primera vez.
+    """
+    key = (model_name, backend or ENCODER_BACKEND)
+    with _lock:
+        if key not in _encoders:
+            _encoders[key] = load_encoder(*key)
+        return _encoders[key]
+
+
+def get_retriever(index_path, cases_path, model_name, **kwargs):
+    """
+    Devuelve el Retriever compartido para (índice, modelo, backend), creándolo en el primer uso.
+
+    Args:
+        index_path (str): Ruta del índice FAISS.
+        cases_path (str): Ruta del almacén de casos.
+        model_name (str): Nombre del modelo de embeddings.
+        **kwargs: Argumentos extra del Retriever. Solo se usan al crearlo: las
+            llamadas siguientes con la misma clave devuelven la misma instancia.
+
+    Returns:
+        Retriever: La instancia compartida.
+    """
+    backend = kwargs.pop("backend", None) or ENCODER_BACKEND
+    key = (os.path.abspath(index_path), model_name, backend)
+    with _lock:
+        if key not in _retrievers:
+            _retrievers[key] = Retriever(
+                index_path=index_path,
+                cases_path=cases_path,
+                model_name=model_name,
+                model=get_encoder(model_name, backend),
+                backend=backend,
+                **kwargs
+            )
+        return _retrievers[key]
+
+
+def warm_up(index_path, cases_path, model_name, in_background=False, **kwargs):
+    """
+    Carga el Retriever y hace una búsqueda de prueba para que la primera pregunta
+    real no pague la inicialización del modelo.
+
+    Args:
+        in_background (bool): Hacerlo en un hilo, mientras el usuario escribe.
+
+    Returns:
+        threading.Thread | float: El hilo lanzado, o los segundos que tardó.
+    """
+    def _run():
+        start = time.perf_counter()
+        get_retriever(index_path, cases_path, model_name, **kwargs).search_batch(["calentamiento"], top_k=1)
+        return time.perf_counter() - start
+
+    if in_background:
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        return thread
+    return _run()
+
+
+def clear():
+    """
+    Olvida los Retrievers y encoders cargados (p. ej. tras reconstruir el índice).
+    """
+    with _lock:
+        _retrievers.clear()
+        _encoders.clear()
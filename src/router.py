@@ -0,0 +1,230 @@
+import os
+import re
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from calculator import safe_eval
+from case_metadata import find_initials
+
+# Enrutador local previo al agente de langgraph_agent_main.py: decide sin llamar
+# al LLM los turnos que claramente son aritmética (se calculan directamente) o
+# preguntas sobre casos de pacientes (se llama directamente a la herramienta RAG).
+# Los demás turnos van al agente como antes. Primero se aplican reglas y después
+# un clasificador por similitud de embeddings con el encoder del Retriever.
+
+# ROUTER=0 desactiva el enrutador (todos los turnos pasan por el agente).
+ROUTER_ENABLED = os.getenv("ROUTER", "1") != "0"
+
+CALCULATOR_TOOL = "calculator_tool"
+RAG_TOOL = "patient_case_rag_tool"
+# Llamadas al LLM que se ahorran con cada ruta: la elección de herramienta y, en
+# la calculadora, también la respuesta final (el resultado ya es la respuesta).
+SKIPPED_LLM_CALLS = {CALCULATOR_TOOL: 2, RAG_TOOL: 1}
+
+# "¿Cuánto es 3 * (4 + 1)?", "calcula 2^10", "15 / 4 ="
+_ARITHMETIC_PREFIX = re.compile(
+    r"^\s*¿?\s*(?P<keyword>cu[aá]nto\s+(?:es|son|da)|calcula(?:r)?|resuelve|eval[uú]a)?\s*:?\s*", re.IGNORECASE
+)
+# Números unidos solo por "-" o "/" sin espacios: fechas ("2024-10-18", "18/10/2024"),
+# teléfonos o códigos. Solo se tratan como cuentas si el turno lo pide ("calcula", "=").
+_AMBIGUOUS = re.compile(r"^\d+(?:[-/]\d+)+$")
+_EXPRESSION = re.compile(r"^[\d\s.+\-*/%^()×÷xX]+$")
+_OPERATOR = re.compile(r"[+\-*/%^×÷]|\d\s*[xX]\s*\d")
+
+# Ejemplos de cada clase para el clasificador por embeddings.
+RAG_EXAMPLES = (
+    "¿Qué tratamiento se aplicó a un paciente con depresión?",
+    "Casos de pacientes con ansiedad ante los exámenes",
+    "¿Qué síntomas presentaba la paciente con trastorno obsesivo compulsivo?",
+    "¿Cuál fue el diagnóstico del paciente que no podía dormir?",
+    "¿Cómo evolucionó el caso de la estudiante con ataques de pánico?",
+    "Antecedentes familiares de los pacientes con consumo de sustancias",
+    "¿Qué técnicas de terapia cognitivo conductual se usaron en los casos?",
+    "Motivo de consulta de los pacientes adolescentes",
+)
+OTHER_EXAMPLES = (
+    "Hola, ¿cómo estás?",
+    "Gracias por la ayuda",
+    "¿Quién eres y qué puedes hacer?",
+    "Adiós, hasta luego",
+    "¿Puedes repetir lo que dijiste antes?",
+    "Resume lo que hemos hablado",
+    "Explícamelo con otras palabras",
+    "¿Qué hora es?",
+)
+
+
+class Route(NamedTuple):
+    """
+    Decisión del enrutador: qué herramienta llamar y con qué argumentos. En la
+    ruta de la calculadora, `result` lleva el resultado ya calculado.
+    """
+    tool: str
+    args: dict
+    reason: str
+    confidence: float
+    result: object = None
+
+
+def arithmetic_expression(text):
+    """
+    La expresión aritmética del turno ("¿Cuánto es 3 * 4?" -> "3 * 4"), o None si
+    el texto no es solo una cuenta. Lo que puede ser una fecha ("2024-10-18") solo
+    cuenta si el turno pide el cálculo ("calcula 2024-10-18", "2024-10-18 =").
+    """
+    prefix = _ARITHMETIC_PREFIX.match(text)
+    expression = text[prefix.end():].strip().rstrip("?").strip()
+    explicit = prefix.group("keyword") is not None or expression.endswith("=")
+    expression = expression.rstrip("=").strip()
+    if not expression or not _EXPRESSION.match(expression) or not _OPERATOR.search(expression):
+        return None
+    if not re.search(r"\d", expression):
+        return None
+    if not explicit and _AMBIGUOUS.match(expression):
+        return None
+    return expression
+
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype='float32')
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=-1, keepdims=True), 1e-12)
+
+
+class Router:
+    """
+    Enruta los turnos claros sin pasar por el LLM y lleva la cuenta de los aciertos
+    y de la latencia ahorrada.
+
+    La latencia ahorrada se estima con la media de las llamadas del agente en las
+    que eligió una herramienta (`observe_tool_selection`), multiplicada por las
+    llamadas que se evita cada ruta.
+    """
+
+    def __init__(self, encode_fn=None, rag_threshold=0.5, margin=0.1, min_words=4, enabled=ROUTER_ENABLED):
+        """
+        Args:
+            encode_fn (callable): Codifica una lista de textos (p. ej.
+                `Retriever.encode_queries`). Sin él, solo se aplican las reglas.
+            rag_threshold (float): Similitud coseno mínima con los ejemplos de
+                preguntas sobre casos para llamar directamente a la herramienta RAG.
+            margin (float): Ventaja mínima sobre los ejemplos de otras conversaciones.
+            min_words (int): Los textos más cortos (a menudo continuaciones como
+                "¿y después?") no se clasifican por embeddings.
+            enabled (bool): Si es False, `route` siempre devuelve None.
+        """
+        self.encode_fn = encode_fn
+        self.rag_threshold = rag_threshold
+        self.margin = margin
+        self.min_words = min_words
+        self.enabled = enabled
+        self._examples = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.turns = 0
+        self.routed = {}
+        self.router_seconds = 0.0
+        self.skipped_llm_calls = 0
+        self.saved_seconds = 0.0
+        self.tool_selection_seconds = 0.0
+        self.tool_selections = 0
+
+    def _example_embeddings(self):
+        if self._examples is None:
+            embeddings = _normalize(self.encode_fn(list(RAG_EXAMPLES) + list(OTHER_EXAMPLES)))
+            self._examples = (embeddings[:len(RAG_EXAMPLES)], embeddings[len(RAG_EXAMPLES):])
+        return self._examples
+
+    def classify(self, text):
+        """
+        Returns:
+            Route: La ruta del turno, o None si no es un caso claro (lo decide el agente).
+        """
+        expression = arithmetic_expression(text)
+        if expression is not None:
+            try:
+                result = safe_eval(expression)
+            except (ValueError, ArithmeticError):
+                # Si no se puede calcular, que lo resuelva el agente.
+                return None
+            return Route(CALCULATOR_TOOL, {"expression": expression}, "regla: aritmética", 1.0, result)
+        if find_initials(text):
+            return Route(RAG_TOOL, {"query": text}, "regla: paciente", 1.0)
+        if self.encode_fn is None or len(text.split()) < self.min_words:
+            return None
+        rag_examples, other_examples = self._example_embeddings()
+        query = _normalize(self.encode_fn([text]))[0]
+        rag_similarity = float(np.max(rag_examples @ query))
+        other_similarity = float(np.max(other_examples @ query))
+        if rag_similarity >= self.rag_threshold and rag_similarity - other_similarity >= self.margin:
+            return Route(RAG_TOOL, {"query": text}, "embeddings", rag_similarity)
+        return None
+
+    def route(self, text):
+        """
+        Clasifica el turno y actualiza las estadísticas.
+
+        Returns:
+            Route: La ruta, o None si el turno debe ir al agente.
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        route = self.classify(text)
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.turns += 1
+            self.router_seconds += seconds
+            if route is not None:
+                self.routed[route.reason] = self.routed.get(route.reason, 0) + 1
+                skipped = SKIPPED_LLM_CALLS[route.tool]
+                self.skipped_llm_calls += skipped
+                if self.tool_selections:
+                    self.saved_seconds += skipped * self.tool_selection_seconds / self.tool_selections
+        return route
+
+    def observe_tool_selection(self, seconds):
+        """
+        Registra la latencia de una llamada del agente que terminó eligiendo una herramienta.
+        """
+        with self._lock:
+            self.tool_selection_seconds += seconds
+            self.tool_selections += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Turnos, turnos enrutados (y por motivo), tasa de aciertos, llamadas
+                al LLM evitadas, segundos ahorrados (estimados) y coste medio del enrutador.
+        """
+        with self._lock:
+            routed = sum(self.routed.values())
+            return {
+                "turns": self.turns,
+                "routed": routed,
+                "by_reason": dict(self.routed),
+                "hit_rate": routed / self.turns if self.turns else 0.0,
+                "skipped_llm_calls": self.skipped_llm_calls,
+                "saved_seconds": self.saved_seconds,
+                "router_ms": 1000 * self.router_seconds / self.turns if self.turns else 0.0,
+            }
+
+
+def print_router_report(stats):
+    print(f"[Enrutador: {stats['routed']}/{stats['turns']} turnos sin pasar por el agente "
+          f"({stats['hit_rate']:.0%}) | {stats['skipped_llm_calls']} llamadas al LLM evitadas | "
+          f"~{stats['saved_seconds']:.1f} s ahorrados | {stats['router_ms']:.2f} ms por turno]")
+
+
+if __name__ == "__main__":
+    router = Router()
+    for text in ["¿Cuánto es 5 * (3 + 1)?", "2^10", "¿Cuál es el motivo de consulta de M.G.P.?",
+                 "Hola, ¿qué tal?", "calcula __import__('os')",
+                 "999999.0^100", "999999^100/7", "(-8)^0.5", "2024-10-18", "calcula 2024-10-18",
+                 "15 / 4 ="]:
+        print(f"{text!r} -> {router.route(text)}")
+    print_router_report(router.stats())
@@ -0,0 +1,91 @@
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+def print_token(text):
+    print(text, end="", flush=True)
+
+
+def chunk_text(chunk):
+    """
+    Texto de un fragmento de mensaje. Gemini puede devolver el contenido como una
+    lista de partes en lugar de un string.
+    """
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def consume_stream(chunks, on_token=print_token, start=None):
+    """
+    Consume un stream de fragmentos de texto, entregando cada uno a `on_token`,
+    y mide el tiempo hasta el primer token y la latencia total.
+
+    Args:
+        chunks (iterable): Los fragmentos de texto, en orden.
+        on_token (callable): Se llama con cada fragmento (por defecto, lo imprime).
+        start (float): `time.perf_counter()` del inicio de la petición. Por defecto, ahora.
+
+    Returns:
+        dict: El texto completo ("answer"), "time_to_first_token" y "total_latency" en segundos.
+    """
+    if start is None:
+        start = time.perf_counter()
+    parts = []
+    time_to_first_token = None
+    for text in chunks:
+        if not text:
+            continue
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - start
+        parts.append(text)
+        if on_token is not None:
+            on_token(text)
+    total_latency = time.perf_counter() - start
+    return {
+        "answer": "".join(parts),
+        "time_to_first_token": total_latency if time_to_first_token is None else time_to_first_token,
+        "total_latency": total_latency,
+    }
+
+
+def stream_graph_answer(app, inputs, config, nodes, on_token=print_token, message_nodes=()):
+    """
+    Ejecuta un grafo de LangGraph en modo "messages" y entrega los tokens del LLM
+    a medida que se generan.
+
+    Solo se muestran los tokens de los nodos indicados (p. ej. el que genera la
+    respuesta final), no los de LLMs usados dentro de herramientas.
+
+    Args:
+        app: El grafo compilado.
+        inputs (dict): La entrada del grafo.
+        config (dict): La configuración (thread_id, ...).
+        nodes (tuple): Nombres de los nodos cuyos tokens se muestran.
+        on_token (callable): Se llama con cada fragmento de texto.
+        message_nodes (tuple): Nodos que responden con un mensaje completo, sin
+            LLM (p. ej. el enrutador local); su respuesta se entrega de una vez.
+
+    Returns:
+        dict: Igual que `consume_stream`.
+    """
+    start = time.perf_counter()
+
+    def texts():
+        for chunk, metadata in app.stream(inputs, config=config, stream_mode="messages"):
+            # Los mensajes completos que devuelven los nodos también se emiten en este
+            # modo; solo nos interesan los fragmentos que produce el LLM en streaming.
+            if isinstance(chunk, AIMessageChunk) and metadata.get("langgraph_node") in nodes:
+                yield chunk_text(chunk)
+            elif (isinstance(chunk, AIMessage) and not isinstance(chunk, AIMessageChunk)
+                  and not chunk.tool_calls and metadata.get("langgraph_node") in message_nodes):
+                yield chunk_text(chunk)
+
+    return consume_stream(texts(), on_token=on_token, start=start)
+
+
+def print_latency_report(result):
+    print(f"\n[Tiempo hasta el primer token: {result['time_to_first_token']:.2f} s | "
+          f"Latencia total: {result['total_latency']:.2f} s]")
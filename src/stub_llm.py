@@ -0,0 +1,135 @@
+import asyncio
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+# LLM simulado para pruebas de carga y benchmarks: responde siempre lo mismo
+# tras una latencia fija, sin red ni API key.
+STUB_ANSWER = "Respuesta simulada: según el contexto proporcionado, la información solicitada se encuentra en los casos recuperados."
+
+
+def word_chunks(text):
+    """
+    Divide la respuesta en fragmentos de una palabra, como llegarían en streaming.
+    """
+    words = text.split(" ")
+    return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+
+class StubLLM:
+    """
+    Sustituto local de Gemini con la misma interfaz que llm_generator.py:
+    `generate` (como generate_test_answer), `stream` (como generate_answer_stream)
+    y `agenerate` (como agenerate_test_answer).
+    """
+
+    def __init__(self, latency=0.2, answer=STUB_ANSWER):
+        self.latency = latency
+        self.answer = answer
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.answer
+
+    def stream(self, prompt):
+        self.calls += 1
+        chunks = word_chunks(self.answer)
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield chunk
+
+    async def agenerate(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.answer
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Chat model de LangChain simulado, para ejecutar los grafos sin Gemini.
+    Soporta invoke/ainvoke y streaming (un fragmento por palabra).
+    Guarda en `prompt_tokens` el tamaño (en palabras) de cada prompt recibido.
+    """
+
+    latency: float = 0.2
+    answer: str = STUB_ANSWER
+    calls: int = 0
+    prompt_tokens: List[int] = Field(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _record(self, messages):
+        self.calls += 1
+        self.prompt_tokens.append(sum(len(str(msg.content).split()) for msg in messages))
+
+    def _result(self, messages):
+        self._record(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._record(messages)
+        chunks = word_chunks(self.answer)
+        for text in chunks:
+            time.sleep(self.latency / len(chunks))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._record(messages)
+        chunks = word_chunks(self.answer)
+        for text in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+
+class StubToolCallingModel(StubChatModel):
+    """
+    Agente simulado para el grafo de langgraph_agent_main.py: ante una cuenta
+    pide `calculator_tool` y ante cualquier otro mensaje del usuario, la
+    herramienta `tool_name` con el mensaje como `query`; en cuanto recibe el
+    resultado de la herramienta, responde.
+    """
+
+    tool_name: str = "patient_case_rag_tool"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _result(self, messages):
+        self._record(messages)
+        last = messages[-1]
+        if last.type == "human":
+            from router import arithmetic_expression
+
+            expression = arithmetic_expression(str(last.content))
+            if expression is not None:
+                tool_call = {"name": "calculator_tool", "args": {"expression": expression}}
+            else:
+                tool_call = {"name": self.tool_name, "args": {"query": str(last.content)}}
+            message = AIMessage(content="", tool_calls=[dict(tool_call, id=f"llamada-{self.calls}")])
+        else:
+            message = AIMessage(content=self.answer)
+        return ChatResult(generations=[ChatGeneration(message=message)])
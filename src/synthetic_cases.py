@@ -0,0 +1,134 @@
+import argparse
+import random
+
+# Generador de casos clínicos sintéticos en español, con el mismo formato que
+# Casos.docx ("Nombre / Edad / Motivo de consulta"), para medir cómo escala el
+# sistema con miles o millones de casos.
+
+LETRAS = "ABCDEFGHIJLMNOPRSTVY"
+
+# Preguntas de ejemplo sobre los casos, para benchmarks y pruebas de carga.
+SAMPLE_QUERIES = [
+    "paciente con ansiedad por no encontrar trabajo",
+    "¿Cuál es el motivo de consulta de la paciente M.G.P.?",
+    "casos de depresión en estudiantes universitarios",
+    "paciente con problemas de pareja y baja autoestima",
+    "tratamiento con Terapia de Aceptación y Compromiso",
+    "paciente adolescente con conflictos familiares",
+    "dificultades para dormir y pensamientos repetitivos",
+    "paciente que siente que está estancada en la universidad",
+]
+
+MOTIVOS = [
+    "No tengo ganas de hacer nada en la universidad, siento que estoy estancada.",
+    "Últimamente no puedo dormir y me despierto varias veces en la noche.",
+    "Siento mucha ansiedad antes de cada entrevista de trabajo.",
+    "Discuto todo el tiempo con mi pareja y ya no sé qué hacer.",
+    "Desde que perdí mi empleo me siento inútil y sin energía.",
+    "Tengo ataques de pánico cuando viajo en transporte público.",
+    "Mis padres dicen que estoy muy irritable y que me aíslo.",
+    "No logro concentrarme en el trabajo y olvido cosas importantes.",
+    "Como de forma compulsiva cuando estoy estresado.",
+    "Me cuesta mucho relacionarme con mis compañeros de clase.",
+    "Tengo pensamientos negativos que no puedo controlar.",
+    "Desde la muerte de mi abuela no he vuelto a ser el mismo.",
+]
+
+ANTECEDENTES = [
+    "Refiere antecedentes familiares de depresión por línea materna.",
+    "No presenta antecedentes psiquiátricos previos.",
+    "Estuvo en tratamiento psicológico durante la adolescencia.",
+    "Consume alcohol los fines de semana en cantidad moderada.",
+    "Reporta consumo ocasional de cannabis.",
+    "Tiene diagnóstico previo de trastorno de ansiedad generalizada.",
+    "Vive con sus padres y dos hermanos menores.",
+    "Trabaja a tiempo parcial mientras termina sus estudios.",
+]
+
+EVOLUCION = [
+    "El paciente atribuye su malestar a la presión académica.",
+    "La paciente atribuye esta desmotivación a su frustración por no conseguir trabajo.",
+    "Los síntomas empeoraron en los últimos tres meses.",
+    "Se observa un estado de ánimo bajo y llanto fácil durante la entrevista.",
+    "Presenta insomnio de conciliación y fatiga diurna.",
+    "Muestra buena disposición para iniciar el tratamiento.",
+    "Se acuerdan sesiones semanales de terapia cognitivo-conductual.",
+    "Se sugiere evaluación psiquiátrica complementaria.",
+    "Se trabajan técnicas de respiración y reestructuración cognitiva.",
+    "Refiere mejoría parcial tras las primeras sesiones.",
+]
+
+
+def generate_case(rng, case_number=None):
+    """
+    Genera un caso clínico sintético.
+
+    Args:
+        rng (random.Random): Generador de números aleatorios.
+        case_number (int): Si se indica, se añade al nombre para que sea único.
+
+    Returns:
+        str: El texto del caso, que empieza con "Nombre:" como espera `segment_cases`.
+    """
+    iniciales = ".".join(rng.choice(LETRAS) for _ in range(3)) + "."
+    if case_number is not None:
+        iniciales += f" ({case_number})"
+    edad = rng.randint(16, 75)
+    motivo = rng.choice(MOTIVOS)
+    antecedentes = " ".join(rng.sample(ANTECEDENTES, rng.randint(1, 3)))
+    evolucion = " ".join(rng.sample(EVOLUCION, rng.randint(2, 5)))
+    return (
+        f"Nombre: {iniciales}\n"
+        f"Edad: {edad} años\n"
+        f"Motivo de consulta: '{motivo}'\n"
+        f"Antecedentes: {antecedentes}\n"
+        f"Evolución: {evolucion}"
+    )
+
+
+def generate_cases(num_cases, seed=0):
+    """
+    Genera `num_cases` casos sintéticos (siempre los mismos para la misma semilla).
+
+    Returns:
+        list: Los textos de los casos.
+    """
+    rng = random.Random(seed)
+    return [generate_case(rng, case_number=i) for i in range(num_cases)]
+
+
+def cases_to_text(cases):
+    """
+    Une los casos como quedarían al extraer el texto de un .docx (ver `segment_cases`).
+    """
+    return "\n".join(cases)
+
+
+def write_docx(cases, path):
+    """
+    Escribe los casos en un .docx, un párrafo por línea, como Casos.docx.
+    """
+    import docx
+
+    document = docx.Document()
+    for case in cases:
+        for line in case.split("\n"):
+            document.add_paragraph(line)
+    document.save(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera casos clínicos sintéticos.")
+    parser.add_argument("--num-cases", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="../data/casos_sinteticos.docx",
+                        help="Archivo .docx o .txt de salida.")
+    args = parser.parse_args()
+
+    cases = generate_cases(args.num_cases, seed=args.seed)
+    if args.output.endswith(".docx"):
+        write_docx(cases, args.output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(cases_to_text(cases))
+    print(f"{len(cases)} casos sintéticos guardados en {args.output}")
@@ -0,0 +1,264 @@
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+from context_packer import count_tokens
+
+# Instrumentación de las etapas del pipeline: cada etapa se mide con un span
+# (`with span("encode"): ...`). Cada span se acumula en un histograma de latencias
+# por etapa y, si se define TRACE_PATH, se escribe además como una línea JSON.
+# Los histogramas se exportan en el formato de texto de Prometheus.
+
+TRACE_PATH = os.getenv("TRACE_PATH")
+# TRACING=0 desactiva la instrumentación por completo.
+TRACING_ENABLED = os.getenv("TRACING", "1") != "0"
+
+# Límites superiores de los buckets (como en Prometheus, cada bucket incluye a los anteriores).
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+# El span activo en el hilo o tarea actual (para enlazar cada span con su padre).
+_current_span = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+
+
+class Histogram:
+    """
+    Histograma con buckets fijos: cuenta, suma y frecuencia por bucket.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Returns:
+            list: Pares (límite, observaciones <= límite), terminando en "+Inf".
+        """
+        total = 0
+        rows = []
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            rows.append((bound, total))
+        return rows
+
+
+class Span:
+    """
+    Un intervalo medido. Se usa como context manager; `set(**attrs)` añade datos
+    (p. ej. tokens) que se escriben en la traza.
+    """
+
+    __slots__ = ("tracer", "name", "attrs", "span_id", "parent", "trace_id", "start", "_token")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.span_id = next(_ids)
+        self.trace_id = self.parent.trace_id if self.parent is not None else self.span_id
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.finish(self, duration)
+        return False
+
+
+class _NoopSpan:
+    # Span vacío para cuando la instrumentación está desactivada.
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Acumula los spans en histogramas por etapa y, opcionalmente, los escribe en
+    un archivo JSON lines (un objeto por span).
+
+    El coste por span es un par de `perf_counter` y la actualización de un
+    histograma bajo un lock, así que puede quedar activado en producción. La
+    traza se escribe con buffer y se vacía al salir.
+    """
+
+    def __init__(self, path=None, enabled=True):
+        """
+        Args:
+            path (str): Archivo .jsonl donde se escriben los spans (None: solo histogramas).
+            enabled (bool): Si es False, `span` no mide nada.
+        """
+        self.enabled = enabled
+        self.latencies = {}
+        self.tokens = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if path and enabled:
+            self._file = open(path, "a", encoding="utf-8")
+            atexit.register(self.close)
+
+    def span(self, name, **attrs):
+        """
+        Mide un bloque: `with tracer.span("faiss_search", top_k=5) as s: ...`.
+        Los atributos `prompt_tokens` y `response_tokens` se acumulan también en
+        los histogramas de tokens.
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def finish(self, span, duration):
+        with self._lock:
+            histogram = self.latencies.get(span.name)
+            if histogram is None:
+                histogram = self.latencies[span.name] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+            for kind in ("prompt_tokens", "response_tokens"):
+                if span.attrs.get(kind) is not None:
+                    key = (span.name, kind)
+                    histogram = self.tokens.get(key)
+                    if histogram is None:
+                        histogram = self.tokens[key] = Histogram(TOKEN_BUCKETS)
+                    histogram.observe(span.attrs[kind])
+            if self._file is not None:
+                record = {
+                    "trace_id": span.trace_id,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent.span_id if span.parent is not None else None,
+                    "name": span.name,
+                    "start": time.time() - duration,
+                    "duration_ms": duration * 1000,
+                }
+                record.update(span.attrs)
+                self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def prometheus_text(self, prefix="rag"):
+        """
+        Los histogramas en el formato de texto de Prometheus:
+        `{prefix}_stage_seconds` por etapa y `{prefix}_tokens` por etapa y tipo.
+        """
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {prefix}_stage_seconds Latencia de cada etapa del pipeline.")
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for stage, histogram in sorted(self.latencies.items()):
+                lines.extend(_histogram_lines(f"{prefix}_stage_seconds", f'stage="{stage}"', histogram))
+            lines.append(f"# HELP {prefix}_tokens Tokens del prompt y de la respuesta por llamada al LLM.")
+            lines.append(f"# TYPE {prefix}_tokens histogram")
+            for (stage, kind), histogram in sorted(self.tokens.items()):
+                labels = f'stage="{stage}",kind="{kind.replace("_tokens", "")}"'
+                lines.extend(_histogram_lines(f"{prefix}_tokens", labels, histogram))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns:
+            dict: Por etapa, número de spans y latencia media en ms.
+        """
+        with self._lock:
+            return {stage: {"count": h.count, "mean_ms": 1000 * h.sum / h.count}
+                    for stage, h in self.latencies.items()}
+
+    def reset(self):
+        with self._lock:
+            self.latencies.clear()
+            self.tokens.clear()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _histogram_lines(metric, labels, histogram):
+    lines = []
+    for bound, count in histogram.cumulative():
+        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+    lines.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def percentile_ms(latencies, q):
+    """
+    Percentil `q` de una lista de latencias en segundos, en milisegundos.
+    """
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def message_tokens(message):
+    """
+    Tokens de una respuesta del LLM: los que informa el proveedor
+    (`usage_metadata`) o, si no los hay, una estimación por palabras.
+
+    Returns:
+        tuple: (tokens del prompt o None, tokens de la respuesta).
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    content = getattr(message, "content", message)
+    return None, count_tokens(content if isinstance(content, str) else str(content))
+
+
+# El tracer del proceso, compartido por todos los módulos.
+tracer = Tracer(path=TRACE_PATH, enabled=TRACING_ENABLED)
+
+
+def span(name, **attrs):
+    """
+    Atajo de `tracer.span` con el tracer del proceso.
+    """
+    return tracer.span(name, **attrs)
+
+
+if __name__ == "__main__":
+    demo = Tracer()
+    for i in range(3):
+        with demo.span("rag_pipeline"):
+            with demo.span("encode"):
+                time.sleep(0.002)
+            with demo.span("llm", prompt_tokens=120 * (i + 1)) as llm_span:
+                time.sleep(0.01)
+                llm_span.set(response_tokens=40)
+    print(demo.prometheus_text())